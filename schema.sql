@@ -14,7 +14,8 @@ CREATE TABLE IF NOT EXISTS ddz.user (
 
 CREATE TABLE IF NOT EXISTS ddz.record (
     id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
-    round JSON default {},
+    round JSON,
+    log BLOB,
     robot TINYINT(1) NOT NULL,
     last_modified DATETIME ON UPDATE CURRENT_TIMESTAMP
 );
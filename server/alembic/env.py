@@ -21,6 +21,10 @@ if config.config_file_name is not None:
 from models.base import Base
 target_metadata = Base.metadata
 
+# 和服务器使用同一个数据库
+from config import DATABASE_URI
+config.set_main_option('sqlalchemy.url', DATABASE_URI.replace('%', '%%'))
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -0,0 +1,66 @@
+"""record binary game log
+
+Revision ID: 2541b0bd756d
+Revises: a74154e5bd83
+Create Date: 2026-10-18 19:02:11.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from models import gamelog
+
+# revision identifiers, used by Alembic.
+revision = '2541b0bd756d'
+down_revision = 'a74154e5bd83'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+record = sa.table(
+    'record',
+    sa.column('id', sa.Integer),
+    sa.column('round', sa.JSON),
+    sa.column('log', sa.LargeBinary),
+)
+
+
+def upgrade() -> None:
+    op.add_column('record', sa.Column('log', sa.LargeBinary(), nullable=True))
+
+    # 按 id 分批把 JSON 转成 gamelog, 转换后清空 round
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(record.c.id, record.c.round)
+            .where(record.c.id > last_id, record.c.log.is_(None), record.c.round.isnot(None))
+            .order_by(record.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        for row_id, game in rows:
+            if game and 'left' in game:
+                conn.execute(record.update().where(record.c.id == row_id).values(log=gamelog.encode(game), round=sa.null()))
+        last_id = rows[-1].id
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(record.c.id, record.c.log)
+            .where(record.c.id > last_id, record.c.log.isnot(None))
+            .order_by(record.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        for row_id, log in rows:
+            conn.execute(record.update().where(record.c.id == row_id).values(round=gamelog.decode(log)))
+        last_id = rows[-1].id
+
+    op.drop_column('record', 'log')
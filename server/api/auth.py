@@ -1,12 +1,12 @@
 from typing import Optional, Awaitable
 
-from sqlalchemy import select
 from tornado.escape import json_encode
 from tornado.web import authenticated, RequestHandler
 
 from api.base import RestfulHandler, JwtMixin
 from api.game.globalvar import GlobalVar
-from models import User
+from api.game.worker import Worker, COOKIE as WORKER_COOKIE
+from models.usercache import user_cache
 
 
 class IndexHandler(RequestHandler):
@@ -26,19 +26,19 @@ class LoginHandler(RestfulHandler, JwtMixin):
 
     async def post(self):
         name = self.get_json_data()['name']
-        async with self.session as session:
-            async with session.begin():
-                account = await self.get_one_or_none(select(User).where(User.name == name))
-                if not account:
-                    account = User(openid=name, name=name, sex=1, avatar='')
-                    session.add(account)
-                    await session.commit()
-
-        account = account.to_dict()
+        account = await user_cache.get_by_name(name)
+        if not account:
+            account = await user_cache.upsert(openid=name, name=name, sex=1, avatar='', update=False)
+
+        # 玩家在某个 worker 的房间里时分配给那个 worker, 重连回原来的房间
+        worker, room_id = await GlobalVar.locate_player(account['uid'])
+        # 缓存里的用户信息不能修改, 复制一份再加上分配的 worker
+        account = {**account, 'worker': worker if worker != -1 else Worker.assign(self.current_user)}
         self.set_secure_cookie('userinfo', json_encode(account))
+        self.set_cookie(WORKER_COOKIE, str(account['worker']))
         self.write({
             **account,
-            'room': GlobalVar.find_player_room_id(account['uid']),
+            'room': room_id,
             'rooms': GlobalVar.room_list(),
             'token': self.jwt_encode(account)
         })
@@ -48,13 +48,13 @@ class UserInfoHandler(RestfulHandler):
 
     @authenticated
     async def get(self):
-        account: User = await self.get_one_or_none(select(User).where(User.id == self.current_user['uid']))
+        account = await user_cache.get_by_uid(self.current_user['uid'])
         if account:
-            account = account.to_dict()
             self.set_secure_cookie('user', json_encode(account))
+            _, room_id = await GlobalVar.locate_player(account['uid'])
             self.write({
                 **account,
-                'room': GlobalVar.find_player_room_id(account['uid']),
+                'room': room_id,
                 'rooms': GlobalVar.room_list()
             })
         else:
@@ -0,0 +1,255 @@
+import argparse
+import gc
+import hashlib
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from config import BASE_DIR, STATIC_ROOT
+from . import hand
+from .rule import Rule, rule
+from .table import RuleTable, load_table
+
+'''
+规则引擎的基准测试: 在固定种子生成的手牌和出牌上计时 rule 的热点函数, 结果写成 JSON, 和保存的基线比较
+
+    python -m api.game.benchmark                      # 和 benchmark.json 比较, 有变慢的项时退出码为 1
+    python -m api.game.benchmark --save               # 把这次的结果保存为基线
+    python -m api.game.benchmark --output result.json --tolerance 0.5
+
+find_best_shot/find_best_follow 使用不带缓存的 Rule, 计的是搜索本身
+from_pokers/to_cards/contains/contains_pokers 是引擎和出牌检查实际使用的打包手牌函数,
+is_contains/_to_cards 是保留的列表版本, 引擎已经不用, 只用于对照
+计时期间和 timeit 一样关闭 gc, 按多次重复的中位数比较
+结果里的 digest 是出牌结果的哈希, 和基线不同说明优化改变了机器人的出牌
+基线只在同一台机器上有意义: meta 里的 MACHINE_KEYS 和基线不同时只输出结果不比较, 换机器后先 --save
+'''
+
+BASELINE = os.path.join(BASE_DIR, 'benchmark.json')
+RULE_JSON = os.path.join(STATIC_ROOT, 'rule.json')
+RULE_BIN = os.path.join(STATIC_ROOT, 'rule.bin')
+
+Case = Tuple[List[int], List[int], bool, List[int]]
+# 这些都相同时才和基线比较; host 只做记录, 不同的机器之间靠 tolerance 吸收差异
+MACHINE_KEYS = ('machine', 'implementation', 'python')
+
+
+def make_corpus(seed: int, size: int) -> List[Case]:
+    """
+    :return: [(手牌, 上家出的牌, 是否队友, 手牌的一部分)]
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        deck = list(range(1, 55))
+        rng.shuffle(deck)
+        hand_pokers = deck[:rng.randint(1, 20)]
+        turn = rule.find_best_shot(deck[20:20 + rng.randint(1, 20)])
+        part = rng.sample(hand_pokers, rng.randint(1, len(hand_pokers)))
+        corpus.append((hand_pokers, turn, rng.random() < 0.5, part))
+    return corpus
+
+
+def make_benchmarks(corpus: List[Case]) -> Dict[str, Tuple[Callable[[], Any], int]]:
+    """
+    :return: name -> (跑一遍的函数, 一遍的调用次数)
+    """
+    engine = Rule(rule.table)
+    shots = [rule.find_best_shot(hand_pokers) for hand_pokers, _, _, _ in corpus]
+    shot_cards = [hand.to_cards(hand.from_pokers(shot)) for shot in shots]
+    packed_hands = [hand.from_pokers(hand_pokers) for hand_pokers, _, _, _ in corpus]
+    packed_subs = [(hand.from_pokers(turn), hand.from_pokers(part)) for _, turn, _, part in corpus]
+
+    def get_poker_spec():
+        for _, turn, _, part in corpus:
+            engine.get_poker_spec(turn)
+            engine.get_poker_spec(part)
+
+    def compare_pokers():
+        for shot, (_, turn, _, _) in zip(shots, corpus):
+            engine.compare_pokers(shot, turn)
+
+    def find_best_shot():
+        return [engine.find_best_shot(hand_pokers) for hand_pokers, _, _, _ in corpus]
+
+    def find_best_follow():
+        return [engine.find_best_follow(hand_pokers, turn, ally) for hand_pokers, turn, ally, _ in corpus]
+
+    def is_contains():
+        for hand_pokers, turn, _, part in corpus:
+            Rule.is_contains(hand_pokers, part)
+            Rule.is_contains(hand_pokers, turn)
+
+    def to_cards():
+        for hand_pokers, _, _, _ in corpus:
+            Rule._to_cards(hand_pokers)
+
+    def to_pokers():
+        for (hand_pokers, _, _, _), cards in zip(corpus, shot_cards):
+            Rule._to_pokers(hand_pokers, cards)
+
+    def from_pokers():
+        for hand_pokers, turn, _, _ in corpus:
+            hand.from_pokers(hand_pokers)
+            hand.from_pokers(turn)
+
+    def to_cards_packed():
+        for packed in packed_hands:
+            hand.to_cards(packed)
+
+    def contains():
+        for packed, (packed_turn, packed_part) in zip(packed_hands, packed_subs):
+            hand.contains(packed, packed_part)
+            hand.contains(packed, packed_turn)
+
+    def contains_pokers():
+        for hand_pokers, turn, _, part in corpus:
+            hand.contains_pokers(hand_pokers, part)
+            hand.contains_pokers(hand_pokers, turn)
+
+    def rule_load():
+        Rule(load_table(RULE_JSON, RULE_BIN))
+
+    def rule_load_json():
+        with open(RULE_JSON, 'rb') as f:
+            Rule(RuleTable.from_json(json.loads(f.read())))
+
+    size = len(corpus)
+    return {
+        'get_poker_spec': (get_poker_spec, size * 2),
+        'compare_pokers': (compare_pokers, size),
+        'find_best_shot': (find_best_shot, size),
+        'find_best_follow': (find_best_follow, size),
+        'is_contains': (is_contains, size * 2),
+        '_to_cards': (to_cards, size),
+        '_to_pokers': (to_pokers, size),
+        'from_pokers': (from_pokers, size * 2),
+        'to_cards': (to_cards_packed, size),
+        'contains': (contains, size * 2),
+        'contains_pokers': (contains_pokers, size * 2),
+        'rule_load': (rule_load, 1),
+        'rule_load_json': (rule_load_json, 1),
+    }
+
+
+def digest(corpus: List[Case]) -> str:
+    engine = Rule(rule.table)
+    sha = hashlib.sha256()
+    for hand_pokers, turn, ally, _ in corpus:
+        sha.update(bytes(engine.find_best_shot(hand_pokers)) + b'|')
+        sha.update(bytes(engine.find_best_follow(hand_pokers, turn, ally)) + b';')
+    return sha.hexdigest()
+
+
+def measure(func: Callable[[], Any], calls: int, repeat: int) -> Dict[str, float]:
+    """
+    先跑一遍预热, 再跑 repeat 遍, 取每次调用的最短和中位耗时
+    """
+    func()
+    times = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter_ns()
+            func()
+            times.append((time.perf_counter_ns() - start) / calls)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return {'calls': calls, 'repeat': repeat, 'min_ns': min(times), 'median_ns': statistics.median(times)}
+
+
+def run(seed: int = 0, size: int = 2000, repeat: int = 15, names: List[str] = ()) -> Dict[str, Any]:
+    corpus = make_corpus(seed, size)
+    results = {}
+    for name, (func, calls) in make_benchmarks(corpus).items():
+        if names and name not in names:
+            continue
+        results[name] = measure(func, calls, repeat)
+    return {
+        'meta': {
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'seed': seed,
+            'size': size,
+            'digest': digest(corpus),
+        },
+        'results': results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> Dict[str, Any]:
+    """
+    按 median_ns 比较, ratio 超过 1 + tolerance 为 slower, 低于 1 / (1 + tolerance) 为 faster
+    基线来自其他机器或其他 Python 时不比较耗时 (comparable 为 False), 只比较 digest
+    """
+    comparable = all(current['meta'].get(key) == baseline['meta'].get(key) for key in MACHINE_KEYS)
+    changes = {}
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if not base:
+            changes[name] = {'status': 'new'}
+            continue
+        if not comparable:
+            continue
+        ratio = result['median_ns'] / base['median_ns']
+        if ratio > 1 + tolerance:
+            status = 'slower'
+        elif ratio < 1 / (1 + tolerance):
+            status = 'faster'
+        else:
+            status = 'same'
+        changes[name] = {'status': status, 'ratio': ratio, 'baseline_ns': base['median_ns'],
+                         'median_ns': result['median_ns']}
+
+    same_corpus = all(current['meta'][key] == baseline['meta'].get(key) for key in ('seed', 'size'))
+    return {
+        'tolerance': tolerance,
+        'comparable': comparable,
+        'digest_changed': same_corpus and current['meta']['digest'] != baseline['meta'].get('digest'),
+        'changes': changes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m api.game.benchmark', description='rule engine benchmarks')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--size', type=int, default=2000, help='hands in the corpus')
+    parser.add_argument('--repeat', type=int, default=15)
+    parser.add_argument('--only', nargs='*', default=[], help='benchmark names')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    parser.add_argument('--output', default='', help='write results to this file')
+    parser.add_argument('--save', action='store_true', help='save results as the baseline')
+    args = parser.parse_args()
+
+    report = run(args.seed, args.size, args.repeat, args.only)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+
+    slower = False
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            report['compare'] = compare(report, json.load(f), args.tolerance)
+        slower = any(change['status'] == 'slower' for change in report['compare']['changes'].values())
+
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    sys.exit(1 if slower else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import orjson
+from tornado.httpclient import HTTPRequest
+from tornado.ioloop import IOLoop
+from tornado.web import create_signed_value, decode_signed_value
+from tornado.websocket import websocket_connect, WebSocketClientConnection, WebSocketClosedError
+
+from .timer import scheduler, TimerHandle
+
+'''
+集群模式: 多个节点放在普通的负载均衡后面, 节点之间通过 Bus 交换
+
+    node        心跳, 超过 3 个心跳周期没有消息的节点视为下线, 它的玩家和人数不再使用
+    presence    玩家所在的节点和房间, 按时间取最新; 玩家在其他节点的房间里时, 连接转发到那个节点
+    lobby       每个节点各等级的人数, 大厅人数是所有节点之和
+
+节点 id 是其他节点访问它的地址, 例如 ws://10.0.0.2:8080, 转发时连接 {node}/ws
+
+Bus 可以替换, 只需要 publish 和投递:
+    LocalBus    进程内投递, 用于测试
+    PeerBus     节点之间用 websocket 两两相连, 本节点的消息从主动建立的连接发出, 从 /cluster 收到其他节点的消息
+'''
+
+NODE = 'node'
+PRESENCE = 'presence'
+LOBBY = 'lobby'
+TOKEN_NAME = 'ddz_cluster'
+TOKEN_HEADER = 'X-Ddz-Cluster'
+
+
+class Bus(object):
+
+    def __init__(self):
+        self._subscribers: Dict[str, List[Callable[[Dict[str, Any]], None]]] = {}
+        # 连上新的节点时调用, 重新发布本节点的全部状态
+        self.on_peer: Optional[Callable[[], None]] = None
+        self.published = 0
+        self.received = 0
+
+    def subscribe(self, channel: str, callback: Callable[[Dict[str, Any]], None]):
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    def publish(self, channel: str, message: Dict[str, Any]):
+        raise NotImplementedError
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+    def receive(self, frame: bytes):
+        channel, message = orjson.loads(frame)
+        self.deliver(channel, message)
+
+    def deliver(self, channel: str, message: Dict[str, Any]):
+        self.received += 1
+        for callback in self._subscribers.get(channel, ()):
+            try:
+                callback(message)
+            except Exception:
+                logging.exception('CLUSTER %s MESSAGE FAILED: %s', channel, message)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'published': self.published, 'received': self.received}
+
+
+class LocalBus(Bus):
+    """
+    同一个 hub 里的 bus 互相收到对方的消息, 在下一轮 IOLoop 中投递
+    """
+
+    def __init__(self, hub: Optional[List['LocalBus']] = None):
+        super().__init__()
+        self.hub = hub if hub is not None else []
+        self.hub.append(self)
+
+    def publish(self, channel: str, message: Dict[str, Any]):
+        self.published += 1
+        frame = orjson.dumps([channel, message], option=orjson.OPT_NON_STR_KEYS)
+        for bus in self.hub:
+            if bus is not self:
+                IOLoop.current().add_callback(bus.receive, frame)
+
+    def start(self):
+        for bus in self.hub:
+            if bus is not self and bus.on_peer:
+                IOLoop.current().add_callback(bus.on_peer)
+
+    def close(self):
+        if self in self.hub:
+            self.hub.remove(self)
+
+
+class PeerBus(Bus):
+
+    def __init__(self, node: str, peers: List[str], secret: str, retry: float = 1.0):
+        super().__init__()
+        self.node = node
+        self.peers = [peer for peer in peers if peer != node]
+        self.secret = secret
+        self.retry = retry
+        self._conns: Dict[str, WebSocketClientConnection] = {}
+        self._closed = False
+
+    def publish(self, channel: str, message: Dict[str, Any]):
+        self.published += 1
+        frame = orjson.dumps([channel, message], option=orjson.OPT_NON_STR_KEYS)
+        for peer, conn in list(self._conns.items()):
+            try:
+                conn.write_message(frame, binary=True)
+            except WebSocketClosedError:
+                self._conns.pop(peer, None)
+
+    def start(self):
+        for peer in self.peers:
+            IOLoop.current().spawn_callback(self._connect, peer)
+
+    def close(self):
+        self._closed = True
+        for conn in self._conns.values():
+            conn.close()
+        self._conns.clear()
+
+    def verify(self, token: Optional[str]) -> Optional[str]:
+        node = decode_signed_value(self.secret, TOKEN_NAME, token, max_age_days=1) if token else None
+        return node.decode() if node else None
+
+    async def _connect(self, peer: str):
+        while not self._closed:
+            headers = {TOKEN_HEADER: create_signed_value(self.secret, TOKEN_NAME, self.node).decode()}
+            try:
+                conn = await websocket_connect(HTTPRequest(f'{peer}/cluster', headers=headers))
+            except Exception as e:
+                logging.warning('CLUSTER PEER %s UNAVAILABLE: %s', peer, e)
+                await asyncio.sleep(self.retry)
+                continue
+
+            self._conns[peer] = conn
+            logging.info('CLUSTER PEER %s CONNECTED', peer)
+            if self.on_peer:
+                self.on_peer()
+            # 这条连接只发不收, 读到 None 表示断开
+            while await conn.read_message() is not None:
+                pass
+            self._conns.pop(peer, None)
+            logging.warning('CLUSTER PEER %s DISCONNECTED', peer)
+            await asyncio.sleep(self.retry)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), 'peers': sorted(self._conns)}
+
+
+class Cluster(object):
+
+    def __init__(self):
+        self.node: Optional[str] = None
+        self.bus: Optional[Bus] = None
+        self.interval = 5.0
+        self.lobby_delay = 1.0
+        # node -> 最后一次收到消息的时间
+        self._nodes: Dict[str, float] = {}
+        # uid -> (node, room_id, 时间)
+        self._players: Dict[int, Tuple[str, int, float]] = {}
+        # 本节点发布过的 uid -> room_id
+        self._claimed: Dict[int, int] = {}
+        # node -> level -> 人数
+        self._lobby: Dict[str, Dict[int, int]] = {}
+        self._levels: Dict[int, int] = {}
+        self._lobby_handle: Optional[TimerHandle] = None
+        self._heartbeat_handle: Optional[TimerHandle] = None
+        self._on_lobby_changed: Callable[[], None] = lambda: None
+        self._on_moved: Callable[[int], None] = lambda uid: None
+
+    @property
+    def enabled(self) -> bool:
+        return self.bus is not None
+
+    def start(self, node: str, bus: Bus, interval: float = 5.0, on_lobby_changed: Callable[[], None] = None,
+              on_moved: Callable[[int], None] = None):
+        """
+        on_lobby_changed    其他节点的人数变化
+        on_moved            本节点的玩家在其他节点登录了
+        """
+        self.node = node
+        self.bus = bus
+        self.interval = interval
+        if on_lobby_changed:
+            self._on_lobby_changed = on_lobby_changed
+        if on_moved:
+            self._on_moved = on_moved
+        bus.subscribe(NODE, self._on_node)
+        bus.subscribe(PRESENCE, self._on_presence)
+        bus.subscribe(LOBBY, self._on_lobby)
+        bus.on_peer = self._publish_state
+        bus.start()
+        self._heartbeat()
+        logging.info('CLUSTER NODE %s STARTED', node)
+
+    def close(self):
+        if self._heartbeat_handle:
+            self._heartbeat_handle.cancel()
+        if self._lobby_handle:
+            self._lobby_handle.cancel()
+        if self.bus:
+            self.bus.close()
+            self.bus = None
+
+    def claim(self, uid: int, room_id: int = -1):
+        """
+        玩家连接到本节点或者换了房间, 只在变化时发布
+        """
+        if not self.enabled or self._claimed.get(uid) == room_id:
+            return
+        now = time.time()
+        self._claimed[uid] = room_id
+        self._players[uid] = (self.node, room_id, now)
+        self.bus.publish(PRESENCE, {'node': self.node, 'players': [[uid, room_id, now]]})
+
+    def release(self, uid: int):
+        """
+        玩家断开连接且不在房间里, 不再随心跳发布, 其他节点也删除 (room_id 为 None)
+        """
+        if not self.enabled or self._claimed.pop(uid, None) is None:
+            return
+        self._players.pop(uid, None)
+        self.bus.publish(PRESENCE, {'node': self.node, 'players': [[uid, None, time.time()]]})
+
+    def update_lobby(self, levels: Dict[int, int]):
+        """
+        本节点的人数变化, 合并 lobby_delay 秒内的变化再发布
+        """
+        if not self.enabled:
+            return
+        self._levels = dict(levels)
+        if self._lobby_handle is None:
+            self._lobby_handle = scheduler.call_later(self.lobby_delay, self._publish_lobby)
+
+    def route(self, uid: int) -> Optional[str]:
+        """
+        玩家在其他在线节点的房间里时返回该节点
+        """
+        entry = self._players.get(uid) if self.enabled else None
+        if entry is None:
+            return None
+        node, room_id, _ = entry
+        if node == self.node or room_id == -1 or not self.is_alive(node):
+            return None
+        return node
+
+    def player_room(self, uid: int) -> int:
+        entry = self._players.get(uid)
+        if entry is None or not self.is_alive(entry[0]):
+            return -1
+        return entry[1]
+
+    def remote_levels(self) -> Dict[int, int]:
+        levels: Dict[int, int] = {}
+        for node, counts in self._lobby.items():
+            if self.is_alive(node):
+                for level, count in counts.items():
+                    levels[level] = levels.get(level, 0) + count
+        return levels
+
+    def is_alive(self, node: str) -> bool:
+        if node == self.node:
+            return True
+        last_seen = self._nodes.get(node)
+        return last_seen is not None and time.monotonic() - last_seen < self.interval * 3
+
+    def stats(self) -> Dict[str, Any]:
+        if not self.enabled:
+            return {'enabled': False}
+        return {
+            'enabled': True,
+            'node': self.node,
+            'nodes': sorted(node for node in self._nodes if self.is_alive(node)),
+            'players': len(self._players),
+            'local_players': len(self._claimed),
+            'remote_levels': self.remote_levels(),
+            'bus': self.bus.stats(),
+        }
+
+    def _heartbeat(self):
+        self.bus.publish(NODE, {'node': self.node})
+        self._purge()
+        self._heartbeat_handle = scheduler.call_later(self.interval, self._heartbeat)
+
+    def _purge(self):
+        dead = [node for node in self._nodes if not self.is_alive(node)]
+        for node in dead:
+            del self._nodes[node]
+            logging.warning('CLUSTER NODE %s DOWN', node)
+        if dead:
+            self._players = {uid: entry for uid, entry in self._players.items() if entry[0] not in dead}
+            if any(self._lobby.pop(node, None) for node in dead):
+                self._on_lobby_changed()
+
+    def _publish_lobby(self):
+        self._lobby_handle = None
+        if self.enabled:
+            self.bus.publish(LOBBY, {'node': self.node, 'levels': self._levels})
+
+    def _publish_state(self):
+        players = [[uid, room_id, self._players[uid][2]] for uid, room_id in self._claimed.items()]
+        self.bus.publish(NODE, {'node': self.node})
+        self.bus.publish(PRESENCE, {'node': self.node, 'players': players})
+        self.bus.publish(LOBBY, {'node': self.node, 'levels': self._levels})
+
+    def _seen(self, node: str):
+        if node not in self._nodes:
+            logging.info('CLUSTER NODE %s UP', node)
+        self._nodes[node] = time.monotonic()
+
+    def _on_node(self, message: Dict[str, Any]):
+        self._seen(message['node'])
+
+    def _on_presence(self, message: Dict[str, Any]):
+        node = message['node']
+        self._seen(node)
+        for uid, room_id, ts in message['players']:
+            entry = self._players.get(uid)
+            if entry and entry[2] > ts:
+                continue
+            if room_id is None:
+                if entry and entry[0] == node:
+                    del self._players[uid]
+                continue
+            self._players[uid] = (node, room_id, ts)
+            if self._claimed.pop(uid, None) is not None:
+                self._on_moved(uid)
+
+    def _on_lobby(self, message: Dict[str, Any]):
+        self._seen(message['node'])
+        self._lobby[message['node']] = {int(level): count for level, count in message['levels'].items()}
+        self._on_lobby_changed()
+
+
+cluster = Cluster()
@@ -0,0 +1,99 @@
+import json
+import logging
+import struct
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import orjson
+
+from .protocol import Protocol as Pt
+
+'''
+二进制协议, 通过 websocket 子协议 ddz.bin.v1 启用, 默认仍使用 JSON
+
+    header  uint16 code, 最高位为 1 表示消息体是 JSON
+    body    固定布局的字段(小端), 牌放在最后: uint8 张数 + 每张牌 1 字节
+'''
+
+HEADER = struct.Struct('<H')
+JSON_BODY = 0x8000
+
+# code -> (固定字段布局, 字段名, 牌的字段名)
+LAYOUTS: Dict[int, Tuple[struct.Struct, Tuple[str, ...], Optional[str]]] = {
+    Pt.REQ_JOIN_ROOM: (struct.Struct('<iB'), ('room', 'level'), None),
+    Pt.REQ_READY: (struct.Struct('<B'), ('ready',), None),
+    Pt.RSP_READY: (struct.Struct('<IB'), ('uid', 'ready'), None),
+    Pt.RSP_LEAVE_ROOM: (struct.Struct('<I'), ('uid',), None),
+    Pt.RSP_DEAL_POKER: (struct.Struct('<IHB'), ('uid', 'timer'), 'pokers'),
+    Pt.REQ_CALL_SCORE: (struct.Struct('<b'), ('rob',), None),
+    Pt.RSP_CALL_SCORE: (struct.Struct('<IbiIB'), ('uid', 'rob', 'landlord', 'multiple'), 'pokers'),
+    Pt.REQ_SHOT_POKER: (struct.Struct('<B'), (), 'pokers'),
+    Pt.RSP_SHOT_POKER: (struct.Struct('<IIB'), ('uid', 'multiple'), 'pokers'),
+}
+
+Message = List[Union[Pt, Dict[str, Any]]]
+
+
+class JsonCodec(object):
+    name = 'json'
+    binary = False
+
+    @staticmethod
+    def encode(message: Message) -> bytes:
+        return orjson.dumps(message)
+
+    @staticmethod
+    def decode(message: Union[str, bytes]) -> Tuple[Optional[int], Optional[Dict[str, Any]]]:
+        try:
+            code, packet = json.loads(message)
+            if isinstance(code, int) and isinstance(packet, dict):
+                return code, packet
+        except (json.decoder.JSONDecodeError, ValueError, TypeError):
+            logging.error('ERROR MESSAGE: %s', message)
+        return None, None
+
+
+class BinaryCodec(object):
+    name = 'ddz.bin.v1'
+    binary = True
+
+    @staticmethod
+    def encode(message: Message) -> bytes:
+        code, packet = message
+        layout = LAYOUTS.get(code)
+        if layout:
+            fmt, fields, pokers_field = layout
+            try:
+                values = [packet[field] for field in fields]
+                if pokers_field is None:
+                    return HEADER.pack(code) + fmt.pack(*values)
+                pokers = packet[pokers_field]
+                return HEADER.pack(code) + fmt.pack(*values, len(pokers)) + bytes(pokers)
+            except (KeyError, TypeError, ValueError, struct.error):
+                pass
+        return HEADER.pack(code | JSON_BODY) + orjson.dumps(packet)
+
+    @staticmethod
+    def decode(message: Union[str, bytes]) -> Tuple[Optional[int], Optional[Dict[str, Any]]]:
+        if isinstance(message, str):
+            return JsonCodec.decode(message)
+        try:
+            code, = HEADER.unpack_from(message)
+            if code & JSON_BODY:
+                packet = orjson.loads(message[HEADER.size:])
+                if isinstance(packet, dict):
+                    return code & ~JSON_BODY, packet
+                return None, None
+
+            fmt, fields, pokers_field = LAYOUTS[code]
+            values = fmt.unpack_from(message, HEADER.size)
+            packet = dict(zip(fields, values))
+            if pokers_field is not None:
+                offset = HEADER.size + fmt.size
+                packet[pokers_field] = list(message[offset: offset + values[-1]])
+            return code, packet
+        except (KeyError, ValueError, struct.error, orjson.JSONDecodeError):
+            logging.error('ERROR MESSAGE: %s', message)
+        return None, None
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec, BinaryCodec)}
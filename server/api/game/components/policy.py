@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+from typing import List, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from ..round import RoundMixin
+
+'''
+机器人的策略, 不涉及 IOLoop, RobotPlayer 和模拟器共用
+'''
+
+ROB_POKERS = (54, 53, 2, 15, 28, 41)
+
+
+def want_rob(hand_pokers: List[int]) -> int:
+    """
+    大小王和 2 合计 4 张以上才抢地主
+    """
+    return int(sum(1 for poker in ROB_POKERS if poker in hand_pokers) >= 4)
+
+
+def is_free_shot(room: RoundMixin, seat: int) -> bool:
+    return not room.last_shot_poker or room.last_shot_seat == seat
+
+
+def is_ally(room: RoundMixin) -> bool:
+    return room.players[room.last_shot_seat].landlord == 0
+
+
+def should_pass(room: RoundMixin, hand_pokers: List[int]) -> bool:
+    """
+    队友快出完时, 自己手里的牌还多就不压
+    """
+    left_pokers = len(room.players[room.last_shot_seat].hand_pokers)
+    return is_ally(room) and left_pokers <= 4 and len(hand_pokers) - len(room.last_shot_poker) > 4
+
+
+def keep_rocket(room: RoundMixin, pokers: List[int]) -> List[int]:
+    """
+    上家手里的牌还多时不用王炸跟牌
+    """
+    if 53 in pokers and 54 in pokers and len(room.players[room.last_shot_seat].hand_pokers) > 10:
+        return []
+    return pokers
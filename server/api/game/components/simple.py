@@ -4,15 +4,18 @@ from typing import TYPE_CHECKING
 
 from tornado.ioloop import IOLoop
 
+from ..decision import Decision
 from ..player import Player
 from ..protocol import Protocol as Pt
-from ..rule import rule
+from ..timer import scheduler
+from .policy import want_rob, is_free_shot, is_ally, should_pass, keep_rocket
 
 if TYPE_CHECKING:
     from ..room import Room
 
 
 class RobotPlayer(Player):
+    is_robot = True
 
     def __init__(self, uid: int, name: str, sex: int = 1, avatar: str = 0, room: Room = None, **kwargs):
         super().__init__(uid, name, sex, avatar, **kwargs)
@@ -23,7 +26,10 @@ class RobotPlayer(Player):
         return True
 
     def to_server(self, code, packet):
-        IOLoop.current().add_callback(self.on_message, code, packet)
+        if self.room:
+            self.room.inbox.submit(self.on_message, code, packet)
+        else:
+            IOLoop.current().add_callback(self.on_message, code, packet)
 
     def write_message(self, packet):
         IOLoop.current().add_callback(self._write_message, packet)
@@ -41,32 +47,29 @@ class RobotPlayer(Player):
                 if landlord == -1:
                     self.auto_rob()
                 elif self.room.turn_player == self:
-                    IOLoop.current().call_later(1, self.auto_shot)
+                    scheduler.call_later(1, self.auto_shot)
         elif code == Pt.RSP_SHOT_POKER:
             if self.room.turn_player == self and self.hand_pokers:
-                self.auto_shot()
+                IOLoop.current().add_callback(self.auto_shot)
         elif code == Pt.RSP_GAME_OVER:
-            IOLoop.current().call_later(5, self.auto_ready)
+            scheduler.call_later(5, self.auto_ready)
 
     def auto_ready(self):
         IOLoop.current().add_callback(self.to_server, Pt.REQ_READY, {'ready': 1})
 
     def auto_rob(self):
-        pokers = [poker for poker in (54, 53, 2, 15, 28, 41) if poker in self.hand_pokers]
-        rob = int(len(pokers) >= 4)
-        IOLoop.current().call_later(1.5, self.to_server, Pt.REQ_CALL_SCORE, {'rob': rob})
+        scheduler.call_later(1.5, self.to_server, Pt.REQ_CALL_SCORE, {'rob': want_rob(self.hand_pokers)})
 
-    def auto_shot(self):
-        if not self.room.last_shot_poker or self.room.last_shot_seat == self.seat:
-            pokers = rule.find_best_shot(self.hand_pokers)
+    async def auto_shot(self):
+        start = IOLoop.current().time()
+        if is_free_shot(self.room, self.seat):
+            pokers = await Decision.find_best_shot(self.hand_pokers)
+        elif should_pass(self.room, self.hand_pokers):
+            pokers = []
         else:
-            ally = self.room.players[self.room.last_shot_seat].landlord == 0
-            left_pokers = len(self.room.players[self.room.last_shot_seat].hand_pokers)
-            if ally and left_pokers <= 4 and len(self.hand_pokers) - len(self.room.last_shot_poker) > 4:
-                pokers = []
-            else:
-                pokers = rule.find_best_follow(self.hand_pokers, self.room.last_shot_poker, ally)
-                if 53 in pokers and 54 in pokers and left_pokers > 10:
-                    pokers = []
+            pokers = await Decision.find_best_follow(self.hand_pokers, self.room.last_shot_poker, is_ally(self.room))
+            pokers = keep_rocket(self.room, pokers)
 
-        IOLoop.current().call_later(2, self.to_server, Pt.REQ_SHOT_POKER, {'pokers': pokers})
+        # 思考时间里扣除计算耗时
+        delay = max(2 - (IOLoop.current().time() - start), 0)
+        scheduler.call_later(delay, self.to_server, Pt.REQ_SHOT_POKER, {'pokers': pokers})
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .round import poker_order
+from .rule import rule
+
+
+def preload():
+    """
+    子进程初始化: 规则表在 fork 前已加载, 这里只确认可用, 不重复解析
+    """
+    rule.index.get(0)
+
+
+def find_best_shot(hand_pokers: List[int]) -> List[int]:
+    return rule.find_best_shot(hand_pokers)
+
+
+def find_best_follow(hand_pokers: List[int], turn_pokers: List[int], ally: bool) -> List[int]:
+    return rule.find_best_follow(hand_pokers, turn_pokers, ally)
+
+
+def smallest_shot(hand_pokers: List[int]) -> List[int]:
+    return [min(hand_pokers, key=poker_order)]
+
+
+def no_follow(hand_pokers: List[int], turn_pokers: List[int], ally: bool) -> List[int]:
+    return []
+
+
+def call(func: Callable, *args) -> Tuple[Any, int, Dict[str, Dict[str, Any]]]:
+    """
+    在决策进程中执行, 同时带回该进程的决策缓存统计
+    """
+    return func(*args), os.getpid(), rule.cache_info()
+
+
+class Decision(object):
+    """
+    机器人和托管出牌的计算, 放到进程池里执行, 不阻塞 IOLoop
+    超时时不再等待结果, 改用不需要搜索的出牌: 主动出牌时出最小的单张, 跟牌时不出
+    进程池不可用时在当前进程内计算
+    """
+    executor: Optional[ProcessPoolExecutor] = None
+    timeout: float = 1.0
+    timeouts: int = 0
+    # 每个决策进程最近一次带回的缓存统计
+    caches: Dict[int, Dict[str, Dict[str, Any]]] = {}
+
+    @classmethod
+    def start(cls, workers: int, timeout: float = 1.0) -> Optional[ProcessPoolExecutor]:
+        cls.timeout = timeout
+        if workers > 0:
+            cls.executor = ProcessPoolExecutor(workers, initializer=preload)
+        return cls.executor
+
+    @classmethod
+    def shutdown(cls):
+        if cls.executor:
+            cls.executor.shutdown(wait=False)
+            cls.executor = None
+
+    @classmethod
+    async def find_best_shot(cls, hand_pokers: List[int]) -> List[int]:
+        return await cls._run(find_best_shot, smallest_shot, hand_pokers)
+
+    @classmethod
+    async def find_best_follow(cls, hand_pokers: List[int], turn_pokers: List[int], ally=True) -> List[int]:
+        return await cls._run(find_best_follow, no_follow, hand_pokers, turn_pokers, ally)
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        pool = {}
+        for info in cls.caches.values():
+            for name, counts in info.items():
+                merged = pool.setdefault(name, {'hits': 0, 'misses': 0, 'size': 0})
+                for key in merged:
+                    merged[key] += counts[key]
+        for merged in pool.values():
+            total = merged['hits'] + merged['misses']
+            merged['hit_rate'] = merged['hits'] / total if total else 0.0
+        return {
+            'workers': len(cls.caches),
+            'timeouts': cls.timeouts,
+            'cache': {'main': rule.cache_info(), 'pool': pool},
+        }
+
+    @classmethod
+    async def _run(cls, func, fallback, *args):
+        if cls.executor:
+            try:
+                future = asyncio.get_event_loop().run_in_executor(cls.executor, call, func, *args)
+                result, pid, cls.caches[pid] = await asyncio.wait_for(future, cls.timeout)
+                return result
+            except asyncio.TimeoutError:
+                # wait_for 已取消 future, 已经在执行的计算会继续, 结果丢弃
+                cls.timeouts += 1
+                logging.warning('DECISION %s TIMEOUT %s', func.__name__, args)
+                return fallback(*args)
+            except BrokenProcessPool:
+                logging.exception('DECISION POOL BROKEN')
+                cls.executor = None
+        return func(*args)
@@ -0,0 +1,116 @@
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+from tornado.websocket import WebSocketHandler, WebSocketProtocol, WebSocketProtocol13, _WebSocketParams, \
+    _PerMessageDeflateCompressor, _PerMessageDeflateDecompressor
+
+'''
+permessage-deflate 压缩策略
+
+    threshold           小于该字节数的消息不压缩, 直接发送(RSV1 不置位)
+    compression_level   zlib 压缩级别
+    mem_level           zlib 内部状态大小, 每级翻倍
+    max_wbits           滑动窗口, 小于客户端协商的值时客户端仍可解压
+    no_context_takeover 每条消息单独压缩, 消息之间不保留 zlib 状态
+
+服务端窗口和是否保留上下文只影响本端压缩, 不需要客户端协商
+
+tornado 的公开接口只能设置 compression_level 和 mem_level, 其余策略依赖 tornado 的内部实现
+(WebSocketProtocol13, _PerMessageDeflateCompressor, _WebSocketParams), 只在这个模块里使用;
+requirements.txt 固定了 tornado 的版本, 升级时 tests/test_deflate.py 检查这些内部接口是否变化
+'''
+
+NEGOTIABLE = ('server_no_context_takeover', 'client_no_context_takeover', 'server_max_window_bits', 'client_max_window_bits')
+
+
+class DeflateStats(object):
+    """
+    压缩统计: 节省的字节数和压缩耗费的时间, 用于调整每个连接的内存
+    """
+    messages = 0
+    compressed = 0
+    skipped = 0
+    bytes_in = 0
+    bytes_out = 0
+    cpu_time = 0.0
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        return {
+            'messages': cls.messages,
+            'compressed': cls.compressed,
+            'skipped': cls.skipped,
+            'bytes_in': cls.bytes_in,
+            'bytes_out': cls.bytes_out,
+            'bytes_saved': cls.bytes_in - cls.bytes_out,
+            'cpu_time': cls.cpu_time,
+            'us_per_message': cls.cpu_time / cls.compressed * 1e6 if cls.compressed else 0.0,
+        }
+
+
+class DeflateCompressor(_PerMessageDeflateCompressor):
+
+    def compress(self, data: bytes) -> bytes:
+        start = time.perf_counter()
+        compressed = super().compress(data)
+        DeflateStats.cpu_time += time.perf_counter() - start
+        DeflateStats.compressed += 1
+        DeflateStats.bytes_in += len(data)
+        DeflateStats.bytes_out += len(compressed)
+        return compressed
+
+
+class DeflateProtocol(WebSocketProtocol13):
+    """
+    按压缩策略发送消息的 websocket 连接, 策略放在 compression_options 里
+    """
+
+    @classmethod
+    def create(cls, handler: WebSocketHandler) -> Optional[WebSocketProtocol]:
+        """
+        用于 WebSocketHandler.get_websocket_protocol, 和 tornado 的实现相同, 只是换成本类
+        """
+        if handler.request.headers.get('Sec-WebSocket-Version') not in ('7', '8', '13'):
+            return None
+        params = _WebSocketParams(
+            ping_interval=handler.ping_interval,
+            ping_timeout=handler.ping_timeout,
+            max_message_size=handler.max_message_size,
+            compression_options=handler.get_compression_options(),
+        )
+        return cls(handler, False, params)
+
+    def write_message(self, message, binary: bool = False):
+        DeflateStats.messages += 1
+        compressor = self._compressor
+        threshold = self._compression_options.get('threshold', 0) if self._compression_options else 0
+        if compressor is None or len(message) >= threshold:
+            return super().write_message(message, binary)
+
+        # 压缩在写入前同步完成, 临时去掉压缩器只影响这一条消息
+        DeflateStats.skipped += 1
+        self._compressor = None
+        try:
+            return super().write_message(message, binary)
+        finally:
+            self._compressor = compressor
+
+    def _create_compressors(self, side: str, agreed_parameters: Dict[str, Any],
+                            compression_options: Optional[Dict[str, Any]] = None) -> None:
+        for key in agreed_parameters:
+            if key not in NEGOTIABLE:
+                raise ValueError('unsupported compression parameter %r' % key)
+
+        options = self._get_compressor_options(side, agreed_parameters, compression_options)
+        if compression_options:
+            options['max_wbits'] = min(options['max_wbits'], compression_options.get('max_wbits', zlib.MAX_WBITS))
+            if compression_options.get('no_context_takeover'):
+                options['persistent'] = False
+        self._compressor = DeflateCompressor(**options)
+
+        other_side = 'client' if side == 'server' else 'server'
+        self._decompressor = _PerMessageDeflateDecompressor(
+            max_message_size=self.params.max_message_size,
+            **self._get_compressor_options(other_side, agreed_parameters, compression_options)
+        )
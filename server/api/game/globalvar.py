@@ -1,25 +1,68 @@
+import asyncio
 import logging
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 
-from .player import Player
+from .cluster import cluster
+from .codec import JsonCodec
+from .player import Player, State
+from .protocol import Protocol
 from .room import Room
+from .timer import scheduler
+from .worker import Worker
 
 
 class GlobalVar(object):
     total_room_count = 0
+    # 多进程时每个 worker 的房间号按 worker 数间隔, 互不重复
+    room_id_step = 1
     __players__: Dict[int, Player] = {}
     __waiting_rooms__: Dict[int, Room] = {}
     __playing_rooms__: Dict[int, Room] = {}
+    # level -> 有空位且没有机器人的等待房间, 按创建顺序
+    __open_rooms__: Dict[int, Dict[int, Room]] = {}
+    # level -> 房间内的玩家数, 房间人数变化时增量更新, 只有真实人数, 会发布给其他节点
+    __level_players__: Dict[int, int] = {1: 0, 2: 0, 3: 0}
+    # level -> 大厅额外显示的人数, 只在生成列表时加一次
+    LOBBY_OFFSET: Dict[int, int] = {1: 33}
+    __room_players__: Dict[int, int] = {}
+    __room_list__: Optional[List[Dict[str, int]]] = None
+    __room_list_message__: Dict[str, bytes] = {}
+    # 生成大厅列表时其他 worker 的人数
+    __room_list_version__: Optional[bytes] = None
 
     @classmethod
-    def room_list(cls):
-        rooms = {1: 33, 2: 0, 3: 0}
-        for room in cls.__playing_rooms__.values():
-            if room.level in rooms:
-                rooms[room.level] += 3
-            else:
-                rooms[room.level] = 0
-        return [{'level': k, 'number': v} for k, v in rooms.items()]
+    def room_list(cls) -> List[Dict[str, int]]:
+        cls._check_remote_levels()
+        if cls.__room_list__ is None:
+            levels = dict(cls.__level_players__)
+            for remote in (Worker.remote_levels(), cluster.remote_levels()):
+                for level, number in remote.items():
+                    levels[level] = levels.get(level, 0) + number
+            for level, number in cls.LOBBY_OFFSET.items():
+                levels[level] = levels.get(level, 0) + number
+            cls.__room_list__ = [{'level': k, 'number': v} for k, v in levels.items()]
+        return cls.__room_list__
+
+    @classmethod
+    def invalidate_room_list(cls):
+        cls.__room_list__ = None
+        cls.__room_list_message__ = {}
+
+    @classmethod
+    def _check_remote_levels(cls):
+        version = Worker.levels_version()
+        if version != cls.__room_list_version__:
+            cls.__room_list_version__ = version
+            cls.invalidate_room_list()
+
+    @classmethod
+    def room_list_message(cls, codec=JsonCodec) -> bytes:
+        cls._check_remote_levels()
+        message = cls.__room_list_message__.get(codec.name)
+        if message is None:
+            message = codec.encode([Protocol.RSP_ROOM_LIST, {'rooms': cls.room_list()}])
+            cls.__room_list_message__[codec.name] = message
+        return message
 
     @classmethod
     def find_player(cls, uid: int, *args, **kwargs) -> Player:
@@ -29,22 +72,94 @@ class GlobalVar(object):
 
     @classmethod
     def find_player_room_id(cls, uid: int) -> int:
+        """
+        只查本 worker 的房间
+        """
         player = cls.__players__.get(uid)
         if player and player.room:
             return player.room.room_id
         return -1
 
+    @classmethod
+    async def locate_player(cls, uid: int) -> Tuple[int, int]:
+        """
+        玩家所在的 worker 和房间号, 本 worker 没有时询问其他 worker, 都没有时 worker 为 -1, 房间号取集群中的
+        """
+        room_id = cls.find_player_room_id(uid)
+        if room_id != -1:
+            return Worker.index, room_id
+        if Worker.is_multi():
+            worker, room_id = await Worker.find_room(uid)
+            if worker != -1:
+                return worker, room_id
+        return -1, cluster.player_room(uid)
+
     @classmethod
     def remove_player(cls, uid: int):
         cls.__players__.pop(uid, None)
 
+    @classmethod
+    def on_player_moved(cls, uid: int):
+        """
+        集群中玩家在其他节点登录了, 不在房间里时删除本节点的玩家
+        """
+        player = cls.__players__.get(uid)
+        if player and not player.room:
+            cls.remove_player(uid)
+
+    @classmethod
+    def on_player_left(cls, player: Player):
+        if player.is_robot:
+            return
+        # 断开连接后离开房间的玩家不再属于本节点
+        if player.is_left():
+            cluster.release(player.uid)
+        else:
+            cluster.claim(player.uid, -1)
+
     @classmethod
     def new_room(cls, level: int, allow_robot: bool) -> Room:
         room = Room(cls.gen_room_id(), level, allow_robot)
         cls.__waiting_rooms__[room.room_id] = room
+        cls._update_open_room(room)
         logging.info('ROOM[%s] CREATED', room)
         return room
 
+    @classmethod
+    def restore_room(cls, room: Room):
+        cls.total_room_count = max(cls.total_room_count, room.room_id)
+        for player in room.players:
+            if player and not player.is_robot:
+                cls.__players__[player.uid] = player
+        cls.__waiting_rooms__[room.room_id] = room
+        cls.on_room_changed(room)
+
+    @classmethod
+    def detach_room(cls, room: Room):
+        """
+        房间移到其他进程时从本进程删除, 真人玩家也一起删除
+        """
+        room.timer.stop_timing()
+        cls.__waiting_rooms__.pop(room.room_id, None)
+        cls.__playing_rooms__.pop(room.room_id, None)
+        cls.__open_rooms__.get(room.level, {}).pop(room.room_id, None)
+        size = cls.__room_players__.pop(room.room_id, 0)
+        if size:
+            cls.__level_players__[room.level] = cls.__level_players__.get(room.level, 0) - size
+            cls._on_levels_changed()
+        for player in room.players:
+            if player and not player.is_robot:
+                player.room = None
+                cls.remove_player(player.uid)
+
+    @classmethod
+    def get_room(cls, room_id: int) -> Optional[Room]:
+        return cls.__waiting_rooms__.get(room_id) or cls.__playing_rooms__.get(room_id)
+
+    @classmethod
+    def rooms(cls) -> List[Room]:
+        return [*cls.__waiting_rooms__.values(), *cls.__playing_rooms__.values()]
+
     @classmethod
     def find_room(cls, room_id: int, level: int, allow_robot: bool) -> Room:
         if room_id in cls.__waiting_rooms__:
@@ -53,10 +168,9 @@ class GlobalVar(object):
         if room_id in cls.__playing_rooms__:
             return cls.__playing_rooms__[room_id]
 
-        for _, room in cls.__waiting_rooms__.items():
-            if room.level != level or room.has_robot():
-                continue
-            return room
+        rooms = cls.__open_rooms__.get(level)
+        if rooms:
+            return next(iter(rooms.values()))
         return cls.new_room(level, allow_robot)
 
     @classmethod
@@ -69,10 +183,105 @@ class GlobalVar(object):
             cls.__waiting_rooms__.pop(room.room_id, None)
             cls.__playing_rooms__.pop(room.room_id, None)
             logging.info('Room[%s] CLOSED', room)
+        for player in room.players:
+            if player and not player.is_robot:
+                cluster.claim(player.uid, room.room_id)
+        cls._update_open_room(room)
+        cls._update_room_players(room)
+
+    @classmethod
+    def _update_room_players(cls, room: Room):
+        size = sum(1 for p in room.players if p and not p.is_robot)
+        delta = size - cls.__room_players__.get(room.room_id, 0)
+        if size:
+            cls.__room_players__[room.room_id] = size
+        else:
+            cls.__room_players__.pop(room.room_id, None)
+        if delta:
+            cls.__level_players__[room.level] = cls.__level_players__.get(room.level, 0) + delta
+            cls._on_levels_changed()
+
+    @classmethod
+    def _on_levels_changed(cls):
+        cls.invalidate_room_list()
+        Worker.publish_levels(cls.__level_players__)
+        cluster.update_lobby(cls.__level_players__)
+
+    @classmethod
+    def _update_open_room(cls, room: Room):
+        rooms = cls.__open_rooms__.setdefault(room.level, {})
+        if room.room_id in cls.__waiting_rooms__ and not room.is_full() and not room.has_robot():
+            rooms.setdefault(room.room_id, room)
+        else:
+            rooms.pop(room.room_id, None)
+
+    @classmethod
+    def start_matcher(cls, interval: float):
+        """
+        定时把同一等级的等待玩家合并成满桌, 在机器人加入(10秒)之前完成
+        """
+        scheduler.call_later(interval, cls._on_match_interval, interval)
+
+    @classmethod
+    async def _on_match_interval(cls, interval: float):
+        try:
+            await cls.match_rooms()
+        finally:
+            scheduler.call_later(interval, cls._on_match_interval, interval)
+
+    @classmethod
+    async def match_rooms(cls):
+        for level, rooms in list(cls.__open_rooms__.items()):
+            candidates = [room for room in rooms.values() if cls._is_matchable(room)]
+            candidates.sort(key=lambda r: r.size(), reverse=True)
+            i, j = 0, len(candidates) - 1
+            while i < j:
+                target, source = candidates[i], candidates[j]
+                # 先处理完两个房间已经收到的消息, 移动期间暂停队列, 房间的修改仍然按顺序执行
+                await asyncio.gather(target.inbox.drain(), source.inbox.drain())
+                try:
+                    if cls._is_matchable(target) and cls._is_matchable(source) and not target.is_full():
+                        cls._move_players(source, target)
+                finally:
+                    target.inbox.resume()
+                    source.inbox.resume()
+                if target.is_full() or not cls._is_matchable(target):
+                    i += 1
+                if source.is_empty() or not cls._is_matchable(source):
+                    j -= 1
+
+    @classmethod
+    def _move_players(cls, source: Room, target: Room):
+        for player in [p for p in source.players if p]:
+            if target.is_full():
+                break
+            source.players[player.seat] = None
+            player.room = target
+            target.on_join(player, robot=False)
+            # 暂停期间收到的该玩家的消息交给新房间处理
+            source.inbox.transfer(target.inbox, player)
+            logging.info('PLAYER[%s] MATCH ROOM[%d] -> ROOM[%d]', player.uid, source.room_id, target.room_id)
+        cls.on_room_changed(source)
+        cls.on_room_changed(target)
+        # 移走的、移入的和原来就在的玩家都要看到新的座位
+        source.sync_room()
+        target.sync_room()
+        if target.is_full():
+            cls._on_matched(target)
+
+    @staticmethod
+    def _is_matchable(room: Room) -> bool:
+        return not room.is_empty() and all(p.state == State.WAITING and not p.is_left() for p in room.players if p)
+
+    @classmethod
+    def _on_matched(cls, room: Room):
+        if room.is_ready():
+            room.players[0].change_state(State.CALL_SCORE)
+            room.on_deal_poker()
 
     @classmethod
     def gen_room_id(cls) -> int:
-        cls.total_room_count += 1
+        cls.total_room_count += cls.room_id_step
         if cls.total_room_count > 999999:
-            cls.total_room_count = 1
+            cls.total_room_count = cls.total_room_count % cls.room_id_step or cls.room_id_step
         return cls.total_room_count
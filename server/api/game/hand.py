@@ -0,0 +1,103 @@
+from typing import Iterable
+
+'''
+Packed rank counts of a hand: 15 ranks, 4 bits per rank (3 count bits and 1 guard bit).
+# 3 4 5 6 7 8 9 0 J Q K A 2 w W
+'''
+
+Hand = int
+
+RANKS = '34567890JQKA2wW'
+
+ONES = sum(1 << (i * 4) for i in range(len(RANKS)))
+GUARDS = ONES << 3
+COUNTS = ONES * 7
+
+BIG = sum(7 << (RANKS.index(c) * 4) for c in '2wW')
+SMALL = COUNTS & ~BIG
+ABS_SMALL = sum(7 << (RANKS.index(c) * 4) for c in '34567890')
+
+CARD_BITS = {c: 1 << (i * 4) for i, c in enumerate(RANKS)}
+ROCKET = CARD_BITS['w'] + CARD_BITS['W']
+
+
+def from_cards(cards: Iterable[str]) -> Hand:
+    return sum(CARD_BITS[c] for c in cards)
+
+
+def from_pokers(pokers: Iterable[int]) -> Hand:
+    return sum(1 << (poker_rank(p) * 4) for p in pokers)
+
+
+def to_cards(hand: Hand) -> str:
+    return ''.join(RANKS[i] * ((hand >> (i * 4)) & 7) for i in range(len(RANKS)))
+
+
+def poker_rank(poker: int) -> int:
+    if poker == 53:
+        return 13
+    if poker == 54:
+        return 14
+    return (poker + 10) % 13
+
+
+def rank_bit(rank: int) -> Hand:
+    return 1 << (rank * 4)
+
+
+def count(hand: Hand, rank: int) -> int:
+    return (hand >> (rank * 4)) & 7
+
+
+def contains(hand: Hand, sub: Hand) -> bool:
+    return ((hand | GUARDS) - sub) & GUARDS == GUARDS
+
+
+def add(hand: Hand, other: Hand) -> Hand:
+    """
+    每个点数的张数相加, 调用方保证每个点数不超过 4 张
+    """
+    return hand + other
+
+
+def subtract(hand: Hand, sub: Hand) -> Hand:
+    """
+    调用方先用 contains 确认 hand 包含 sub
+    """
+    return hand - sub
+
+
+def poker_bits(pokers: Iterable[int]) -> int:
+    """
+    按牌而不是按点数打包, 每张牌 (1-54) 一位; 有重复或不合法的牌时返回 -1
+    """
+    bits = 0
+    for poker in pokers:
+        if not isinstance(poker, int) or not 1 <= poker <= 54 or bits >> poker & 1:
+            return -1
+        bits |= 1 << poker
+    return bits
+
+
+def contains_pokers(hand_pokers: Iterable[int], pokers: Iterable[int]) -> bool:
+    bits = poker_bits(pokers)
+    return bits >= 0 and bits & ~poker_bits(hand_pokers) == 0
+
+
+def size(hand: Hand) -> int:
+    return bin(hand & ONES).count('1') + 2 * bin(hand & (ONES << 1)).count('1') + 4 * bin(hand & (ONES << 2)).count('1')
+
+
+def singles(hand: Hand) -> int:
+    """
+    :return: 只有一张的点数个数
+    """
+    x = (hand ^ ONES) | GUARDS
+    return bin(GUARDS & ~(x - ONES)).count('1')
+
+
+def lowest(hand: Hand) -> int:
+    """
+    :return: 最小点数的下标, 空手牌返回 -1
+    """
+    return ((hand & -hand).bit_length() - 1) // 4
@@ -0,0 +1,188 @@
+import asyncio
+import inspect
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Tuple
+
+'''
+房间的消息队列: 玩家请求、机器人出牌、倒计时超时都放进所在房间的队列, 同一个房间同时只有一个任务按顺序处理
+处理函数里的 await (例如机器人决策) 不会和同一个房间的其他消息交错
+
+    put         队列满时等待, 用于玩家的 websocket 消息, 等待期间不再读取该连接
+    submit      不等待, 队列满或已关闭时丢弃并计数, 用于机器人和定时器
+    drain       处理完已收到的消息后暂停, 之后收到的消息留在队列里, 可以安全地导出房间
+    resume      继续处理
+    close       丢弃队列里的消息, 之后的消息都丢弃
+    transfer    把某个玩家的消息按原顺序移到另一个房间的队列, 用于合桌
+
+队列为空时没有常驻任务, 有消息时才创建
+'''
+
+
+class InboxStats(object):
+    messages = 0
+    dropped = 0
+    pending = 0
+    max_depth = 0
+    wait_total = 0.0
+    wait_max = 0.0
+    run_total = 0.0
+    run_max = 0.0
+
+    @classmethod
+    def on_put(cls, depth: int):
+        cls.pending += 1
+        if depth > cls.max_depth:
+            cls.max_depth = depth
+
+    @classmethod
+    def on_done(cls, wait: float, run: float):
+        cls.pending -= 1
+        cls.messages += 1
+        cls.wait_total += wait
+        cls.run_total += run
+        if wait > cls.wait_max:
+            cls.wait_max = wait
+        if run > cls.run_max:
+            cls.run_max = run
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        messages = cls.messages or 1
+        return {
+            'messages': cls.messages,
+            'dropped': cls.dropped,
+            'pending': cls.pending,
+            'max_depth': cls.max_depth,
+            'wait_avg_ms': cls.wait_total / messages * 1000,
+            'wait_max_ms': cls.wait_max * 1000,
+            'run_avg_ms': cls.run_total / messages * 1000,
+            'run_max_ms': cls.run_max * 1000,
+        }
+
+
+class Inbox(object):
+
+    def __init__(self, name: Any, maxsize: int = 256):
+        self.name = name
+        self.maxsize = maxsize
+        self._queue: Deque[Tuple[float, Callable, tuple]] = deque()
+        self._putters: Deque[asyncio.Future] = deque()
+        self._task = None
+        self._paused = False
+        self._closed = False
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def paused(self) -> bool:
+        return self._paused
+
+    async def put(self, func: Callable, *args) -> bool:
+        while len(self._queue) >= self.maxsize and not self._closed:
+            waiter = asyncio.get_event_loop().create_future()
+            self._putters.append(waiter)
+            await waiter
+        return self.submit(func, *args)
+
+    def submit(self, func: Callable, *args) -> bool:
+        if self._closed or len(self._queue) >= self.maxsize:
+            InboxStats.dropped += 1
+            logging.warning('ROOM[%s] INBOX DROP %s', self.name, getattr(func, '__qualname__', func))
+            return False
+        self._push(func, args)
+        return True
+
+    async def drain(self):
+        """
+        等待已收到的消息处理完, 然后暂停
+        """
+        if self._closed or self._paused:
+            return
+        future = asyncio.get_event_loop().create_future()
+
+        def pause():
+            self._paused = True
+            future.set_result(None)
+
+        # 暂停标记不受 maxsize 限制, 排在已收到的消息后面
+        self._push(pause, ())
+        await future
+
+    def resume(self):
+        self._paused = False
+        self._start()
+
+    def close(self) -> int:
+        """
+        返回丢弃的消息数
+        """
+        self._closed = True
+        dropped = len(self._queue)
+        InboxStats.dropped += dropped
+        InboxStats.pending -= dropped
+        self._queue.clear()
+        while self._putters:
+            waiter = self._putters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+        return dropped
+
+    def transfer(self, other: 'Inbox', owner: Any) -> int:
+        """
+        处理函数是 owner 的方法的消息移到 other, 返回移动的条数
+        """
+        moved = [item for item in self._queue if getattr(item[1], '__self__', None) is owner]
+        if not moved:
+            return 0
+        self._queue = deque(item for item in self._queue if getattr(item[1], '__self__', None) is not owner)
+        other._queue.extend(moved)
+        self._wake_putter()
+        other._start()
+        return len(moved)
+
+    def _push(self, func: Callable, args: tuple):
+        self._queue.append((time.perf_counter(), func, args))
+        InboxStats.on_put(len(self._queue))
+        self._start()
+
+    def _start(self):
+        if self._task is None and self._queue and not self._paused:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        try:
+            while self._queue and not self._paused:
+                queued, func, args = self._queue.popleft()
+                self._wake_putter()
+                start = time.perf_counter()
+                try:
+                    result = func(*args)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception:
+                    logging.exception('ROOM[%s] INBOX %s FAILED', self.name, getattr(func, '__qualname__', func))
+                InboxStats.on_done(start - queued, time.perf_counter() - start)
+        finally:
+            self._task = None
+
+    def _wake_putter(self):
+        while self._putters:
+            waiter = self._putters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {'depth': len(self._queue), 'paused': self._paused, 'closed': self._closed, 'waiting': len(self._putters)}
+
+
+def deepest(inboxes: List[Inbox], limit: int = 10) -> List[Dict[str, Any]]:
+    """
+    队列最长的几个房间, 用于排查卡住的房间
+    """
+    busy = sorted((inbox for inbox in inboxes if inbox.depth), key=lambda inbox: inbox.depth, reverse=True)
+    return [{'room': inbox.name, **inbox.stats()} for inbox in busy[:limit]]
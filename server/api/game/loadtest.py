@@ -0,0 +1,374 @@
+import argparse
+import asyncio
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import orjson
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError, HTTPRequest
+from tornado.websocket import websocket_connect, WebSocketClientConnection, WebSocketClosedError
+
+from config import BASE_DIR
+from .codec import BinaryCodec, JsonCodec
+from .components.policy import want_rob
+from .protocol import Protocol as Pt
+from .round import poker_order
+from .rule import rule
+
+'''
+压力测试: 每个客户端用 /login 登录, 打开 /ws?token=, 按真实协议加入房间、准备、抢地主、出牌(出牌用 rule)
+统计每种请求到对应响应的延迟分位数、连接数、错误数和服务器处理的牌局数/消息数
+
+    python -m api.game.loadtest --url http://127.0.0.1:8080 --clients 300 --games 5
+    python -m api.game.loadtest --spawn --clients 300 --duration 60 --workers 2
+
+--spawn 在本机启动一个服务器, 用户存在临时目录的 SQLite 里(需要 aiosqlite), 不依赖 MySQL
+默认进入 level 2 的房间, 不会加入机器人, 每桌三个都是压测客户端; 客户端数最好是 3 的倍数
+--admin 指定 uid 为 1 的用户名时, 结束前读取 /admin 的统计
+'''
+
+# 请求 -> 对应的响应, 响应里的 uid 是自己时算作这次请求的延迟
+RESPONSES = {
+    Pt.REQ_JOIN_ROOM: Pt.RSP_JOIN_ROOM,
+    Pt.REQ_READY: Pt.RSP_READY,
+    Pt.REQ_CALL_SCORE: Pt.RSP_CALL_SCORE,
+    Pt.REQ_SHOT_POKER: Pt.RSP_SHOT_POKER,
+}
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class LoadStats(object):
+
+    def __init__(self):
+        self.logins = 0
+        self.login_errors = 0
+        self.connected = 0
+        self.connect_errors = 0
+        self.disconnected = 0
+        self.finished = 0
+        self.errors: Counter = Counter()
+        self.game_overs = 0
+        self.sent = 0
+        self.received = 0
+        self.latencies: Dict[str, List[float]] = {}
+
+    def on_latency(self, code: int, elapsed: float):
+        self.latencies.setdefault(Pt(code).name, []).append(elapsed)
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        latency = {}
+        for name, values in sorted(self.latencies.items()):
+            values.sort()
+            latency[name] = {
+                'count': len(values),
+                'p50_ms': percentile(values, 50) * 1000,
+                'p90_ms': percentile(values, 90) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+                'max_ms': values[-1] * 1000,
+            }
+        # 每局三个客户端都会收到结束消息
+        games = self.game_overs / 3
+        return {
+            'seconds': elapsed,
+            'logins': self.logins,
+            'login_errors': self.login_errors,
+            'connected': self.connected,
+            'connect_errors': self.connect_errors,
+            'disconnected': self.disconnected,
+            'finished': self.finished,
+            'errors': sum(self.errors.values()),
+            'error_reasons': dict(self.errors.most_common(10)),
+            'games': games,
+            'games_per_second': games / elapsed if elapsed else 0.0,
+            'sent': self.sent,
+            'received': self.received,
+            'sent_per_second': self.sent / elapsed if elapsed else 0.0,
+            'received_per_second': self.received / elapsed if elapsed else 0.0,
+            'latency': latency,
+        }
+
+
+class LoadClient(object):
+
+    def __init__(self, stats: LoadStats, url: str, name: str, level: int = 2, games: int = 1, think: float = 0.0,
+                 binary: bool = False, deflate: bool = False):
+        self.stats = stats
+        self.url = url
+        self.name = name
+        self.level = level
+        self.games = games
+        self.think = think
+        self.codec = BinaryCodec if binary else JsonCodec
+        self.deflate = deflate
+
+        self.uid = -1
+        self.conn: Optional[WebSocketClientConnection] = None
+        self.played = 0
+        # 当前请求和发送时间, 同一时间只有一个等待响应的请求
+        self.pending: Optional[int] = None
+        self.pending_at = 0.0
+
+        self.seats: List[int] = []
+        self.hand: List[int] = []
+        # uid -> 手里剩余的牌数, 出完牌的人之后不用再出
+        self.left: Dict[int, int] = {}
+        self.landlord = -1
+        self.last_shot_uid = -1
+        self.last_shot_poker: List[int] = []
+
+    async def run(self):
+        token = await self.login()
+        if token is None:
+            return
+        if not await self.connect(token):
+            return
+        try:
+            self.send(Pt.REQ_JOIN_ROOM, {'room': -1, 'level': self.level})
+            while True:
+                message = await self.conn.read_message()
+                if message is None:
+                    self.stats.disconnected += 1
+                    return
+                self.stats.received += 1
+                code, packet = self.codec.decode(message)
+                if code is not None and await self.on_message(code, packet):
+                    self.stats.finished += 1
+                    return
+        finally:
+            self.conn.close()
+
+    async def login(self) -> Optional[str]:
+        try:
+            response = await AsyncHTTPClient().fetch(f'{self.url}/login', method='POST',
+                                                     body=orjson.dumps({'name': self.name}))
+        except (HTTPClientError, OSError) as e:
+            self.stats.login_errors += 1
+            self.stats.errors[f'login: {e}'] += 1
+            return None
+        account = orjson.loads(response.body)
+        self.uid = account['uid']
+        self.stats.logins += 1
+        return account['token']
+
+    async def connect(self, token: str) -> bool:
+        url = self.url.replace('http', 'ws', 1) + f'/ws?token={token}'
+        try:
+            self.conn = await websocket_connect(url, compression_options={} if self.deflate else None,
+                                                subprotocols=[self.codec.name] if self.codec.binary else None)
+        except (HTTPClientError, OSError) as e:
+            self.stats.connect_errors += 1
+            self.stats.errors[f'connect: {e}'] += 1
+            return False
+        self.stats.connected += 1
+        return True
+
+    def send(self, code: int, packet: Dict[str, Any]):
+        self.pending = code
+        self.pending_at = time.perf_counter()
+        try:
+            self.conn.write_message(self.codec.encode([code, packet]), binary=self.codec.binary)
+            self.stats.sent += 1
+        except WebSocketClosedError:
+            self.pending = None
+
+    async def act(self, code: int, packet: Dict[str, Any]):
+        if self.think:
+            await asyncio.sleep(self.think * random.uniform(0.5, 1.5))
+        self.send(code, packet)
+
+    async def on_message(self, code: int, packet: Dict[str, Any]) -> bool:
+        """
+        :return: 是否已经打完
+        """
+        if self.pending is not None and (code == Pt.ERROR or (
+                code == RESPONSES[self.pending] and packet.get('uid', self.uid) == self.uid)):
+            self.stats.on_latency(self.pending, time.perf_counter() - self.pending_at)
+            self.pending = None
+
+        if code == Pt.ERROR:
+            self.stats.errors[packet.get('reason', '')] += 1
+        elif code == Pt.RSP_JOIN_ROOM:
+            first = not self.seats
+            self.seats = [player.get('uid', -1) for player in packet['players']]
+            if first:
+                await self.act(Pt.REQ_READY, {'ready': 1})
+        elif code == Pt.RSP_DEAL_POKER:
+            self.hand = sorted(packet['pokers'], key=poker_order)
+            self.left = {uid: 17 for uid in self.seats}
+            self.landlord = -1
+            self.last_shot_uid, self.last_shot_poker = -1, []
+            if packet['uid'] == self.uid:
+                await self.act(Pt.REQ_CALL_SCORE, {'rob': want_rob(self.hand)})
+        elif code == Pt.RSP_CALL_SCORE:
+            if packet['landlord'] == -1:
+                if self.next_uid(packet['uid']) == self.uid:
+                    await self.act(Pt.REQ_CALL_SCORE, {'rob': want_rob(self.hand)})
+                return False
+            self.landlord = self.last_shot_uid = packet['landlord']
+            self.left[self.landlord] = 20
+            if self.landlord == self.uid:
+                self.hand = sorted(self.hand + packet['pokers'], key=poker_order)
+                await self.shot()
+        elif code == Pt.RSP_SHOT_POKER:
+            self.left[packet['uid']] = self.left.get(packet['uid'], 0) - len(packet['pokers'])
+            if packet['pokers']:
+                self.last_shot_uid, self.last_shot_poker = packet['uid'], packet['pokers']
+                if packet['uid'] == self.uid:
+                    for poker in packet['pokers']:
+                        self.hand.remove(poker)
+            if self.left[packet['uid']] > 0 and self.next_uid(packet['uid']) == self.uid:
+                await self.shot()
+        elif code == Pt.RSP_GAME_OVER:
+            self.stats.game_overs += 1
+            self.played += 1
+            if self.played >= self.games:
+                return True
+            await self.act(Pt.REQ_READY, {'ready': 1})
+        return False
+
+    async def shot(self):
+        if not self.last_shot_poker or self.last_shot_uid == self.uid:
+            pokers = rule.find_best_shot(self.hand)
+        else:
+            ally = self.landlord not in (self.uid, self.last_shot_uid)
+            pokers = rule.find_best_follow(self.hand, self.last_shot_poker, ally)
+        await self.act(Pt.REQ_SHOT_POKER, {'pokers': pokers})
+
+    def next_uid(self, uid: int) -> int:
+        if uid not in self.seats:
+            return -1
+        return self.seats[(self.seats.index(uid) + 1) % 3]
+
+
+async def fetch_admin(url: str, name: str) -> Optional[Dict[str, Any]]:
+    client = AsyncHTTPClient()
+    try:
+        response = await client.fetch(f'{url}/login', method='POST', body=orjson.dumps({'name': name}))
+        cookie = response.headers.get_list('Set-Cookie')[0].split(';')[0]
+        response = await client.fetch(HTTPRequest(f'{url}/admin', headers={'Cookie': cookie}))
+    except (HTTPClientError, OSError, IndexError):
+        return None
+    return orjson.loads(response.body)
+
+
+def spawn_server(port: int, workers: int, workdir: str) -> subprocess.Popen:
+    """
+    启动使用 SQLite 的本地服务器, 日志写到 workdir/server.log
+    """
+    from sqlalchemy import create_engine
+    from models.base import Base
+    import models  # noqa: F401 注册表结构
+
+    database = os.path.join(workdir, 'loadtest.db')
+    Base.metadata.create_all(create_engine(f'sqlite:///{database}'))
+    env = {
+        **os.environ,
+        'DATABASE_URI': f'sqlite+aiosqlite:///{database}',
+        'PORT': str(port),
+        'WORKERS': str(workers),
+        'SNAPSHOT_PATH': os.path.join(workdir, 'snapshot.json'),
+        'RECORD_SPOOL': os.path.join(workdir, 'record.spool'),
+    }
+    env.setdefault('LOG_SAMPLING', 'ddz.req=0,ddz.rsp=0,ddz.deal=0,ddz.shot=0')
+    log = open(os.path.join(workdir, 'server.log'), 'wb')
+    return subprocess.Popen([sys.executable, 'app.py'], cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_server(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            await AsyncHTTPClient().fetch(f'{url}/login')
+            return
+        except (HTTPClientError, OSError):
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def run(args) -> Dict[str, Any]:
+    stats = LoadStats()
+    prefix = args.prefix or f'load{random.randint(0, 99999)}'
+    clients = [LoadClient(stats, args.url, f'{prefix}-{i}', args.level, args.games, args.think, args.binary,
+                          args.deflate) for i in range(args.clients)]
+    admin = await fetch_admin(args.url, args.admin) if args.admin else None
+
+    async def start(i: int, client: LoadClient):
+        # 在 ramp 秒内均匀地建立连接
+        await asyncio.sleep(args.ramp * i / max(len(clients), 1))
+        await client.run()
+
+    start_at = time.perf_counter()
+    tasks = [asyncio.ensure_future(start(i, client)) for i, client in enumerate(clients)]
+    _, pending = await asyncio.wait(tasks, timeout=args.duration or None)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    report = stats.report(time.perf_counter() - start_at)
+    report['unfinished'] = len(pending)
+
+    if args.admin:
+        after = await fetch_admin(args.url, args.admin)
+        if admin and after:
+            messages = after['inbox']['messages'] - admin['inbox']['messages']
+            report['server'] = {
+                'inbox_messages': messages,
+                'inbox_messages_per_second': messages / report['seconds'],
+                'inbox': after['inbox'],
+                'worker': after['worker'],
+            }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m api.game.loadtest', description='websocket load test')
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--clients', type=int, default=30)
+    parser.add_argument('--games', type=int, default=1, help='games per client')
+    parser.add_argument('--duration', type=float, default=0, help='stop after seconds, 0 waits for all games')
+    parser.add_argument('--ramp', type=float, default=1.0, help='seconds to open all connections')
+    parser.add_argument('--think', type=float, default=0.0, help='average seconds before each request')
+    parser.add_argument('--level', type=int, default=2)
+    parser.add_argument('--prefix', default='', help='user name prefix, random by default')
+    parser.add_argument('--binary', action='store_true', help=f'use the {BinaryCodec.name} subprotocol')
+    parser.add_argument('--deflate', action='store_true', help='request permessage-deflate')
+    parser.add_argument('--admin', default='', help='name of uid 1, reads /admin before and after')
+    parser.add_argument('--spawn', action='store_true', help='start a local server with a SQLite user store')
+    parser.add_argument('--port', type=int, default=18080, help='port of the spawned server')
+    parser.add_argument('--workers', type=int, default=1, help='workers of the spawned server')
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn:
+        # 新建的数据库里第一个登录的用户 uid 为 1
+        args.admin = args.admin or 'loadtest-admin'
+        workdir = tempfile.mkdtemp(prefix='ddz-loadtest-')
+        args.url = f'http://127.0.0.1:{args.port}'
+        server = spawn_server(args.port, args.workers, workdir)
+        print(f'server pid {server.pid} log {workdir}/server.log', file=sys.stderr)
+
+    try:
+        if server:
+            asyncio.run(wait_server(args.url))
+        report = asyncio.run(run(args))
+    finally:
+        if server:
+            server.send_signal(signal.SIGTERM)
+            server.wait(10)
+
+    sys.stdout.write(orjson.dumps(report, option=orjson.OPT_INDENT_2).decode() + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -5,14 +5,20 @@ import logging
 from enum import IntEnum
 from typing import TYPE_CHECKING, List, Optional, Dict, Any
 
+from config import LOG_PAYLOAD
+from utils.logs import sampled
+from . import hand
+from .codec import JsonCodec
+from .decision import Decision
 from .protocol import Protocol as Pt
-from .rule import rule
+from .round import poker_order
 
 if TYPE_CHECKING:
     from .room import Room
     from .views import SocketHandler
 
 logger = logging.getLogger(__file__)
+shot_logger = logging.getLogger('ddz.shot')
 
 
 def shot_turn(func):
@@ -35,6 +41,7 @@ class State(IntEnum):
 
 
 class Player(object):
+    is_robot = False
 
     def __init__(self, uid: int, name: str, sex: int = 1, avatar: str = '', **kwargs):
         self.uid = uid
@@ -77,18 +84,40 @@ class Player(object):
             'pokers': self.hand_pokers if real else [0] * len(self.hand_pokers),
         }
 
-    def push_pokers(self, pokers: List[int]):
-        self._hand_pokers += pokers
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'uid': self.uid,
+            'name': self.name,
+            'sex': self.sex,
+            'avatar': self.avatar,
+            'robot': self.is_robot,
+            'point': self.point,
+            'seat': self.seat,
+            'state': self.state,
+            'ready': self._ready,
+            'leave': self._leave,
+            'rob': self.rob,
+            'landlord': self.landlord,
+            'pokers': self._hand_pokers,
+        }
 
-        def compare_single_poker(poker: int):
-            if poker == 53 or poker == 54:
-                return poker
-            poker = poker % 13
-            if poker <= 2:
-                return poker + 13
-            return poker
+    def restore(self, data: Dict[str, Any], room: Room):
+        """
+        从快照恢复, 不发送消息; 真人玩家没有连接, 按离开处理, 重连后通过 handle_leave 回到房间
+        """
+        self.room = room
+        self.point = data['point']
+        self.seat = data['seat']
+        self.state = State(data['state'])
+        self._ready = data['ready']
+        self._leave = 1 if self.socket is None and not self.is_robot else data['leave']
+        self.rob = data['rob']
+        self.landlord = data['landlord']
+        self._hand_pokers = list(data['pokers'])
 
-        self._hand_pokers.sort(key=compare_single_poker)
+    def push_pokers(self, pokers: List[int]):
+        self._hand_pokers += pokers
+        self._hand_pokers.sort(key=poker_order)
 
     @property
     def hand_pokers(self) -> List[int]:
@@ -117,16 +146,17 @@ class Player(object):
     def on_disconnect(self):
         self.set_left()
 
-    def on_timeout(self):
+    async def on_timeout(self):
         if not self.is_left():
             return
         if self.state == State.CALL_SCORE:
-            self.on_message(Pt.REQ_CALL_SCORE, {'rob': 0})
+            await self.on_message(Pt.REQ_CALL_SCORE, {'rob': 0})
         elif self.state == State.PLAYING:
             if not self.room.last_shot_poker or self.room.last_shot_seat == self.seat:
-                self.on_message(Pt.REQ_SHOT_POKER, rule.find_best_shot(self.hand_pokers))
+                pokers = await Decision.find_best_shot(self.hand_pokers)
+                await self.on_message(Pt.REQ_SHOT_POKER, {'pokers': pokers})
             else:
-                self.on_message(Pt.REQ_SHOT_POKER, {'pokers': []})
+                await self.on_message(Pt.REQ_SHOT_POKER, {'pokers': []})
 
     def handle_leave(self, code: int, packet: Dict[str, Any]):
         from .globalvar import GlobalVar
@@ -161,7 +191,6 @@ class Player(object):
             logger.info('PLAYER[%s] JOIN ROOM[%d]', self.uid, room.room_id)
 
             if room.is_full():
-                GlobalVar.on_room_changed(room)
                 logger.info('ROOM[%s] FULL[%s]', room.room_id, room.players)
         else:
             self.write_error('ERROR STATE[%s]' % self.state)
@@ -201,7 +230,7 @@ class Player(object):
         if code == Pt.REQ_SHOT_POKER:
             pokers = packet.get('pokers')
 
-            if not rule.is_contains(self._hand_pokers, pokers):
+            if not isinstance(pokers, list) or not hand.contains_pokers(self._hand_pokers, pokers):
                 self.write_error('Poker does not exist')
                 return
 
@@ -214,14 +243,15 @@ class Player(object):
                 self._hand_pokers.remove(p)
 
             self.room.broadcast([Pt.RSP_SHOT_POKER, {'uid': self.uid, 'pokers': pokers, 'multiple': self.room.multiple}])
-            logger.info('USER[%d] shot %s', self.uid, pokers)
+            if sampled(shot_logger):
+                shot_logger.info('USER[%d] shot %s', self.uid, pokers if LOG_PAYLOAD else len(pokers))
 
             if self._hand_pokers:
                 self.room.go_next_turn()
             else:
                 self.change_state(State.GAME_OVER)
                 self.room.on_game_over(self)
-                await self.room.save_shot_round()
+                self.room.save_shot_round()
         else:
             self.write_error('STATE[%s]' % self.state)
 
@@ -235,6 +265,14 @@ class Player(object):
     def write_message(self, packet):
         self.socket.write_message(packet)
 
+    def write_frame(self, frame: bytes):
+        if self.socket:
+            self.socket.write_frame(frame)
+
+    @property
+    def codec(self):
+        return self.socket.codec if self.socket else JsonCodec
+
     def write_error(self, reason: str):
         if self.socket:
             self.socket.write_message([Pt.ERROR, {'reason': reason}])
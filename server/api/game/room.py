@@ -2,44 +2,39 @@ from __future__ import annotations
 
 import logging
 import random
-from functools import reduce
-from operator import mul
-from typing import Optional, List, Dict
+from typing import Any, Optional, List, Dict
 from typing import TYPE_CHECKING
 
 from tornado.ioloop import IOLoop
 
-from models import Record
+from config import LOG_PAYLOAD, ROOM_INBOX_SIZE
+from models.recorder import recorder
+from utils.logs import sampled
+from .inbox import Inbox
 from .protocol import Protocol as Pt
-from .rule import rule
-from .timer import Timer
+from .round import RoundMixin, MULTIPLE_DETAILS
+from .timer import Timer, scheduler
 
 if TYPE_CHECKING:
     from .player import Player
 
+deal_logger = logging.getLogger('ddz.deal')
 
-class Room(object):
+
+class Room(RoundMixin):
     robot_no = 0
 
     def __init__(self, room_id, level=1, allow_robot=True):
         self.room_id = room_id
         self.level = level
-        self._multiple_details: Dict[str, int] = {
-            'origin': 10,
-            'origin_multiple': 15,
-            'di': 1,
-            'ming': 1,
-            'bomb': 1,
-            'rob': 1,
-            'spring': 1,
-            'landlord': 1,
-            'farmer': 1,
-        }
+        self._multiple_details: Dict[str, int] = dict(MULTIPLE_DETAILS)
 
         self.players: List[Optional[Player]] = [None, None, None]
         self.pokers: List[int] = []
 
         self.timer = Timer(self.on_timeout)
+        # 修改房间状态的消息都经过 inbox, 按顺序处理
+        self.inbox = Inbox(room_id, ROOM_INBOX_SIZE)
         self.whose_turn = 0
         self.landlord_seat = 0
         self.bomb_multiple = 2
@@ -70,7 +65,7 @@ class Room(object):
 
         for player in self.players:
             if player.is_left():
-                IOLoop.current().add_callback(self.on_leave, player, True)
+                self.inbox.submit(self.on_leave, player, True)
             else:
                 player.restart()
 
@@ -95,10 +90,76 @@ class Room(object):
             'last_shot_poker': self.last_shot_poker,
         }
 
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'id': self.room_id,
+            'level': self.level,
+            'allow_robot': self.allow_robot,
+            'robot_no': self.robot_no,
+            'multiple': self._multiple_details,
+            'pokers': self.pokers,
+            'whose_turn': self.whose_turn,
+            'landlord_seat': self.landlord_seat,
+            'bomb_multiple': self.bomb_multiple,
+            'last_shot_seat': self.last_shot_seat,
+            'last_shot_poker': self.last_shot_poker,
+            'shot_round': self.shot_round,
+            'timer': self.timer.timeout if self.timer.is_running else -1,
+            'players': [p.snapshot() if p else None for p in self.players],
+        }
+
+    def restore(self, data: Dict[str, Any], players: List[Optional[Player]]):
+        """
+        从快照恢复牌局, 恢复倒计时, 轮到机器人时让机器人继续
+        """
+        from .player import State
+        self.robot_no = data['robot_no']
+        self._multiple_details = dict(data['multiple'])
+        self.pokers = list(data['pokers'])
+        self.whose_turn = data['whose_turn']
+        self.landlord_seat = data['landlord_seat']
+        self.bomb_multiple = data['bomb_multiple']
+        self.last_shot_seat = data['last_shot_seat']
+        self.last_shot_poker = list(data['last_shot_poker'])
+        self.shot_round = [list(pokers) for pokers in data['shot_round']]
+        self.players = players
+
+        state = self.room_state
+        if state == State.GAME_OVER:
+            self.inbox.submit(self.restart)
+            return
+        if state not in (State.CALL_SCORE, State.PLAYING) or not self.is_full():
+            for player in self.players:
+                if player and player.is_robot and not player.ready:
+                    player.auto_ready()
+            return
+
+        if data['timer'] >= 0:
+            self.timer.resume(data['timer'])
+        else:
+            self.timer.start_timing(self.turn_player.timeout)
+        if self.turn_player.is_robot:
+            if state == State.CALL_SCORE:
+                self.turn_player.auto_rob()
+            else:
+                IOLoop.current().add_callback(self.turn_player.auto_shot)
+
     def broadcast(self, response):
+        """
+        所有人收到相同的消息, 每种编码只编码一次; 机器人直接处理原始数据, 不需要编码
+        每个人看到的内容不同时(sync_room, on_deal_poker)逐个调用 write_message
+        """
+        frames = {}
         for player in self.players:
             if player and not player.is_left():
-                player.write_message(response)
+                if player.is_robot:
+                    player.write_message(response)
+                    continue
+                codec = player.codec
+                frame = frames.get(codec.name)
+                if frame is None:
+                    frame = frames[codec.name] = codec.encode(response)
+                player.write_frame(frame)
 
     def sync_room(self):
         for player in self.players:
@@ -127,38 +188,25 @@ class Room(object):
         p1.to_server(Pt.REQ_JOIN_ROOM, {'room': self.room_id, 'level': 1})
 
         if nth == 1:
-            IOLoop.current().call_later(3, self.add_robot, nth=2)
+            scheduler.call_later(3, self.add_robot, nth=2)
             self.robot_no += 1
 
     def on_timeout(self):
-        self.turn_player.on_timeout()
+        if self.turn_player:
+            self.inbox.submit(self.turn_player.on_timeout)
 
-    def on_join(self, target: Player):
+    def on_join(self, target: Player, robot=True):
+        """
+        robot: 是否在 10 秒后补机器人, 合桌移过来的玩家不再补, 房间已经为第一个玩家安排过
+        """
+        from .globalvar import GlobalVar
         if self._on_join(target):
-            if self.allow_robot and self.level == 1:
-                IOLoop.current().call_later(10, self.add_robot, nth=1)
+            GlobalVar.on_room_changed(self)
+            if robot and self.allow_robot and self.level == 1:
+                scheduler.call_later(10, self.add_robot, nth=1)
             return True
         return False
 
-    def on_rob(self, target: Player) -> bool:
-        if target.rob == 1:
-            self._multiple_details['rob'] *= 2
-
-        if not self._is_rob_end():
-            self.go_next_turn()
-            return False
-
-        for i in range(3):
-            # 每个人都抢地主, 第一个人是地主
-            if self.turn_player.rob == 1 or i == 2:
-                self.turn_player.landlord = 1
-                self.turn_player.push_pokers(self.pokers)
-                self.last_shot_seat = self.whose_turn
-                self.re_multiple()
-                return True
-            self.go_prev_turn()
-        return True
-
     def on_deal_poker(self):
         try:
             from .dealer import generate_pokers
@@ -183,28 +231,8 @@ class Room(object):
             }]
             if not player.is_left():
                 player.write_message(response)
-            logging.info('ROOM[%s] DEAL[%s]', self.room_id, response)
-
-    def on_shot(self, seat: int, pokers: List[int]) -> str:
-        if pokers:
-            spec = rule.get_poker_spec(pokers)
-            if spec is None:
-                return 'Poker does not comply with the rules'
-
-            if seat != self.last_shot_seat and rule.compare_pokers(pokers, self.last_shot_poker) < 0:
-                return 'Poker small than last shot'
-
-            if spec == 'bomb' or spec == 'rocket':
-                self._multiple_details['bomb'] *= 2
-
-            self.last_shot_seat = seat
-            self.last_shot_poker = pokers
-        else:
-            if seat == self.last_shot_seat:
-                return 'Last shot player does not allow pass'
-
-        self.shot_round.append(pokers)
-        return ''
+            if sampled(deal_logger):
+                deal_logger.info('ROOM[%s] DEAL[%s]', self.room_id, response if LOG_PAYLOAD else player.uid)
 
     def on_leave(self, target: Player, is_restart=False):
         from .components.simple import RobotPlayer
@@ -220,98 +248,39 @@ class Room(object):
 
             self.robot_no -= free_robot
             GlobalVar.on_room_changed(self)
+            GlobalVar.on_player_left(target)
             return True
         except ValueError:
             logging.error('Player[%d] NOT IN Room[%d]', target.uid, self.room_id)
             return False
 
     def on_game_over(self, winner: Player):
-        spring = self.is_spring(winner)
-        anti_spring = self.anti_spring(winner)
-        if spring or anti_spring:
-            self._multiple_details['spring'] *= 3
-
+        spring, anti_spring, points = self.settle(winner)
         response = [Pt.RSP_GAME_OVER, {
             'winner': winner.uid,
-            'spring': int(self.is_spring(winner)),
-            'antispring': int(self.anti_spring(winner)),
+            'spring': int(spring),
+            'antispring': int(anti_spring),
             'multiple': self._multiple_details,
-            'players': [],
-        }]
-        for player in self.players:
-            point = self.get_point(winner, player)
-            response[1]['players'].append({
+            'players': [{
                 'uid': player.uid,
                 'point': point,
                 'pokers': player.hand_pokers,
-            })
+            } for player, point in zip(self.players, points)],
+        }]
         self.broadcast(response)
         logging.info('Room[%d] GameOver', self.room_id)
 
         self.timer.stop_timing()
-        IOLoop.current().add_callback(self.restart)
-
-    async def save_shot_round(self):
-        for player in self.players:
-            if not player.socket:
-                continue
-            robot = self.has_robot()
-            await player.socket.insert(Record(round={
-                'left': {player.seat: player.hand_pokers for player in self.players},
-                'round': self.shot_round,
-                'lord': self.landlord.seat,
-            }, robot=robot))
-            break
-
-    @property
-    def multiple(self) -> int:
-        return reduce(mul, self._multiple_details.values(), 1) // self._multiple_details['origin']
+        self.inbox.submit(self.restart)
 
-    def re_multiple(self):
-        joker_number = rule.get_joker_no(self.pokers)
-        if joker_number > 0:
-            self._multiple_details['di'] *= 2 * joker_number
+    def save_shot_round(self):
+        if not any(player.socket for player in self.players):
             return
-
-        if rule.is_same_color(self.pokers):
-            self._multiple_details['di'] *= 2
-
-        if rule.is_short_seq(self.pokers):
-            self._multiple_details['di'] *= 2
-
-    def get_point(self, winner: Player, player: Player) -> int:
-        point = reduce(mul, self._multiple_details.values(), 1)
-        if self.landlord == winner:
-            if winner == player:
-                return point * 2
-            else:
-                return -point
-        else:
-            if player.landlord == 0:
-                return point
-            else:
-                return -point * 2
-
-    def is_spring(self, winner: Player) -> bool:
-        if self.landlord == winner:
-            for i, poker in enumerate(self.shot_round):
-                if i % 3 == 0:
-                    continue
-                if poker:
-                    return False
-            return True
-        return False
-
-    def anti_spring(self, winner: Player) -> bool:
-        if self.landlord == winner:
-            return False
-
-        for i, poker in enumerate(self.shot_round):
-            if i == 0:
-                continue
-            if i % 3 == 0 and poker:
-                return False
-        return True
+        recorder.append({
+            'left': {player.seat: list(player.hand_pokers) for player in self.players},
+            'round': list(self.shot_round),
+            'lord': self.landlord.seat,
+        }, robot=self.has_robot())
 
     def _on_join(self, target: Player):
         for i, player in enumerate(self.players):
@@ -323,72 +292,14 @@ class Room(object):
         return False
 
     def go_next_turn(self):
-        self.whose_turn += 1
-        if self.whose_turn == 3:
-            self.whose_turn = 0
+        super().go_next_turn()
         self.timer.start_timing(self.turn_player.timeout)
 
-    def go_prev_turn(self):
-        self.whose_turn -= 1
-        if self.whose_turn == -1:
-            self.whose_turn = 2
-
     def seat_to_uid(self, seat):
         if self.players[seat]:
             return self.players[seat].uid
         return -1
 
-    @property
-    def landlord(self):
-        for player in self.players:
-            if player.landlord == 1:
-                return player
-        return None
-
-    @property
-    def prev_player(self):
-        prev_seat = (self.whose_turn - 1) % 3
-        return self.players[prev_seat]
-
-    @property
-    def turn_player(self):
-        return self.players[self.whose_turn]
-
-    @property
-    def next_player(self):
-        next_seat = (self.whose_turn + 1) % 3
-        return self.players[next_seat]
-
-    def _is_rob_end(self) -> bool:
-        """
-        每人都可以抢一次地主, 第一个人可以多抢一次
-        :return: 抢地主是否结束
-        """
-        # 下一个人没有抢地主, 继续抢地主
-        if self.next_player.rob == -1:
-            return False
-
-        # 抢了一圈, 处理第一个人多抢一次
-        if self.next_player.seat == self.landlord_seat:
-            # 第一个人第一次没有抢, 结束
-            if self.next_player.rob == 0:
-                return True
-
-            if self.turn_player.rob == 0:
-                # 当前用户没有抢
-                if self.prev_player.rob == 0:
-                    # 前一个用户也没有抢, 第一个人是地主, 结束
-                    return True
-                else:
-                    # 前一个用户抢了, 第一个人可以多抢一次, 继续抢
-                    return False
-            else:
-                # 当前用户抢了, 第一个人可以多抢一次, 继续抢
-                return False
-
-        # 第一个人也抢了, 结束
-        return True
-
     def is_ready(self) -> bool:
         return self.is_full() and all([p.ready for p in self.players])
 
@@ -399,8 +310,7 @@ class Room(object):
         return self.size() == 0
 
     def has_robot(self) -> bool:
-        from .components.simple import RobotPlayer
-        return any([isinstance(p, RobotPlayer) for p in self.players])
+        return any(p and p.is_robot for p in self.players)
 
     def size(self):
         return sum([p is not None for p in self.players])
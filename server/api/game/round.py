@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+from functools import reduce
+from operator import mul
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from .rule import rule
+
+if TYPE_CHECKING:
+    from .player import Player
+
+'''
+一局牌的规则和计分: 抢地主、出牌校验、倍数、得分、春天
+只依赖 rule, 不依赖 IOLoop、连接和定时器, Room 和无界面的模拟器共用
+使用者需要有 players、pokers、whose_turn、landlord_seat、last_shot_seat、last_shot_poker、shot_round 和 _multiple_details
+'''
+
+MULTIPLE_DETAILS = {
+    'origin': 10,
+    'origin_multiple': 15,
+    'di': 1,
+    'ming': 1,
+    'bomb': 1,
+    'rob': 1,
+    'spring': 1,
+    'landlord': 1,
+    'farmer': 1,
+}
+
+
+def poker_order(poker: int) -> int:
+    """
+    手牌排序: 3 到 K, A, 2, 小王, 大王
+    """
+    if poker == 53 or poker == 54:
+        return poker
+    poker = poker % 13
+    if poker <= 2:
+        return poker + 13
+    return poker
+
+
+class RoundMixin(object):
+    players: List[Optional[Player]]
+    pokers: List[int]
+    whose_turn: int
+    landlord_seat: int
+    last_shot_seat: int
+    last_shot_poker: List[int]
+    shot_round: List[List[int]]
+    _multiple_details: Dict[str, int]
+
+    def on_rob(self, target: Player) -> bool:
+        if target.rob == 1:
+            self._multiple_details['rob'] *= 2
+
+        if not self._is_rob_end():
+            self.go_next_turn()
+            return False
+
+        for i in range(3):
+            # 每个人都抢地主, 第一个人是地主
+            if self.turn_player.rob == 1 or i == 2:
+                self.turn_player.landlord = 1
+                self.turn_player.push_pokers(self.pokers)
+                self.last_shot_seat = self.whose_turn
+                self.re_multiple()
+                return True
+            self.go_prev_turn()
+        return True
+
+    def on_shot(self, seat: int, pokers: List[int]) -> str:
+        if pokers:
+            spec = rule.get_poker_spec(pokers)
+            if spec is None:
+                return 'Poker does not comply with the rules'
+
+            if seat != self.last_shot_seat and rule.compare_pokers(pokers, self.last_shot_poker) < 0:
+                return 'Poker small than last shot'
+
+            if spec == 'bomb' or spec == 'rocket':
+                self._multiple_details['bomb'] *= 2
+
+            self.last_shot_seat = seat
+            self.last_shot_poker = pokers
+        else:
+            if seat == self.last_shot_seat:
+                return 'Last shot player does not allow pass'
+
+        self.shot_round.append(pokers)
+        return ''
+
+    @property
+    def multiple(self) -> int:
+        return reduce(mul, self._multiple_details.values(), 1) // self._multiple_details['origin']
+
+    def re_multiple(self):
+        joker_number = rule.get_joker_no(self.pokers)
+        if joker_number > 0:
+            self._multiple_details['di'] *= 2 * joker_number
+            return
+
+        if rule.is_same_color(self.pokers):
+            self._multiple_details['di'] *= 2
+
+        if rule.is_short_seq(self.pokers):
+            self._multiple_details['di'] *= 2
+
+    def get_point(self, winner: Player, player: Player) -> int:
+        point = reduce(mul, self._multiple_details.values(), 1)
+        if self.landlord == winner:
+            if winner == player:
+                return point * 2
+            else:
+                return -point
+        else:
+            if player.landlord == 0:
+                return point
+            else:
+                return -point * 2
+
+    def settle(self, winner: Player) -> Tuple[bool, bool, List[int]]:
+        """
+        结算: 春天或反春天倍数乘 3, 返回 (春天, 反春天, 每个座位的得分)
+        """
+        spring = self.is_spring(winner)
+        anti_spring = self.anti_spring(winner)
+        if spring or anti_spring:
+            self._multiple_details['spring'] *= 3
+        return spring, anti_spring, [self.get_point(winner, player) for player in self.players]
+
+    def is_spring(self, winner: Player) -> bool:
+        if self.landlord == winner:
+            for i, poker in enumerate(self.shot_round):
+                if i % 3 == 0:
+                    continue
+                if poker:
+                    return False
+            return True
+        return False
+
+    def anti_spring(self, winner: Player) -> bool:
+        if self.landlord == winner:
+            return False
+
+        for i, poker in enumerate(self.shot_round):
+            if i == 0:
+                continue
+            if i % 3 == 0 and poker:
+                return False
+        return True
+
+    def go_next_turn(self):
+        self.whose_turn += 1
+        if self.whose_turn == 3:
+            self.whose_turn = 0
+
+    def go_prev_turn(self):
+        self.whose_turn -= 1
+        if self.whose_turn == -1:
+            self.whose_turn = 2
+
+    @property
+    def landlord(self):
+        for player in self.players:
+            if player.landlord == 1:
+                return player
+        return None
+
+    @property
+    def prev_player(self):
+        prev_seat = (self.whose_turn - 1) % 3
+        return self.players[prev_seat]
+
+    @property
+    def turn_player(self):
+        return self.players[self.whose_turn]
+
+    @property
+    def next_player(self):
+        next_seat = (self.whose_turn + 1) % 3
+        return self.players[next_seat]
+
+    def _is_rob_end(self) -> bool:
+        """
+        每人都可以抢一次地主, 第一个人可以多抢一次
+        :return: 抢地主是否结束
+        """
+        # 下一个人没有抢地主, 继续抢地主
+        if self.next_player.rob == -1:
+            return False
+
+        # 抢了一圈, 处理第一个人多抢一次
+        if self.next_player.seat == self.landlord_seat:
+            # 第一个人第一次没有抢, 结束
+            if self.next_player.rob == 0:
+                return True
+
+            if self.turn_player.rob == 0:
+                # 当前用户没有抢
+                if self.prev_player.rob == 0:
+                    # 前一个用户也没有抢, 第一个人是地主, 结束
+                    return True
+                else:
+                    # 前一个用户抢了, 第一个人可以多抢一次, 继续抢
+                    return False
+            else:
+                # 当前用户抢了, 第一个人可以多抢一次, 继续抢
+                return False
+
+        # 第一个人也抢了, 结束
+        return True
@@ -1,7 +1,13 @@
-import json
 import logging
+import os
 from collections import Counter, defaultdict
-from typing import Dict, List, Tuple, Iterable, Optional
+from functools import lru_cache
+from typing import Dict, List, Tuple, Iterable, Iterator, Optional, Sequence, Union
+
+from config import STATIC_ROOT, RULE_CACHE_SIZE
+from . import hand
+from .hand import Hand
+from .table import RuleTable, load_table
 
 '''
 # A 2 3 4 5 6 7 8 9 0 J Q K w W
@@ -22,37 +28,170 @@ CARD_TYPES = (
 
 class Rule(object):
 
-    def __init__(self, rules: Dict[str, List[str]]):
-        self.rules = rules
+    def __init__(self, table: RuleTable, cache_size: int = 0):
+        self.table = table
+        # packed rank counts of every rule entry, in rule order
+        self.hands: Dict[str, Sequence[Hand]] = table.specs
+        # packed rank counts -> (spec, value), the first spec in rule order wins
+        self.index = table.index
         self.cnt_to_specs: Dict[int, List[str]] = defaultdict(list)
-        for name, specs_list in rules.items():
-            self.cnt_to_specs[len(specs_list[0])].append(name)
+        for name, size in table.sizes.items():
+            self.cnt_to_specs[size].append(name)
+        self.shapes: Dict[str, Tuple[int, int, int, int, int]] = {
+            name: self._spec_shape(name) for name in table.sizes if name != 'rocket'
+        }
+        # 出牌只与点数有关, 按点数缓存机器人决策, 花色在命中缓存后再分配
+        self._best_shot = lru_cache(maxsize=cache_size)(self._find_best_shot)
+        self._best_follow = lru_cache(maxsize=cache_size)(self._find_follow_shot)
+
+    def cache_info(self) -> Dict[str, Dict[str, Union[int, float]]]:
+        info = {}
+        for name, cached in (('shot', self._best_shot), ('follow', self._best_follow)):
+            hits, misses, maxsize, size = cached.cache_info()
+            info[name] = {
+                'hits': hits,
+                'misses': misses,
+                'size': size,
+                'maxsize': maxsize,
+                'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            }
+        return info
+
+    def cache_clear(self):
+        self._best_shot.cache_clear()
+        self._best_follow.cache_clear()
 
     def get_poker_spec(self, pokers: List[int]) -> Optional[str]:
-        cards = ''.join(self._to_cards(pokers))
-        for spec in self.cnt_to_specs.get(len(cards), []):
-            if cards in self.rules[spec]:
-                return spec
-        return None
+        spec_value = self.index.get(hand.from_pokers(pokers))
+        return spec_value[0] if spec_value else None
 
     def find_best_shot(self, hand_pokers: List[int]) -> List[int]:
-        hand_cards = self._to_cards(hand_pokers)
-        best_shot = self._find_best_shot(hand_cards)
-        return self._to_pokers(hand_pokers, best_shot)
+        best_shot = self._best_shot(hand.from_pokers(hand_pokers))
+        return self._to_pokers(hand_pokers, hand.to_cards(best_shot))
 
     def find_best_follow(self, hand_pokers: List[int], turn_pokers: List[int], ally=True) -> List[int]:
-        hand_cards = self._to_cards(hand_pokers)
-        turn_cards = self._to_cards(turn_pokers)
-        best_follow = self._find_follow_shot(hand_cards, turn_cards, ally)
-        return self._to_pokers(hand_pokers, best_follow)
+        hand_cards = hand.from_pokers(hand_pokers)
+        turn_cards = hand.from_pokers(turn_pokers)
+        best_follow = self._best_follow(hand_cards, turn_cards, bool(ally))
+        return self._to_pokers(hand_pokers, hand.to_cards(best_follow))
+
+    def legal_leads(self, hand_pokers: List[int]) -> Iterator[List[int]]:
+        for _, _, cards in self._legal_leads(hand.from_pokers(hand_pokers)):
+            yield self._to_pokers(hand_pokers, hand.to_cards(cards))
+
+    def legal_follows(self, hand_pokers: List[int], turn_pokers: List[int]) -> Iterator[List[int]]:
+        if not turn_pokers:
+            yield from self.legal_leads(hand_pokers)
+            return
+
+        spec_value = self.index.get(hand.from_pokers(turn_pokers))
+        if not spec_value:
+            return
+        for _, _, cards in self._legal_follows(hand.from_pokers(hand_pokers), *spec_value):
+            yield self._to_pokers(hand_pokers, hand.to_cards(cards))
+
+    def _legal_leads(self, hand_cards: Hand) -> Iterator[Tuple[str, int, Hand]]:
+        for spec in self.hands:
+            for value, cards in self._find_spec_candidates(hand_cards, spec):
+                yield spec, value, cards
+
+    def _legal_follows(self, hand_cards: Hand, turn_type: str, turn_value: int) -> Iterator[Tuple[str, int, Hand]]:
+        """
+        :return: 同牌型更大的牌, 然后是炸弹和火箭
+        """
+        if turn_type == 'rocket':
+            return
+
+        for value, cards in self._find_greater(hand_cards, turn_type, turn_value):
+            yield turn_type, value, cards
+
+        if turn_type != 'bomb':
+            for value, cards in self._find_spec_candidates(hand_cards, 'bomb'):
+                yield 'bomb', value, cards
+
+        if hand.contains(hand_cards, hand.ROCKET):
+            yield 'rocket', 0, hand.ROCKET
+
+    def _find_greater(self, hand_cards: Hand, spec: str, value: int) -> List[Tuple[int, Hand]]:
+        return [(v, cards) for v, cards in self._find_spec_candidates(hand_cards, spec) if v > value]
+
+    def _find_spec_candidates(self, hand_cards: Hand, spec: str) -> List[Tuple[int, Hand]]:
+        """
+        由手牌点数直接构造某一牌型的所有出法, 代价只与手牌相关
+        :return: [(value, cards)] 按 value 升序
+        """
+        if spec == 'rocket':
+            return [(0, hand.ROCKET)] if hand.contains(hand_cards, hand.ROCKET) else []
+
+        width, length, kicker, step, last = self.shapes[spec]
+        found: Dict[Hand, int] = {}
+        # 连续 length 个点数都够 width 张时, 以 rank 结尾的 core 可用
+        run = 0
+        for rank in range(last + 1):
+            if (hand_cards >> (rank * 4)) & 7 < width:
+                run = 0
+                continue
+            run += 1
+            if run >= length:
+                start = rank - length + 1
+                core = (hand.ONES & ((1 << (length * 4)) - 1)) * width << (start * 4)
+                if kicker:
+                    left_cards = hand_cards - core
+                    ranks = [r for r in range(len(hand.RANKS)) if hand.count(left_cards, r) and not start <= r < start + length]
+                    candidates = [core + k for k in self._find_kickers(left_cards, ranks, kicker, step)]
+                else:
+                    candidates = [core]
+                for cards in candidates:
+                    spec_value = self.index.get(cards)
+                    if spec_value and spec_value[0] == spec:
+                        found[cards] = spec_value[1]
+        return sorted((value, cards) for cards, value in found.items())
 
-    def _find_follow_shot(self, hand_cards: List[str], turn_cards: List[str], ally=True) -> str:
-        turn_card_type, turn_card_value = self._get_cards_value(turn_cards)
-        if not turn_card_type:
-            return ''
+    @staticmethod
+    def _find_kickers(hand_cards: Hand, ranks: List[int], total: int, step: int, i: int = 0) -> Iterator[Hand]:
+        if total == 0:
+            yield 0
+            return
+        if i == len(ranks):
+            return
+        bit = hand.rank_bit(ranks[i])
+        for n in range(0, min(hand.count(hand_cards, ranks[i]), total) + 1, step):
+            for kicker in Rule._find_kickers(hand_cards, ranks, total - n, step, i + 1):
+                yield kicker + bit * n
 
+    @staticmethod
+    def _spec_shape(spec: str) -> Tuple[int, int, int, int, int]:
+        """
+        :return: 每个点数的张数, 连续点数个数, 带牌张数, 带牌步长(单张1, 对子2), 最大起始点数
+        """
+        name = spec.rstrip('0123456789')
+        length = int(spec[len(name):] or 1)
+        width, kicker, step, last = {
+            'single': (1, 0, 1, 14),
+            'pair': (2, 0, 1, 12),
+            'trio': (3, 0, 1, 12),
+            'bomb': (4, 0, 1, 12),
+            'trio_single': (3, 1, 1, 12),
+            'trio_pair': (3, 2, 2, 12),
+            'bomb_single': (4, 2, 1, 12),
+            'bomb_pair': (4, 4, 2, 12),
+            'seq_single': (1, 0, 1, 11),
+            'seq_pair': (2, 0, 1, 11),
+            'seq_trio': (3, 0, 1, 11),
+            'seq_trio_single': (3, 1, 1, 11),
+            'seq_trio_pair': (3, 2, 2, 11),
+        }[name]
+        return width, length, kicker * length, step, last
+
+    def _find_follow_shot(self, hand_cards: Hand, turn_cards: Hand, ally=True) -> Hand:
+        spec_value = self.index.get(turn_cards)
+        if not spec_value:
+            logging.error('Unknown Card Type: %s', hand.to_cards(turn_cards))
+            return 0
+
+        turn_card_type, turn_card_value = spec_value
         if turn_card_type == 'rocket':
-            return ''
+            return 0
 
         def _reduce_single_number() -> int:
             n = 0
@@ -64,36 +203,32 @@ class Rule(object):
 
         rockets, bombs, big_cards, small_cards = self._get_basic_cards(hand_cards)
 
-        total_single_no = self.get_single_no(small_cards)
+        total_single_no = hand.singles(small_cards)
         reduce = _reduce_single_number()
 
         for cards in (small_cards, hand_cards):
-            for i, spec in enumerate(self.rules[turn_card_type]):
-                if i > turn_card_value and self.is_contains(cards, spec):
-                    left_cards = self.minus(cards, spec)
-                    if self._find_one_shot(left_cards):
-                        return spec
-                    if total_single_no - self.get_single_no(left_cards) >= reduce:
-                        return spec
-            if ally and len(hand_cards) - len(turn_cards) >= 2:
+            for _, spec in self._find_greater(cards, turn_card_type, turn_card_value):
+                left_cards = cards - spec
+                if self._find_one_shot(left_cards):
+                    return spec
+                if total_single_no - hand.singles(left_cards) >= reduce:
+                    return spec
+            if ally and hand.size(hand_cards) - hand.size(turn_cards) >= 2:
                 break
 
         if ally:
-            return ''
+            return 0
 
         for cards in (big_cards, hand_cards):
-            for i, spec in enumerate(self.rules[turn_card_type]):
-                if i > turn_card_value and self.is_contains(cards, spec):
-                    return spec
-
-        if bombs:
-            return bombs[0]
+            for _, spec in self._find_greater(cards, turn_card_type, turn_card_value):
+                return spec
 
-        if rockets:
-            return rockets[0]
-        return ''
+        for spec, _, cards in self._legal_follows(hand_cards, turn_card_type, turn_card_value):
+            if spec == 'bomb' or spec == 'rocket':
+                return cards
+        return 0
 
-    def _find_best_shot(self, hand_cards: List[str]) -> str:
+    def _find_best_shot(self, hand_cards: Hand) -> Hand:
         one_shot = self._find_one_shot(hand_cards)
         if one_shot:
             return one_shot
@@ -106,7 +241,7 @@ class Rule(object):
         else:
             return bombs[0]
 
-        total_single = self.get_single_no(small_cards)
+        total_single = hand.singles(small_cards)
 
         best_seq_single, left_cards = self._find_best_seq(small_cards)
         if best_seq_single:
@@ -119,7 +254,7 @@ class Rule(object):
             (['seq_pair9', 'seq_pair8', 'seq_pair7', 'seq_pair6', 'seq_pair5', 'seq_pair4', 'seq_pair3'], 0)
         )
 
-        abs_small_cards = [card for card in small_cards if card in '34567890']
+        abs_small_cards = small_cards & hand.ABS_SMALL
 
         for cards in (abs_small_cards, small_cards):
             for specs, single_reduce in shot_order:
@@ -128,11 +263,10 @@ class Rule(object):
                     return best_shot
 
         if small_cards:
-            if len(small_cards) == 1:
-                return small_cards[0]
-            if small_cards[0] == small_cards[1]:
-                return small_cards[0] + small_cards[1]
-            return small_cards[0]
+            lowest = hand.lowest(small_cards)
+            if hand.count(small_cards, lowest) >= 2:
+                return hand.rank_bit(lowest) * 2
+            return hand.rank_bit(lowest)
 
         for specs, single_reduce in shot_order:
             best_shot = self._find_spec_shot(hand_cards, specs, total_single + single_reduce)
@@ -141,34 +275,32 @@ class Rule(object):
 
         for spec in ['pair', 'trio', 'single']:
             trio, after_cards = self._find_spec_type(hand_cards, spec)
-            if trio and self.get_single_no(after_cards) <= total_single:
+            if trio and hand.singles(after_cards) <= total_single:
                 return trio[0]
 
-        return hand_cards[0]
+        return hand.rank_bit(hand.lowest(hand_cards))
 
-    def _find_one_shot(self, hand_cards: List[str]):
-        cards_no = len(hand_cards)
-        for spec in self.cnt_to_specs.get(cards_no, []):
-            if spec == 'bomb_single' or spec == 'bomb_pair':
-                continue
-            results, left_cards = self._find_spec_type(hand_cards, spec)
-            if not left_cards:
-                return results[0]
+    def _find_one_shot(self, hand_cards: Hand) -> Optional[Hand]:
+        # 有的点数组合属于多个牌型, 例如 333444555666 既是 seq_trio4 也是 seq_trio_single3 (带 3 4 5),
+        # 索引里保留按规则顺序的第一个牌型; 这里只关心整手牌能否一次出完, 取哪个牌型都一样
+        spec_value = self.index.get(hand_cards)
+        if spec_value and spec_value[0] != 'bomb_single' and spec_value[0] != 'bomb_pair':
+            return hand_cards
         return None
 
-    def _get_basic_cards(self, hand_cards: List[str]):
+    def _get_basic_cards(self, hand_cards: Hand) -> Tuple[List[Hand], List[Hand], Hand, Hand]:
         rockets, left_cards = self._find_spec_type(hand_cards, 'rocket')
         bombs, left_cards = self._find_spec_type(left_cards, 'bomb')
-        return rockets, bombs, self.get_big_cards(left_cards), self.get_small_cards(left_cards)
+        return rockets, bombs, left_cards & hand.BIG, left_cards & hand.SMALL
 
-    def _find_best_seq(self, hand_cards: List[str]) -> Tuple[List[str], List[str]]:
-        total_single_no = self.get_single_no(hand_cards)
-        best_shot, best_left_cards, best_single_no = [], [], total_single_no
+    def _find_best_seq(self, hand_cards: Hand) -> Tuple[List[Hand], Hand]:
+        total_single_no = hand.singles(hand_cards)
+        best_shot, best_left_cards, best_single_no = [], 0, total_single_no
 
         seq_specs = [f'seq_single{n}' for n in (12, 11, 10, 9, 8, 7, 6, 5)]
         for seq_spec in seq_specs:
             seq_single, left_cards = self._find_spec_type(hand_cards, seq_spec)
-            single_num = total_single_no - self.get_single_no(left_cards)
+            single_num = total_single_no - hand.singles(left_cards)
             if single_num < best_single_no:
                 best_shot = seq_single
                 best_left_cards = left_cards
@@ -178,20 +310,19 @@ class Rule(object):
             return best_shot, best_left_cards
         return [], hand_cards
 
-    def _find_spec_shot(self, hand_cards: List[str], specs: List[str], single: int) -> Optional[str]:
+    def _find_spec_shot(self, hand_cards: Hand, specs: List[str], single: int) -> Optional[Hand]:
         for spec in specs:
             seq, left_cards = self._find_spec_type(hand_cards, spec)
-            if seq and self.get_single_no(left_cards) <= single:
+            if seq and hand.singles(left_cards) <= single:
                 return seq[0]
         return None
 
-    def _find_spec_type(self, hand_cards: List[str], card_type: str) -> Tuple[List[str], List[str]]:
-        left_cards = [c for c in hand_cards]
+    def _find_spec_type(self, hand_cards: Hand, card_type: str) -> Tuple[List[Hand], Hand]:
+        left_cards = hand_cards
         result = []
-        for spec in self.rules[card_type]:
-            if self.is_contains(left_cards, spec):
-                for sp in spec:
-                    left_cards.remove(sp)
+        for _, spec in self._find_spec_candidates(hand_cards, card_type):
+            if hand.contains(left_cards, spec):
+                left_cards -= spec
                 result.append(spec)
 
         return result, left_cards
@@ -206,11 +337,11 @@ class Rule(object):
 
     def _expand_seq_once(self, seq: str, available: List[str]) -> Tuple[str, List[str]]:
         spec = f'seq_single{len(seq) + 1}'
-        if spec not in self.rules:
+        if spec not in self.hands:
             return seq, available
 
         for card in available:
-            if self.safe_index_of(self.rules[spec], seq + card) < 0:
+            if self.index.get(hand.from_cards(seq + card), ('',))[0] != spec:
                 continue
             available.remove(card)
             return seq + card, available
@@ -225,8 +356,8 @@ class Rule(object):
             if b_pokers:
                 return 1
 
-        a_card_type, a_card_value = self._get_cards_value(self._to_cards(a_pokers))
-        b_card_type, b_card_value = self._get_cards_value(self._to_cards(b_pokers))
+        a_card_type, a_card_value = self._get_cards_value(hand.from_pokers(a_pokers))
+        b_card_type, b_card_value = self._get_cards_value(hand.from_pokers(b_pokers))
         if a_card_type == b_card_type:
             return a_card_value - b_card_value
 
@@ -235,25 +366,19 @@ class Rule(object):
         else:
             return 0
 
-    def _get_cards_value(self, cards: List[str]) -> Tuple[str, int]:
-        cards = ''.join(cards)
-        if cards == 'wW':
+    def _get_cards_value(self, cards: Hand) -> Tuple[str, int]:
+        if cards == hand.ROCKET:
             return 'rocket', 22000
 
-        value = self.safe_index_of(self.rules['bomb'], cards)
-        if value >= 0:
-            return 'bomb', 20000 + value
-
-        return self._get_card_value(cards)
+        spec_value = self.index.get(cards)
+        if not spec_value:
+            logging.error('Unknown Card Type: %s', hand.to_cards(cards))
+            return '', 0
 
-    def _get_card_value(self, cards: str) -> Tuple[str, int]:
-        specs = self.cnt_to_specs.get(len(cards), [])
-        for spec in specs:
-            value = self.safe_index_of(self.rules[spec], cards)
-            if value >= 0:
-                return spec, value
-        logging.error('Unknown Card Type: %s', cards)
-        return '', 0
+        spec, value = spec_value
+        if spec == 'bomb':
+            return 'bomb', 20000 + value
+        return spec, value
 
     @staticmethod
     def _to_cards(pokers) -> List[str]:
@@ -360,12 +485,11 @@ class Rule(object):
         return hand_cards
 
 
-with open('static/rule.json', 'r') as f:
-    rule = Rule(json.load(f))
-    # from random import sample
-    # print(rule._find_best_shot([c for c in 'KKKKwW']))
-    # print(rule._find_follow_shot([c for c in 'KKKKAA22'], [c for c in '22'], False))
-    # print(rule._find_follow_shot([c for c in 'A22'], [c for c in 'A'], False))
-    # print(rule._find_follow_shot([c for c in 'KA222'], [c for c in 'AA'], False))
-    # rnd = sample(list(range(1, 55)), k=17)
-    # print(''.join(rule._to_cards(rnd)), ''.join(rule._to_cards(rule.find_best_shot(rnd))))
+rule = Rule(load_table(os.path.join(STATIC_ROOT, 'rule.json'), os.path.join(STATIC_ROOT, 'rule.bin')), RULE_CACHE_SIZE)
+# from random import sample
+# print(hand.to_cards(rule._find_best_shot(hand.from_cards('KKKKwW'))))
+# print(hand.to_cards(rule._find_follow_shot(hand.from_cards('KKKKAA22'), hand.from_cards('22'), False)))
+# print(hand.to_cards(rule._find_follow_shot(hand.from_cards('A22'), hand.from_cards('A'), False)))
+# print(hand.to_cards(rule._find_follow_shot(hand.from_cards('KA222'), hand.from_cards('AA'), False)))
+# rnd = sample(list(range(1, 55)), k=17)
+# print(''.join(rule._to_cards(rnd)), ''.join(rule._to_cards(rule.find_best_shot(rnd))))
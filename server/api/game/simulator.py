@@ -0,0 +1,196 @@
+import argparse
+import json
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from .components.policy import want_rob, is_free_shot, is_ally, should_pass, keep_rocket
+from .round import RoundMixin, MULTIPLE_DETAILS, poker_order
+from .rule import rule
+
+'''
+无界面的牌局模拟: 同步执行发牌、抢地主和出牌, 没有连接、定时器和 IOLoop
+规则和计分与 Room 相同 (RoundMixin), 机器人策略与 RobotPlayer 相同 (components.policy)
+
+    python -m api.game.simulator --games 100000 --workers 4 --seed 1
+
+第 i 局的发牌只由 seed 和 i 决定, 同样的 seed 和 games 得到同样的统计, 与 workers 和 chunk 无关
+'''
+
+
+class SimulationError(RuntimeError):
+    pass
+
+
+class SimPlayer(object):
+    __slots__ = ('seat', 'rob', 'landlord', 'hand_pokers')
+
+    def __init__(self, seat: int):
+        self.seat = seat
+        self.rob = -1
+        self.landlord = 0
+        self.hand_pokers: List[int] = []
+
+    def push_pokers(self, pokers: List[int]):
+        self.hand_pokers += pokers
+        self.hand_pokers.sort(key=poker_order)
+
+
+class SimGame(RoundMixin):
+
+    def __init__(self, seed: int):
+        rng = random.Random(seed)
+        pokers = list(range(1, 55))
+        rng.shuffle(pokers)
+
+        self._multiple_details = dict(MULTIPLE_DETAILS)
+        self.players = [SimPlayer(seat) for seat in range(3)]
+        for seat, player in enumerate(self.players):
+            player.push_pokers(pokers[seat * 17: (seat + 1) * 17])
+        self.pokers = pokers[51:]
+
+        # 和 Room 一样每局轮换第一个叫地主的人
+        self.landlord_seat = seed % 3
+        self.whose_turn = self.landlord_seat
+        self.last_shot_seat = 0
+        self.last_shot_poker: List[int] = []
+        self.shot_round: List[List[int]] = []
+
+    def play(self) -> Dict[str, Any]:
+        while True:
+            player = self.turn_player
+            player.rob = want_rob(player.hand_pokers)
+            if self.on_rob(player):
+                break
+
+        while True:
+            player = self.turn_player
+            hand = player.hand_pokers
+            if is_free_shot(self, player.seat):
+                pokers = rule.find_best_shot(hand)
+            elif should_pass(self, hand):
+                pokers = []
+            else:
+                pokers = keep_rocket(self, rule.find_best_follow(hand, self.last_shot_poker, is_ally(self)))
+
+            error = self.on_shot(player.seat, pokers)
+            if error:
+                raise SimulationError(f'seat {player.seat} shot {pokers}: {error}')
+            for poker in pokers:
+                hand.remove(poker)
+            if not hand:
+                break
+            self.go_next_turn()
+
+        spring, anti_spring, points = self.settle(player)
+        landlord = self.landlord
+        return {
+            'landlord': landlord.seat,
+            'winner': player.seat,
+            'landlord_win': landlord is player,
+            'spring': spring,
+            'anti_spring': anti_spring,
+            'bombs': self._multiple_details['bomb'].bit_length() - 1,
+            'multiple': self.multiple,
+            'shots': len(self.shot_round),
+            'landlord_point': points[landlord.seat],
+        }
+
+
+class SimStats(object):
+    FIELDS = ('games', 'landlord_wins', 'spring', 'anti_spring', 'bombs', 'bomb_games', 'shots', 'multiple',
+              'landlord_points', 'errors')
+
+    def __init__(self, state: Optional[Dict[str, int]] = None):
+        state = state or {}
+        for field in self.FIELDS:
+            setattr(self, field, state.get(field, 0))
+
+    def update(self, result: Dict[str, Any]):
+        self.games += 1
+        self.landlord_wins += result['landlord_win']
+        self.spring += result['spring']
+        self.anti_spring += result['anti_spring']
+        self.bombs += result['bombs']
+        self.bomb_games += result['bombs'] > 0
+        self.shots += result['shots']
+        self.multiple += result['multiple']
+        self.landlord_points += result['landlord_point']
+
+    def merge(self, other: 'SimStats'):
+        for field in self.FIELDS:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    def state(self) -> Dict[str, int]:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def report(self) -> Dict[str, Any]:
+        games = self.games or 1
+        return {
+            **self.state(),
+            'landlord_win_rate': self.landlord_wins / games,
+            'spring_rate': self.spring / games,
+            'anti_spring_rate': self.anti_spring / games,
+            'bombs_per_game': self.bombs / games,
+            'shots_per_game': self.shots / games,
+            'multiple_per_game': self.multiple / games,
+            'landlord_point_per_game': self.landlord_points / games,
+        }
+
+
+def play(seed: int) -> Dict[str, Any]:
+    return SimGame(seed).play()
+
+
+def run(seed: int, start: int, count: int) -> Dict[str, int]:
+    """
+    在一个进程里模拟第 start 到 start + count - 1 局
+    """
+    stats = SimStats()
+    for i in range(start, start + count):
+        try:
+            stats.update(play(game_seed(seed, i)))
+        except SimulationError:
+            stats.errors += 1
+    return stats.state()
+
+
+def game_seed(seed: int, i: int) -> int:
+    return seed * 1000003 + i
+
+
+def simulate(games: int, workers: int = 1, seed: int = 0, chunk: int = 1000) -> SimStats:
+    stats = SimStats()
+    chunks = [(seed, start, min(chunk, games - start)) for start in range(0, games, chunk)]
+    if workers <= 1:
+        for args in chunks:
+            stats.merge(SimStats(run(*args)))
+        return stats
+
+    with ProcessPoolExecutor(workers) as executor:
+        for state in executor.map(run, *zip(*chunks)):
+            stats.merge(SimStats(state))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m api.game.simulator', description='robot self-play')
+    parser.add_argument('--games', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk', type=int, default=1000, help='games per task sent to a worker')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    stats = simulate(args.games, args.workers, args.seed, args.chunk)
+    elapsed = time.perf_counter() - start
+    report = {**stats.report(), 'seed': args.seed, 'workers': args.workers, 'seconds': elapsed,
+              'games_per_second': stats.games / elapsed if elapsed else 0.0}
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import orjson
+from tornado.ioloop import IOLoop
+
+from .components.simple import RobotPlayer
+from .globalvar import GlobalVar
+from .room import Room
+from .timer import scheduler
+
+'''
+房间和玩家的快照, 停服(SIGTERM)时写入, 也可以定时写入; 启动时读取, 玩家重连后回到原来的牌局
+
+    version  格式版本
+    time     写入时间, 超过 max_age 的快照不恢复
+    rooms    Room.snapshot(), 其中 players 是 Player.snapshot()
+
+停服时用 export_room 逐个导出房间: 等房间队列里的消息处理完再导出, 然后断开真人玩家, 新的进程用 restore_room 恢复
+定时写入时不等待队列, 每次 IOLoop 迭代只序列化 CHUNK 个房间, 文件在线程中拼接和写入
+'''
+
+VERSION = 1
+# 定时快照每次 IOLoop 迭代序列化的房间数
+CHUNK = 100
+# 停服时等待每个房间队列处理完的秒数, 超时后直接导出
+DRAIN_TIMEOUT = 3.0
+
+
+class Snapshot(object):
+    path: Optional[str] = None
+    interval: float = 0
+
+    @staticmethod
+    async def dump_async(chunk: int = CHUNK) -> List[bytes]:
+        """
+        分批序列化房间, 每批之间让出 IOLoop; 每个房间在一批里完整序列化, 不会和它的消息交错
+        """
+        rooms = GlobalVar.rooms()
+        parts = []
+        for start in range(0, len(rooms), chunk):
+            if start:
+                await asyncio.sleep(0)
+            parts += [orjson.dumps(room.snapshot()) for room in rooms[start:start + chunk] if not room.is_empty()]
+        return parts
+
+    @classmethod
+    async def save_async(cls, path: Optional[str] = None):
+        """
+        定时写入
+        """
+        path = path or cls.path
+        now = time.time()
+        parts = await cls.dump_async()
+        await IOLoop.current().run_in_executor(None, _write, path, now, parts)
+
+    @classmethod
+    async def shutdown(cls, path: Optional[str] = None, timeout: float = DRAIN_TIMEOUT) -> int:
+        """
+        停服时导出所有房间并写入, 返回房间数
+        """
+        path = path or cls.path
+        start = time.perf_counter()
+        rooms = await asyncio.gather(*[cls.export_room(room.room_id, timeout)
+                                       for room in GlobalVar.rooms() if not room.is_empty()])
+        parts = [orjson.dumps(data) for data in rooms if data]
+        _write(path, time.time(), parts)
+        logging.info('SNAPSHOT %d ROOMS TO %s IN %.1fms', len(parts), path, (time.perf_counter() - start) * 1000)
+        return len(parts)
+
+    @classmethod
+    def start(cls, path: str, interval: float = 0):
+        cls.path = path
+        cls.interval = interval
+        if interval > 0:
+            scheduler.call_later(interval, cls._on_interval)
+
+    @classmethod
+    async def _on_interval(cls):
+        try:
+            await cls.save_async()
+        except OSError:
+            logging.exception('SNAPSHOT FAILED')
+        scheduler.call_later(cls.interval, cls._on_interval)
+
+    @classmethod
+    def load(cls, path: Optional[str] = None, max_age: float = 300) -> int:
+        """
+        恢复快照中的房间, 恢复后删除快照文件, 避免再次启动时重复恢复
+        不能恢复的快照改名留下, 便于排查或回滚到写入它的版本
+        """
+        path = path or cls.path
+        if not path or not os.path.exists(path):
+            return 0
+        with open(path, 'rb') as f:
+            try:
+                snapshot = orjson.loads(f.read())
+            except orjson.JSONDecodeError:
+                snapshot = {}
+        if not isinstance(snapshot, dict) or 'version' not in snapshot:
+            logging.warning('SNAPSHOT %s IS BROKEN, MOVED TO %s', path, cls._set_aside(path, 'broken'))
+            return 0
+
+        version = snapshot['version']
+        if version != VERSION:
+            logging.warning('SNAPSHOT %s VERSION %s NOT SUPPORTED, MOVED TO %s',
+                            path, version, cls._set_aside(path, f'v{version}'))
+            return 0
+        age = time.time() - snapshot['time']
+        if age > max_age:
+            logging.warning('SNAPSHOT %s IS %.0fs OLD, MOVED TO %s', path, age, cls._set_aside(path, 'old'))
+            return 0
+
+        for data in snapshot['rooms']:
+            cls.restore_room(data)
+        os.remove(path)
+        logging.info('SNAPSHOT RESTORED %d ROOMS FROM %s', len(snapshot['rooms']), path)
+        return len(snapshot['rooms'])
+
+    @staticmethod
+    def _set_aside(path: str, suffix: str) -> str:
+        target = f'{path}.{suffix}'
+        os.replace(path, target)
+        return target
+
+    @staticmethod
+    async def export_room(room_id: int, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        把房间移到其他进程: 等房间队列里的消息处理完后导出, 从本进程删除并断开真人玩家
+        玩家重连到新的进程后, 由新的进程用 restore_room 恢复的房间继续
+        """
+        room = GlobalVar.get_room(room_id)
+        if room is None:
+            return None
+        try:
+            await asyncio.wait_for(room.inbox.drain(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning('ROOM[%d] DRAIN TIMEOUT, EXPORTED WITH %d PENDING', room_id, room.inbox.depth)
+        data = room.snapshot()
+        sockets = [p.socket for p in room.players if p and not p.is_robot and p.socket]
+        GlobalVar.detach_room(room)
+        dropped = room.inbox.close()
+        for socket in sockets:
+            socket.close(4001, 'Room moved')
+        logging.info('ROOM[%d] EXPORTED, %d MESSAGES DROPPED', room_id, dropped)
+        return data
+
+    @staticmethod
+    def restore_room(data: Dict[str, Any]) -> Room:
+        room = Room(data['id'], data['level'], data['allow_robot'])
+        players = []
+        for p in data['players']:
+            if p is None:
+                players.append(None)
+                continue
+            if p['robot']:
+                player = RobotPlayer(p['uid'], p['name'], p['sex'], p['avatar'], room)
+            else:
+                player = GlobalVar.find_player(p['uid'], p['name'], p['sex'], p['avatar'])
+            player.restore(p, room)
+            players.append(player)
+        room.restore(data, players)
+        GlobalVar.restore_room(room)
+        return room
+
+
+def _write(path: str, now: float, rooms: List[bytes]):
+    """
+    rooms 是已经序列化的房间, 直接拼接成快照文件
+    """
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(orjson.dumps({'version': VERSION, 'time': now})[:-1] + b',"rooms":[')
+        f.write(b','.join(rooms))
+        f.write(b']}')
+    os.replace(tmp, path)
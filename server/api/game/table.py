@@ -0,0 +1,152 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Tuple, Sequence, Optional
+
+from . import hand
+from .hand import Hand
+
+'''
+Compiled rule table, header in little-endian, columns in the native byte order recorded in the header:
+
+    header   magic, version, byteorder, spec count, entry count, key count, sha256 of rule.json
+    specs    name, cards length, entry offset, entry count (for each spec, in rule order)
+    entries  uint64[entry count]  packed rank counts of every rule entry, spec by spec in rule order
+    keys     uint64[key count]    sorted unique packed rank counts
+    values   uint16[key count]    index of each key in its spec
+    spec_ids uint8[key count]     spec of each key, the first spec in rule order wins
+'''
+
+MAGIC = b'DDZR'
+VERSION = 1
+HEADER = struct.Struct('<4sHBBII32s')
+SPEC = struct.Struct('<24sBII')
+
+
+class PackedIndex(object):
+    """
+    packed rank counts -> (spec, value), binary searched over the sorted key column
+    """
+
+    def __init__(self, names: List[str], keys: Sequence[int], spec_ids: Sequence[int], values: Sequence[int]):
+        self._names = names
+        self._keys = keys
+        self._spec_ids = spec_ids
+        self._values = values
+
+    def get(self, key: Hand, default=None) -> Optional[Tuple[str, int]]:
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return self._names[self._spec_ids[i]], self._values[i]
+        return default
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class RuleTable(object):
+
+    def __init__(self, specs: Dict[str, Sequence[Hand]], sizes: Dict[str, int], index, digest: bytes = b''):
+        self.specs = specs
+        self.sizes = sizes
+        self.index = index
+        self.digest = digest
+        self._buffer = None
+
+    @classmethod
+    def from_json(cls, rules: Dict[str, List[str]], digest: bytes = b'') -> 'RuleTable':
+        specs: Dict[str, Sequence[Hand]] = {}
+        sizes: Dict[str, int] = {}
+        index: Dict[Hand, Tuple[str, int]] = {}
+        for name, specs_list in rules.items():
+            specs[name] = [hand.from_cards(cards) for cards in specs_list]
+            sizes[name] = len(specs_list[0])
+            for value, key in enumerate(specs[name]):
+                index.setdefault(key, (name, value))
+        return cls(specs, sizes, index, digest)
+
+    @classmethod
+    def from_buffer(cls, buffer) -> Optional['RuleTable']:
+        view = memoryview(buffer)
+        magic, version, byteorder, spec_no, entry_no, key_no, digest = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION or byteorder != (sys.byteorder == 'little'):
+            return None
+
+        offset = HEADER.size
+        names, layout = [], []
+        for _ in range(spec_no):
+            name, size, start, count = SPEC.unpack_from(view, offset)
+            offset += SPEC.size
+            names.append(name.rstrip(b'\0').decode())
+            layout.append((size, start, count))
+        offset = _align(offset)
+
+        entries = view[offset: offset + entry_no * 8].cast('Q')
+        offset += entry_no * 8
+        keys = view[offset: offset + key_no * 8].cast('Q')
+        offset += key_no * 8
+        values = view[offset: offset + key_no * 2].cast('H')
+        offset += key_no * 2
+        spec_ids = view[offset: offset + key_no]
+
+        specs = {name: entries[start: start + count] for name, (_, start, count) in zip(names, layout)}
+        sizes = {name: size for name, (size, _, _) in zip(names, layout)}
+        table = cls(specs, sizes, PackedIndex(names, keys, spec_ids, values), digest)
+        table._buffer = buffer
+        return table
+
+    def to_bytes(self) -> bytes:
+        names = list(self.specs.keys())
+        entries = array('Q')
+        layout = []
+        for name in names:
+            layout.append(SPEC.pack(name.encode(), self.sizes[name], len(entries), len(self.specs[name])))
+            entries.extend(self.specs[name])
+
+        index = sorted((key, self.index.get(key)) for key in set(entries))
+        keys = array('Q', [key for key, _ in index])
+        values = array('H', [value for _, (_, value) in index])
+        spec_ids = bytes(names.index(name) for _, (name, _) in index)
+
+        header = HEADER.pack(MAGIC, VERSION, sys.byteorder == 'little', len(names), len(entries), len(keys), self.digest)
+        body = header + b''.join(layout)
+        body += b'\0' * (_align(len(body)) - len(body))
+        return body + entries.tobytes() + keys.tobytes() + values.tobytes() + spec_ids
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def compile_file(json_path: str, bin_path: str):
+    with open(json_path, 'rb') as f:
+        content = f.read()
+    table = RuleTable.from_json(json.loads(content), hashlib.sha256(content).digest())
+    with open(bin_path, 'wb') as out:
+        out.write(table.to_bytes())
+
+
+def load_table(json_path: str, bin_path: str) -> RuleTable:
+    """
+    优先 mmap 编译好的规则表, 规则表缺失或与 rule.json 不一致时解析 rule.json
+    """
+    with open(json_path, 'rb') as f:
+        content = f.read()
+    digest = hashlib.sha256(content).digest()
+
+    if os.path.exists(bin_path) and os.path.getsize(bin_path) > HEADER.size:
+        with open(bin_path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        table = RuleTable.from_buffer(buffer)
+        if table and table.digest == digest:
+            return table
+        logging.warning('RULE TABLE %s IS STALE, run `python -m utils.generator compile`', bin_path)
+    else:
+        logging.warning('RULE TABLE %s NOT FOUND, run `python -m utils.generator compile`', bin_path)
+    return RuleTable.from_json(json.loads(content), digest)
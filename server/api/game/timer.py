@@ -1,37 +1,161 @@
+import heapq
+import itertools
 import time
-from typing import Callable
+from typing import Callable, Optional, List, Dict
 
 from tornado.ioloop import IOLoop
 
 
+class TimerHandle(object):
+    __slots__ = ('deadline', 'seq', 'callback', 'args', 'kwargs', 'cancelled', 'due')
+
+    def __init__(self, deadline: float, seq: int, callback: Callable, args, kwargs):
+        self.deadline = deadline
+        self.seq = seq
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+        # 已到期出堆, 回调在排队等待执行
+        self.due = False
+
+    def cancel(self):
+        """
+        到期后、回调执行前取消也有效
+        """
+        if not self.cancelled:
+            self.cancelled = True
+            self.callback = self.args = self.kwargs = None
+            if not self.due:
+                scheduler.on_cancel()
+
+    def __lt__(self, other: 'TimerHandle') -> bool:
+        return (self.deadline, self.seq) < (other.deadline, other.seq)
+
+
+class Scheduler(object):
+    """
+    进程内共享的定时器: 所有倒计时、机器人加入和思考时间放在一个最小堆里,
+    IOLoop 上只挂一个最早到期的 call_at
+    """
+
+    def __init__(self):
+        self._heap: List[TimerHandle] = []
+        self._seq = itertools.count()
+        self._cancelled = 0
+        self._timeout = None
+        self._timeout_deadline = 0.0
+        self._lag = 0.0
+        self._max_lag = 0.0
+
+    @property
+    def pending(self) -> int:
+        return len(self._heap) - self._cancelled
+
+    def stats(self) -> Dict[str, float]:
+        return {'pending': self.pending, 'lag': self._lag, 'max_lag': self._max_lag}
+
+    def call_later(self, delay: float, callback: Callable, *args, **kwargs) -> TimerHandle:
+        return self.call_at(IOLoop.current().time() + delay, callback, *args, **kwargs)
+
+    def call_at(self, deadline: float, callback: Callable, *args, **kwargs) -> TimerHandle:
+        handle = TimerHandle(deadline, next(self._seq), callback, args, kwargs)
+        heapq.heappush(self._heap, handle)
+        if self._heap[0] is handle:
+            self._arm()
+        return handle
+
+    def on_cancel(self):
+        self._cancelled += 1
+        if self._cancelled > 64 and self._cancelled > len(self._heap) // 2:
+            self._heap = [handle for handle in self._heap if not handle.cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled = 0
+
+    def _arm(self):
+        if not self._heap:
+            return
+        deadline = self._heap[0].deadline
+        if self._timeout is not None:
+            if self._timeout_deadline <= deadline:
+                return
+            IOLoop.current().remove_timeout(self._timeout)
+        self._timeout_deadline = deadline
+        self._timeout = IOLoop.current().call_at(deadline, self._on_tick)
+
+    def _on_tick(self):
+        self._timeout = None
+        loop = IOLoop.current()
+        now = loop.time()
+        while self._heap and self._heap[0].deadline <= now:
+            handle = heapq.heappop(self._heap)
+            if handle.cancelled:
+                self._cancelled -= 1
+                continue
+            self._lag = now - handle.deadline
+            self._max_lag = max(self._max_lag, self._lag)
+            handle.due = True
+            loop.add_callback(self._run, handle)
+        self._arm()
+
+    @staticmethod
+    def _run(handle: TimerHandle):
+        # 出堆后到执行前可能已被取消 (例如房间队列里的出牌已经开始了下一轮倒计时)
+        if handle.cancelled:
+            return None
+        callback, args, kwargs = handle.callback, handle.args, handle.kwargs
+        handle.cancel()
+        return callback(*args, **kwargs)
+
+
+scheduler = Scheduler()
+
+
 class Timer(object):
 
     def __init__(self, callback: Callable, timeout: int = 20):
         self._callback = callback
         self._timeout = timeout * 2
-        self._is_running = False
+        self._handle: Optional[TimerHandle] = None
+        # 每次计时加一, 过期的回调不再生效
+        self._generation = 0
         self._last_time = time.time()
 
     @property
     def timeout(self) -> int:
         return max(self._timeout - int(time.time() - self._last_time), 0)
 
+    @property
+    def is_running(self) -> bool:
+        return self._handle is not None
+
     def start_timing(self, timeout: int = 20):
         if timeout:
             self._timeout = timeout * 2
 
         self._last_time = time.time()
-        if not self._is_running:
-            IOLoop.current().call_later(1, self._on_time)
-        self._is_running = True
+        self._schedule()
+
+    def resume(self, remaining: int):
+        """
+        从快照恢复时按剩余秒数继续倒计时
+        """
+        self._timeout = remaining
+        self._last_time = time.time()
+        self._schedule()
 
     def stop_timing(self):
-        self._is_running = False
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+
+    def _schedule(self):
+        self.stop_timing()
+        self._generation += 1
+        self._handle = scheduler.call_later(self._timeout, self._on_time, self._generation)
 
-    def _on_time(self):
-        if self._is_running:
+    def _on_time(self, generation: int):
+        if generation != self._generation or self._handle is None:
             return
-        if time.time() - self._last_time >= self._timeout:
-            self._callback()
-        else:
-            IOLoop.current().call_later(1, self._on_time)
+        self._handle = None
+        self._callback()
@@ -1,17 +1,29 @@
-import json
 import logging
 from typing import Optional, Any, Dict, List, Union
 
 from tornado.escape import json_decode
-from tornado.web import authenticated
-from tornado.websocket import WebSocketHandler, WebSocketClosedError
+from tornado.web import authenticated, RequestHandler
+from tornado.websocket import WebSocketHandler, WebSocketClosedError, WebSocketProtocol
 
 from api.base import RestfulHandler, JwtMixin
-from models.base import AlchemyMixin
+from config import WS_COMPRESSION, LOG_PAYLOAD
+from models.base import AlchemyMixin, DatabaseStats
+from models.recorder import recorder
+from models.usercache import user_cache
+from utils.logs import sampled
+from .cluster import cluster, TOKEN_HEADER as CLUSTER_TOKEN_HEADER
+from .codec import CODECS, BinaryCodec, JsonCodec
+from .decision import Decision
+from .deflate import DeflateProtocol, DeflateStats
 from .globalvar import GlobalVar
+from .inbox import InboxStats, deepest
 from .player import Player
 from .protocol import Protocol
 from .room import Room
+from .worker import Worker, WorkerProxy, FORWARDED_HEADER
+
+req_logger = logging.getLogger('ddz.req')
+rsp_logger = logging.getLogger('ddz.rsp')
 
 
 class SocketHandler(WebSocketHandler, AlchemyMixin, JwtMixin):
@@ -19,6 +31,7 @@ class SocketHandler(WebSocketHandler, AlchemyMixin, JwtMixin):
     def __init__(self, application, request, **kwargs):
         super().__init__(application, request, **kwargs)
         self.player: Optional[Player] = None
+        self.proxy: Optional[WorkerProxy] = None
 
     def get_current_user(self):
         token = self.get_argument('token', None)
@@ -46,61 +59,115 @@ class SocketHandler(WebSocketHandler, AlchemyMixin, JwtMixin):
 
     @authenticated
     async def open(self):
+        address = self.route()
+        if address:
+            self.proxy = WorkerProxy(self)
+            if not await self.proxy.connect(address):
+                self.close(1011, 'Worker unavailable')
+            return
+
         self.player = GlobalVar.find_player(**self.current_user)
         self.player.socket = self
+        Worker.on_connect(1)
+        cluster.claim(self.player.uid, self.room.room_id if self.room else -1)
         logging.info('SOCKET[%s] OPEN', self.player.uid)
 
+    def route(self) -> Optional[str]:
+        """
+        玩家在其他集群节点的房间里, 或者属于其他 worker 时, 返回要转发到的地址
+        """
+        uid = self.current_user['uid']
+        forwarded = self.request.headers.get(FORWARDED_HEADER)
+        if forwarded:
+            if Worker.is_forwarded(forwarded, uid):
+                return None
+            logging.warning('SOCKET[%s] INVALID %s FROM %s', uid, FORWARDED_HEADER, self.request.remote_ip)
+        address = cluster.route(uid)
+        if address:
+            return address
+        worker = Worker.owner(self.current_user)
+        if worker != Worker.index:
+            return Worker.address(worker)
+        return None
+
     async def on_message(self, message):
+        if self.proxy:
+            self.proxy.write_message(message)
+            return
+
         if message == 'ping':
             self._write_message('pong')
             return
 
-        code, packet = self.decode_message(message)
+        code, packet = self.codec.decode(message)
         if code is None:
             self.write_message([Protocol.ERROR, {'reason': 'Protocol cannot be resolved'}])
             return
 
-        logging.info('REQ[%d]: %s', self.uid, message)
+        if sampled(req_logger):
+            req_logger.info('REQ[%d]: %s', self.uid, message if LOG_PAYLOAD else code)
 
         if code == Protocol.REQ_ROOM_LIST:
-            self.write_message([Protocol.RSP_ROOM_LIST, {'rooms': GlobalVar.room_list()}])
+            self._write_message(GlobalVar.room_list_message(self.codec), self.codec.binary)
             return
 
-        await self.player.on_message(code, packet)
+        # 在房间里的玩家的消息交给房间的队列处理, 大厅里的直接处理
+        room = self.room
+        if room:
+            await room.inbox.put(self.player.on_message, code, packet)
+        else:
+            await self.player.on_message(code, packet)
 
     def on_close(self):
+        if self.proxy:
+            self.proxy.close()
+            return
+        if self.player is None:
+            return
+        Worker.on_connect(-1)
         self.player.on_disconnect()
+        if not self.player.room:
+            cluster.release(self.player.uid)
         logging.info('SOCKET[%s] CLOSED[%s %s]', self.player.uid, self.close_code, self.close_reason)
 
     def check_origin(self, origin: str) -> bool:
         return True
 
+    def select_subprotocol(self, subprotocols: List[str]) -> Optional[str]:
+        if BinaryCodec.name in subprotocols:
+            return BinaryCodec.name
+        return None
+
+    @property
+    def codec(self):
+        return CODECS.get(self.selected_subprotocol, JsonCodec)
+
     def get_compression_options(self) -> Optional[Dict[str, Any]]:
-        return {'compression_level': 6, 'mem_level': 9}
+        return WS_COMPRESSION
+
+    def get_websocket_protocol(self) -> Optional[WebSocketProtocol]:
+        return DeflateProtocol.create(self)
 
     def write_message(self, message: List[Union[Protocol, Dict[str, Any]]], binary=False) -> Optional[None]:
-        packet = json.dumps(message)
-        self._write_message(packet, binary)
+        codec = self.codec
+        self._write_message(codec.encode(message), codec.binary)
+
+    def write_frame(self, frame: bytes):
+        """
+        发送已按 self.codec 编码好的消息, 广播时同一份数据每种编码只编码一次
+        """
+        self._write_message(frame, self.codec.binary)
 
     def _write_message(self, message, binary=False):
         if self.ws_connection is None:
             return
         try:
             future = self.ws_connection.write_message(message, binary=binary)
-            logging.info('RSP[%d]: %s', self.uid, message)
+            if sampled(rsp_logger):
+                rsp_logger.info('RSP[%d]: %s', self.uid, message if LOG_PAYLOAD else len(message))
         except WebSocketClosedError:
             logging.error('WebSockedClosed[%s][%s]', self.uid, message)
 
-    @staticmethod
-    def decode_message(message):
-        try:
-            code, packet = json.loads(message)
-            if isinstance(code, int) and isinstance(packet, dict):
-                return code, packet
-        except (json.decoder.JSONDecodeError, ValueError):
-            logging.error('ERROR MESSAGE: %s', message)
-        return None, None
-
 
 class AdminHandler(RestfulHandler):
     required_fields = ('allow_robot',)
@@ -110,7 +177,17 @@ class AdminHandler(RestfulHandler):
         if self.current_user['uid'] != 1:
             self.send_error(403, reason='Forbidden')
             return
-        self.write({'allow_robot': self.application.allow_robot})
+        self.write({
+            'allow_robot': self.application.allow_robot,
+            'compression': DeflateStats.stats(),
+            'record': recorder.stats(),
+            'user_cache': user_cache.stats(),
+            'database': DatabaseStats.stats(),
+            'worker': Worker.stats(),
+            'cluster': cluster.stats(),
+            'inbox': {**InboxStats.stats(), 'deepest': deepest([room.inbox for room in GlobalVar.rooms()])},
+            'decision': Decision.stats(),
+        })
 
     @authenticated
     def post(self):
@@ -119,3 +196,47 @@ class AdminHandler(RestfulHandler):
             return
         self.application.allow_robot = bool(self.get_body_argument('allow_robot'))
         self.write({'allow_robot': self.application.allow_robot})
+
+
+class WorkerRoomHandler(RequestHandler):
+    """
+    其他 worker 询问玩家在本 worker 的房间
+    """
+
+    def get(self):
+        uid = int(self.get_query_argument('uid'))
+        if not Worker.is_forwarded(self.request.headers.get(FORWARDED_HEADER), uid):
+            self.send_error(403)
+            return
+        self.write({'room': GlobalVar.find_player_room_id(uid)})
+
+    def data_received(self, chunk):
+        pass
+
+
+class ClusterHandler(WebSocketHandler):
+    """
+    接收其他集群节点发布的消息
+    """
+
+    def get_current_user(self) -> Optional[str]:
+        if cluster.enabled and hasattr(cluster.bus, 'verify'):
+            return cluster.bus.verify(self.request.headers.get(CLUSTER_TOKEN_HEADER))
+        return None
+
+    async def get(self, *args, **kwargs):
+        if not self.current_user:
+            self.set_status(403)
+            self.finish()
+            return
+        await super().get(*args, **kwargs)
+
+    def open(self):
+        logging.info('CLUSTER NODE %s CONNECTED IN', self.current_user)
+
+    def on_message(self, message):
+        if cluster.enabled:
+            cluster.bus.receive(message)
+
+    def data_received(self, chunk):
+        pass
@@ -0,0 +1,289 @@
+import asyncio
+import gc
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+import orjson
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError, HTTPRequest
+from tornado.web import create_signed_value, decode_signed_value
+from tornado.websocket import websocket_connect, WebSocketClientConnection, WebSocketClosedError
+
+from config import SECRET_KEY
+
+if TYPE_CHECKING:
+    from .views import SocketHandler
+
+'''
+多进程模式: 启动时 fork 出 count 个 worker, 每个 worker 有自己的房间和玩家, 同一个房间的玩家都在同一个进程
+
+    公共端口    所有 worker 共享, 处理登录等无状态请求和 websocket
+    内部端口    每个 worker 一个 (WORKER_PORT + index), 只监听 127.0.0.1
+    分配        登录时先询问其他 worker 玩家是否在房间里, 在的话分配给那个 worker, 否则分配给连接数最少的 worker
+                写入 token 和 cookie, 之后一直连到这个 worker
+    大厅人数    每个 worker 把自己各等级的人数写到共享数组, 大厅显示所有 worker 之和
+    转发        websocket 连到了其他 worker 时, 由该 worker 转发到所属 worker 的内部端口
+
+前面有 nginx 时可以按 cookie 直接连到所属 worker, 不需要转发:
+
+    map $cookie_ddz_worker $ddz_worker { default 127.0.0.1:8081; 1 127.0.0.1:8082; }
+    location /ws { proxy_pass http://$ddz_worker; ... }
+
+规则表在 fork 前加载, fork 前 gc.freeze() 避免子进程的 GC 改写共享的内存页
+'''
+
+COOKIE = 'ddz_worker'
+# 转发的连接带上这个头, 收到的一方不再转发, 避免两边的路由不一致时来回转发
+# 值是用 SECRET_KEY 签名的 uid, 客户端自己带上这个头不能绕过路由
+FORWARDED_HEADER = 'X-Ddz-Forwarded'
+FORWARDED_NAME = 'ddz_forwarded'
+# 询问其他 worker 玩家所在的房间, 请求头同样是签名的 uid
+ROOM_PATH = '/worker/room'
+# 共享人数的等级 1 .. MAX_LEVEL
+MAX_LEVEL = 8
+
+
+class Worker(object):
+    index: int = 0
+    count: int = 1
+    port_base: int = 0
+    # 每个 worker 的连接数, fork 前创建, 每个 worker 只写自己的位置
+    loads: Optional[Any] = None
+    # 每个 worker 各等级的人数, 第 index 行第 level - 1 列
+    levels: Optional[Any] = None
+    proxied: int = 0
+    _children: Dict[int, int] = {}
+    _stopping: bool = False
+
+    @classmethod
+    def prefork(cls, count: int, port_base: int, max_restarts: int = 100) -> int:
+        """
+        在父进程中调用, 必须在创建 IOLoop 之前; 子进程返回自己的 index, 父进程等待所有子进程退出后结束
+        子进程异常退出时重新 fork
+        """
+        cls.count = max(count, 1)
+        cls.port_base = port_base
+        cls.loads = multiprocessing.Array('i', cls.count, lock=False)
+        cls.levels = multiprocessing.Array('i', cls.count * MAX_LEVEL, lock=False)
+        if cls.count == 1:
+            return 0
+
+        gc.freeze()
+        for i in range(cls.count):
+            if cls._spawn(i):
+                return i
+
+        signal.signal(signal.SIGTERM, cls._on_signal)
+        signal.signal(signal.SIGINT, cls._on_signal)
+        restarts = 0
+        while cls._children:
+            pid, status = os.wait()
+            index = cls._children.pop(pid, None)
+            if index is None:
+                continue
+            cls.loads[index] = 0
+            if cls._stopping or os.waitstatus_to_exitcode(status) == 0:
+                logging.info('WORKER[%d] PID[%d] EXITED', index, pid)
+                continue
+            logging.warning('WORKER[%d] PID[%d] EXITED WITH %d, RESTART', index, pid, os.waitstatus_to_exitcode(status))
+            restarts += 1
+            if restarts > max_restarts:
+                raise RuntimeError('Too many worker restarts')
+            if cls._spawn(index):
+                return index
+        sys.exit(0)
+
+    @classmethod
+    def _spawn(cls, index: int) -> bool:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            cls.index = index
+            cls._children = {}
+            return True
+        cls._children[pid] = index
+        logging.info('WORKER[%d] PID[%d] STARTED', index, pid)
+        return False
+
+    @classmethod
+    def _on_signal(cls, signum, frame):
+        cls._stopping = True
+        for pid in list(cls._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    @classmethod
+    def is_multi(cls) -> bool:
+        return cls.count > 1
+
+    @classmethod
+    def port(cls, index: int) -> int:
+        return cls.port_base + index
+
+    @classmethod
+    def address(cls, index: int) -> str:
+        return f'ws://127.0.0.1:{cls.port(index)}'
+
+    @classmethod
+    def path(cls, path: str) -> str:
+        """
+        每个 worker 单独的文件, 例如快照和落盘的牌局记录
+        """
+        return f'{path}.{cls.index}' if cls.is_multi() else path
+
+    @classmethod
+    def assign(cls, user: Optional[Dict[str, Any]] = None) -> int:
+        """
+        已分配过的用户保持原来的 worker, 否则分配给连接数最少的 worker
+        """
+        worker = (user or {}).get('worker')
+        if isinstance(worker, int) and 0 <= worker < cls.count:
+            return worker
+        loads = cls.loads or [0]
+        return min(range(cls.count), key=lambda i: loads[i])
+
+    @classmethod
+    def owner(cls, user: Dict[str, Any]) -> int:
+        worker = user.get('worker')
+        if isinstance(worker, int) and 0 <= worker < cls.count:
+            return worker
+        return user['uid'] % cls.count
+
+    @staticmethod
+    def sign_forwarded(uid: int) -> str:
+        return create_signed_value(SECRET_KEY, FORWARDED_NAME, str(uid)).decode()
+
+    @staticmethod
+    def is_forwarded(token: Optional[str], uid: int) -> bool:
+        value = decode_signed_value(SECRET_KEY, FORWARDED_NAME, token, max_age_days=1) if token else None
+        return value is not None and value.decode() == str(uid)
+
+    @classmethod
+    def on_connect(cls, delta: int):
+        if cls.loads is not None:
+            cls.loads[cls.index] += delta
+
+    @classmethod
+    def publish_levels(cls, levels: Dict[int, int]):
+        if not cls.is_multi():
+            return
+        row = cls.index * MAX_LEVEL
+        for level, number in levels.items():
+            if 1 <= level <= MAX_LEVEL:
+                cls.levels[row + level - 1] = number
+
+    @classmethod
+    def remote_levels(cls) -> Dict[int, int]:
+        """
+        其他 worker 各等级的人数之和
+        """
+        levels: Dict[int, int] = {}
+        if not cls.is_multi():
+            return levels
+        for i in range(cls.count):
+            if i == cls.index:
+                continue
+            for level in range(1, MAX_LEVEL + 1):
+                number = cls.levels[i * MAX_LEVEL + level - 1]
+                if number:
+                    levels[level] = levels.get(level, 0) + number
+        return levels
+
+    @classmethod
+    def levels_version(cls) -> Optional[bytes]:
+        """
+        共享人数的当前值, 变化时重新生成大厅列表
+        """
+        return bytes(memoryview(cls.levels).cast('B')) if cls.is_multi() else None
+
+    @classmethod
+    async def find_room(cls, uid: int, timeout: float = 1.0) -> Tuple[int, int]:
+        """
+        询问其他 worker 玩家所在的房间, 返回 (worker, room_id), 都不在房间里时返回 (-1, -1)
+        """
+        headers = {FORWARDED_HEADER: cls.sign_forwarded(uid)}
+        others = [i for i in range(cls.count) if i != cls.index]
+        responses = await asyncio.gather(*[
+            AsyncHTTPClient().fetch(HTTPRequest(f'http://127.0.0.1:{cls.port(i)}{ROOM_PATH}?uid={uid}',
+                                                headers=headers, request_timeout=timeout))
+            for i in others
+        ], return_exceptions=True)
+        for i, response in zip(others, responses):
+            if isinstance(response, (HTTPClientError, OSError, asyncio.TimeoutError)):
+                logging.warning('WORKER[%d] FIND ROOM ON WORKER[%d] FAILED: %s', cls.index, i, response)
+                continue
+            if isinstance(response, BaseException):
+                raise response
+            room_id = orjson.loads(response.body)['room']
+            if room_id != -1:
+                return i, room_id
+        return -1, -1
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        return {
+            'index': cls.index,
+            'count': cls.count,
+            'loads': list(cls.loads) if cls.loads is not None else [],
+            'proxied': cls.proxied,
+        }
+
+
+class WorkerProxy(object):
+    """
+    把连到当前进程的 websocket 原样转发给所属的 worker 或集群节点, 内部连接不压缩
+    """
+
+    def __init__(self, handler: 'SocketHandler'):
+        self.handler = handler
+        self.upstream: Optional[WebSocketClientConnection] = None
+
+    async def connect(self, address: str) -> bool:
+        """
+        address: ws://host:port
+        """
+        request = self.handler.request
+        url = address + request.path
+        if request.query:
+            url += '?' + request.query
+        headers = {FORWARDED_HEADER: Worker.sign_forwarded(self.handler.current_user['uid'])}
+        if 'Cookie' in request.headers:
+            headers['Cookie'] = request.headers['Cookie']
+        subprotocols: List[str] = [self.handler.selected_subprotocol] if self.handler.selected_subprotocol else []
+        try:
+            self.upstream = await websocket_connect(HTTPRequest(url, headers=headers),
+                                                    on_message_callback=self.on_upstream_message,
+                                                    subprotocols=subprotocols)
+        except Exception:
+            logging.exception('WORKER[%d] PROXY TO %s FAILED', Worker.index, address)
+            return False
+        Worker.proxied += 1
+        return True
+
+    def on_upstream_message(self, message):
+        if message is None:
+            self.handler.close()
+            return
+        if self.handler.ws_connection:
+            try:
+                self.handler.ws_connection.write_message(message, binary=isinstance(message, bytes))
+            except WebSocketClosedError:
+                self.close()
+
+    def write_message(self, message):
+        if self.upstream:
+            try:
+                self.upstream.write_message(message, binary=isinstance(message, bytes))
+            except WebSocketClosedError:
+                self.handler.close()
+
+    def close(self):
+        if self.upstream:
+            self.upstream.close()
+            self.upstream = None
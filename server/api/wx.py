@@ -6,8 +6,6 @@ from typing import Optional, Awaitable, Dict, Union
 from xml.etree import ElementTree
 from xml.etree.ElementTree import Element
 
-from sqlalchemy import select
-from sqlalchemy.dialects.mysql import insert
 from tornado import httpclient
 from tornado.escape import json_decode, json_encode
 from tornado.web import RequestHandler
@@ -16,7 +14,7 @@ from api.base import JwtMixin
 from api.game.globalvar import GlobalVar
 from config import WECHAT_CONFIG
 from models.base import AlchemyMixin
-from models import User
+from models.usercache import user_cache
 
 logger = logging.getLogger(__name__)
 
@@ -80,9 +78,13 @@ class WechatHandler(RequestHandler, AlchemyMixin, JwtMixin):
                 current_user = await self.fetch_user_from_net(code)
                 self.set_secure_cookie('social', json_encode(current_user), expires_days=7)
 
+            # 玩家在某个 worker 的房间里时, token 里带上那个 worker, 连接会转发过去
+            worker, room_id = await GlobalVar.locate_player(current_user['uid'])
+            if worker != -1:
+                current_user = {**current_user, 'worker': worker}
             payload = {
                 **current_user,
-                'room': GlobalVar.find_player_room_id(current_user['uid']),
+                'room': room_id,
                 'rooms': GlobalVar.room_list(),
                 'token': self.jwt_encode(current_user)
             }
@@ -95,8 +97,8 @@ class WechatHandler(RequestHandler, AlchemyMixin, JwtMixin):
         current_user = json_decode(cookie)
         if not current_user or not current_user.get('uid'):
             return {}
-        account: User = await self.get_one_or_none(select(User).where(User.id == current_user['uid']))
-        return account.to_dict() if account else {}
+        account = await user_cache.get_by_uid(current_user['uid'])
+        return account or {}
 
     async def fetch_user_from_net(self, code) -> Dict[str, Union[int, str]]:
         access_token, openid, unionid = await self.fetch_access_token(code)
@@ -105,16 +107,8 @@ class WechatHandler(RequestHandler, AlchemyMixin, JwtMixin):
         sex = response_json.get('sex')
         avatar = response_json.get('headimgurl')
 
-        insert_stmt = insert(User).values(openid=openid, name=name, sex=sex, avatar=avatar)
-        uid = await self.insert_or_update(
-            insert_stmt,
-            name=insert_stmt.inserted.name,
-            sex=insert_stmt.inserted.sex,
-            avatar=insert_stmt.inserted.avatar,
-        )
-        if uid == 0:
-            uid = (await self.get_one_or_none(select(User).where(User.openid == openid))).id
-        return {'uid': uid, 'name': name, 'sex': sex, 'avatar': avatar}
+        account = await user_cache.upsert(openid=openid, name=name, sex=sex, avatar=avatar)
+        return {'uid': account['uid'], 'name': name, 'sex': sex, 'avatar': avatar}
 
     def data_received(self, chunk: bytes) -> Optional[Awaitable[None]]:
         pass
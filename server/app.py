@@ -1,19 +1,31 @@
 import asyncio
-import logging.config
+import logging
+import signal
 from concurrent.futures import ThreadPoolExecutor
 
 import tornado.locks
 import tornado.web
 import tornado.websocket
 import uvloop
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
 from tornado.process import cpu_count
 
 from api.auth import IndexHandler, LoginHandler, UserInfoHandler
-from api.game.views import SocketHandler
+from api.game.cluster import cluster, PeerBus
+from api.game.decision import Decision
+from api.game.globalvar import GlobalVar
+from api.game.snapshot import Snapshot
+from api.game.views import SocketHandler, AdminHandler, ClusterHandler, WorkerRoomHandler
+from api.game.worker import Worker, ROOM_PATH as WORKER_ROOM_PATH
 from api.wx import WechatConfig, WechatHandler
-from config import DEBUG, LOGGING, PORT, SECRET_KEY, TEMPLATE_ROOT, STATIC_ROOT, STATIC_URL
+from models.recorder import recorder
+from config import DEBUG, LOGGING, PORT, SECRET_KEY, TEMPLATE_ROOT, STATIC_ROOT, STATIC_URL, ROBOT_WORKERS, \
+    ROBOT_DECISION_TIMEOUT, MATCH_INTERVAL, LOG_SAMPLING, LOG_QUEUE_SIZE, SNAPSHOT_PATH, SNAPSHOT_INTERVAL, \
+    SNAPSHOT_MAX_AGE, WORKERS, WORKER_PORT, CLUSTER_NODES, CLUSTER_INDEX, CLUSTER_HEARTBEAT
+from utils.logs import setup_logging, parse_sampling
 
-logging.config.dictConfig(LOGGING)
+setup_logging(LOGGING, parse_sampling(LOG_SAMPLING), LOG_QUEUE_SIZE)
 
 
 class Application(tornado.web.Application):
@@ -35,21 +47,69 @@ class Application(tornado.web.Application):
             ('/login', LoginHandler),
             ('/userinfo', UserInfoHandler),
             ('/ws', SocketHandler),
+            ('/admin', AdminHandler),
+            ('/cluster', ClusterHandler),
+            (WORKER_ROOM_PATH, WorkerRoomHandler),
             ('/social/config', WechatConfig),
             ('/social/index', WechatHandler),
         ]
         super().__init__(url_patterns, **settings)
-        self.executor = ThreadPoolExecutor(cpu_count() * 2)
+        self.executor = ThreadPoolExecutor(max(cpu_count() * 2 // Worker.count, 2))
+        self.robot_executor = Decision.start(ROBOT_WORKERS, ROBOT_DECISION_TIMEOUT)
         self.allow_robot = True
+        recorder.start()
+        if MATCH_INTERVAL:
+            GlobalVar.start_matcher(MATCH_INTERVAL)
 
 
-async def main():
+async def main(sockets):
+    # 每个 worker 的房间号、快照和落盘文件互不重复
+    GlobalVar.total_room_count, GlobalVar.room_id_step = Worker.index, Worker.count
+    recorder.spool_path = Worker.path(recorder.spool_path)
+    if CLUSTER_NODES:
+        # 集群中每个节点的房间号按节点数间隔
+        node = CLUSTER_NODES[CLUSTER_INDEX]
+        GlobalVar.total_room_count, GlobalVar.room_id_step = CLUSTER_INDEX, len(CLUSTER_NODES)
+        cluster.start(node, PeerBus(node, CLUSTER_NODES, SECRET_KEY), CLUSTER_HEARTBEAT,
+                      GlobalVar.invalidate_room_list, GlobalVar.on_player_moved)
     app = Application()
-    app.listen(PORT)
-    logging.info(f'server on http://127.0.0.1:{PORT}')
-    await asyncio.Event().wait()
+    Snapshot.start(Worker.path(SNAPSHOT_PATH), SNAPSHOT_INTERVAL)
+    Snapshot.load(max_age=SNAPSHOT_MAX_AGE)
+    server = HTTPServer(app)
+    server.add_sockets(sockets)
+    if Worker.is_multi():
+        server.listen(Worker.port(Worker.index), '127.0.0.1')
+    logging.info(f'server on http://127.0.0.1:{PORT} worker {Worker.index}/{Worker.count}')
+
+    stopping = asyncio.Event()
+    stopped = asyncio.Event()
+
+    async def stop():
+        try:
+            await Snapshot.shutdown()
+        finally:
+            stopped.set()
+
+    def on_term():
+        # 多进程时 worker 可能同时收到自己的和父进程转发的 SIGTERM
+        if stopping.is_set():
+            return
+        stopping.set()
+        asyncio.ensure_future(stop())
+
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, on_term)
+    try:
+        await stopped.wait()
+    finally:
+        cluster.close()
+        await recorder.close()
 
 
 if __name__ == '__main__':
+    # 先监听公共端口再 fork, 所有 worker 共享; 规则表已在 import 时加载
+    if CLUSTER_NODES and WORKERS > 1:
+        raise ValueError('cluster mode runs one process per node, set WORKERS=1')
+    sockets = bind_sockets(int(PORT))
+    Worker.prefork(WORKERS, WORKER_PORT)
     uvloop.install()
-    asyncio.run(main())
+    asyncio.run(main(sockets))
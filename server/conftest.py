@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 测试和服务器一样从 server 目录导入 api, models, config
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -1,7 +1,8 @@
 from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, TIMESTAMP, JSON, SMALLINT
+from sqlalchemy import Column, Integer, String, TIMESTAMP, JSON, SMALLINT, LargeBinary
 
+from models import gamelog
 from models.base import Base
 
 
@@ -29,6 +30,11 @@ class Record(Base):
     __tablename__ = 'record'
     __table_args__ = {'mysql_collate': 'utf8mb4_general_ci'}
     id = Column(Integer, primary_key=True)
-    round = Column(JSON, default={})
+    # 旧记录是 JSON, 新记录写在 log 里, 见 models/gamelog.py
+    round = Column(JSON)
+    log = Column(LargeBinary)
     robot = Column(SMALLINT, default=1)
-    last_modified = Column(TIMESTAMP, default=datetime.now, onupdate=datetime.now)
\ No newline at end of file
+    last_modified = Column(TIMESTAMP, default=datetime.now, onupdate=datetime.now)
+
+    def game(self):
+        return gamelog.decode(self.log) if self.log else self.round
\ No newline at end of file
@@ -1,18 +1,128 @@
+import time
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event
 from sqlalchemy.dialects.mysql import Insert
-from sqlalchemy.engine import Result, ScalarResult, CursorResult
+from sqlalchemy.engine import Result, ScalarResult, CursorResult, Row
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.sql import Select
 
 __all__ = ('AlchemyMixin', 'Base')
 
-from config import DATABASE_URI
+from config import DATABASE_URI, DATABASE_ECHO, DATABASE_POOL
+
+
+class DatabaseStats(object):
+    """
+    连接池和 SQL 耗时统计, 用于按同时进行的牌局数调整连接池大小
+    """
+    max_statements = 200
+    statements: Dict[str, List[float]] = {}
+    checkouts = 0
+    checkout_wait = 0.0
+    max_checkout_wait = 0.0
+    in_use = 0
+    max_in_use = 0
+
+    @classmethod
+    def on_statement(cls, statement: str, elapsed: float):
+        key = ' '.join(statement.split())[:160]
+        stat = cls.statements.get(key)
+        if stat is None:
+            if len(cls.statements) >= cls.max_statements:
+                key = 'OTHER'
+                stat = cls.statements.setdefault(key, [0, 0.0, 0.0])
+            else:
+                stat = cls.statements[key] = [0, 0.0, 0.0]
+        stat[0] += 1
+        stat[1] += elapsed
+        stat[2] = max(stat[2], elapsed)
+
+    @classmethod
+    def on_checkout_wait(cls, elapsed: float):
+        cls.checkouts += 1
+        cls.checkout_wait += elapsed
+        cls.max_checkout_wait = max(cls.max_checkout_wait, elapsed)
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        return {
+            'pool': engine.pool.status(),
+            'in_use': cls.in_use,
+            'max_in_use': cls.max_in_use,
+            'checkouts': cls.checkouts,
+            'checkout_wait': cls.checkout_wait / cls.checkouts if cls.checkouts else 0.0,
+            'max_checkout_wait': cls.max_checkout_wait,
+            'statements': {
+                key: {'count': count, 'avg': total / count, 'max': longest}
+                for key, (count, total, longest) in cls.statements.items()
+            },
+        }
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    记录从连接池取连接的等待时间, 包括连接池满时等待归还和新建连接
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DatabaseStats.on_checkout_wait(time.perf_counter() - start)
+
+
+def create_engine(uri: str):
+    if uri.startswith('sqlite'):
+        # SQLite 没有连接池可调
+        return create_async_engine(uri, echo=DATABASE_ECHO)
+    return create_async_engine(uri, echo=DATABASE_ECHO, poolclass=TimedQueuePool, **DATABASE_POOL)
+
 
 Base = declarative_base()
-engine = create_async_engine(DATABASE_URI, echo=True)
+engine = create_engine(DATABASE_URI)
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
+@event.listens_for(engine.sync_engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(engine.sync_engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    DatabaseStats.on_statement(statement, time.perf_counter() - conn.info['query_start'].pop())
+
+
+@event.listens_for(engine.sync_engine, 'checkout')
+def on_checkout(dbapi_connection, connection_record, connection_proxy):
+    DatabaseStats.in_use += 1
+    DatabaseStats.max_in_use = max(DatabaseStats.max_in_use, DatabaseStats.in_use)
+
+
+@event.listens_for(engine.sync_engine, 'checkin')
+def on_checkin(dbapi_connection, connection_record):
+    DatabaseStats.in_use -= 1
+
+
+async def fetch_one(stmt: Select) -> Optional[Row]:
+    """
+    只读查询直接使用连接, 不创建 ORM session 和事务
+    """
+    async with engine.connect() as conn:
+        result: Result = await conn.execute(stmt)
+        return result.first()
+
+
+async def fetch_all(stmt: Select) -> List[Row]:
+    async with engine.connect() as conn:
+        result: Result = await conn.execute(stmt)
+        return result.all()
+
+
 class AlchemyMixin:
     async def get_one_or_none(self, stmt: Select):
         async with self.session as session:
@@ -26,6 +136,12 @@ class AlchemyMixin:
                 result: Result = await session.execute(stmt)
                 return result.scalars()
 
+    async def fetch_one(self, stmt: Select) -> Optional[Row]:
+        return await fetch_one(stmt)
+
+    async def fetch_all(self, stmt: Select) -> List[Row]:
+        return await fetch_all(stmt)
+
     async def insert(self, instance):
         async with self.session as session:
             async with session.begin():
@@ -0,0 +1,100 @@
+import zlib
+from typing import Any, Dict, List
+
+'''
+牌局记录的二进制格式, 代替 Record.round 里的 JSON
+
+    version  uint8   格式版本, 当前为 1
+    flags    uint8   bit0 为 1 表示 body 经过 raw deflate 压缩
+    body
+        lord    uint8                   地主座位
+        left    3 * (uint8 张数 + 牌)   每个座位剩下的牌, 按座位顺序
+        round   出牌记录, 直到 body 结束:
+                0x01 - 0x14  出牌张数, 后面跟着每张牌 1 字节
+                0x80 | n     连续 n 次不出 (1 <= n <= 127)
+
+牌用 1-54 表示, 与游戏中一致
+'''
+
+VERSION = 1
+FLAG_DEFLATE = 0x01
+PASS = 0x80
+MAX_PASS = 0x7f
+MAX_SHOT = 20
+SEATS = 3
+
+
+class GameLogError(ValueError):
+    pass
+
+
+def encode(game: Dict[str, Any], compress: bool = False) -> bytes:
+    """
+    game: {'left': {seat: pokers}, 'round': [pokers], 'lord': seat}, seat 可以是 int 或 str (数据库里的 JSON)
+    compress 时只在压缩后更短时才压缩, 牌局很短, 压缩率不高, 解码也更慢
+    """
+    left = {int(seat): pokers for seat, pokers in game['left'].items()}
+    body = bytearray([game['lord']])
+    for seat in range(SEATS):
+        pokers = left.get(seat, [])
+        body.append(len(pokers))
+        body.extend(pokers)
+
+    passes = 0
+    for pokers in game['round']:
+        if not pokers:
+            passes += 1
+            if passes == MAX_PASS:
+                body.append(PASS | passes)
+                passes = 0
+            continue
+        if passes:
+            body.append(PASS | passes)
+            passes = 0
+        if len(pokers) > MAX_SHOT:
+            raise GameLogError(f'shot of {len(pokers)} cards')
+        body.append(len(pokers))
+        body.extend(pokers)
+    if passes:
+        body.append(PASS | passes)
+
+    flags = 0
+    if compress:
+        deflated = zlib.compress(body, 9, -zlib.MAX_WBITS)
+        if len(deflated) < len(body):
+            body, flags = deflated, FLAG_DEFLATE
+    return bytes((VERSION, flags)) + bytes(body)
+
+
+def decode(data: bytes) -> Dict[str, Any]:
+    if len(data) < 2 or data[0] != VERSION:
+        raise GameLogError(f'unsupported game log version {data[:1]!r}')
+    body = data[2:]
+    if data[1] & FLAG_DEFLATE:
+        body = zlib.decompress(body, -zlib.MAX_WBITS)
+
+    try:
+        lord, i = body[0], 1
+        left: Dict[int, List[int]] = {}
+        for seat in range(SEATS):
+            n = body[i]
+            left[seat] = list(body[i + 1: i + 1 + n])
+            i += 1 + n
+
+        rounds: List[List[int]] = []
+        append = rounds.append
+        end = len(body)
+        while i < end:
+            n = body[i]
+            i += 1
+            if n & PASS:
+                for _ in range(n & MAX_PASS):
+                    append([])
+            else:
+                append(list(body[i: i + n]))
+                i += n
+        if i != end:
+            raise GameLogError('truncated game log')
+    except IndexError:
+        raise GameLogError('truncated game log')
+    return {'left': left, 'round': rounds, 'lord': lord}
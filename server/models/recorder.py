@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import orjson
+from sqlalchemy import insert
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from config import RECORD_SPOOL, RECORD_BATCH_SIZE, RECORD_FLUSH_INTERVAL, RECORD_MAX_PENDING, RECORD_FLUSH_TIMEOUT, \
+    RECORD_COMPRESS
+from . import gamelog
+from .auth import Record
+from .base import engine
+
+'''
+牌局记录异步批量写入
+
+    append      只放进内存, 不访问数据库
+    flush       攒够 batch_size 条或每隔 interval 秒, 编码成 gamelog 后一条多行 INSERT 写入
+    spool       数据库写失败、超时或内存中超过 max_pending 条时追加到本地文件, 在单独的线程中按顺序写
+    replay      数据库恢复后把本地文件里的记录写回数据库
+    close       停服时写完内存中的记录, 写不进数据库的落盘
+'''
+
+
+class RecordWriter(object):
+
+    def __init__(self, spool_path: str, batch_size: int = 100, interval: float = 5.0, max_pending: int = 10000,
+                 timeout: float = 3.0, compress: bool = False):
+        self.spool_path = spool_path
+        self.compress = compress
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._pending: List[Dict[str, Any]] = []
+        self._flushing = False
+        self._periodic: Optional[PeriodicCallback] = None
+        # 落盘和补写读取都在这一个线程里, 不会同时读写落盘文件
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='record-spool')
+        self.written = 0
+        self.spooled = 0
+
+    def start(self):
+        if self._periodic is None:
+            self._periodic = PeriodicCallback(self._on_interval, self.interval * 1000)
+            self._periodic.start()
+
+    def append(self, round: Dict[str, Any], robot: int):
+        self._pending.append({'round': round, 'robot': robot, 'last_modified': datetime.now()})
+        if len(self._pending) >= self.max_pending:
+            rows, self._pending = self._pending, []
+            # 直接交给落盘线程, 不阻塞 IOLoop; 提交的顺序就是写入的顺序
+            IOLoop.current().run_in_executor(self._executor, self._spool, rows)
+        elif len(self._pending) >= self.batch_size and not self._flushing:
+            IOLoop.current().add_callback(self.flush)
+
+    async def flush(self) -> bool:
+        if self._flushing:
+            return False
+        self._flushing = True
+        try:
+            while self._pending:
+                rows, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+                if not await self._insert(rows):
+                    rows.extend(self._pending)
+                    self._pending = []
+                    await self._spool_async(rows)
+                    return False
+            return True
+        finally:
+            self._flushing = False
+
+    async def replay(self) -> bool:
+        """
+        把落盘的记录写回数据库, 写入失败的部分重新落盘
+        """
+        replay_path = self.spool_path + '.replay'
+        if self._flushing or not (os.path.exists(self.spool_path) or os.path.exists(replay_path)):
+            return True
+        self._flushing = True
+        try:
+            rows = await IOLoop.current().run_in_executor(self._executor, self._take_spool, replay_path)
+            for i in range(0, len(rows), self.batch_size):
+                if not await self._insert(rows[i: i + self.batch_size]):
+                    await self._spool_async(rows[i:])
+                    os.remove(replay_path)
+                    return False
+            os.remove(replay_path)
+            logging.info('RECORD REPLAY %d ROWS', len(rows))
+            return True
+        finally:
+            self._flushing = False
+
+    async def close(self):
+        if self._periodic:
+            self._periodic.stop()
+            self._periodic = None
+        # 等待正在进行的写入结束
+        while self._flushing:
+            await asyncio.sleep(0.05)
+        await self.flush()
+        # 等待已经交给落盘线程的写入
+        await IOLoop.current().run_in_executor(self._executor, lambda: None)
+
+    def stats(self) -> Dict[str, int]:
+        return {'pending': len(self._pending), 'written': self.written, 'spooled': self.spooled}
+
+    async def _on_interval(self):
+        if await self.flush():
+            await self.replay()
+
+    async def _insert(self, rows: List[Dict[str, Any]]) -> bool:
+        try:
+            await asyncio.wait_for(self._execute(rows), self.timeout)
+            self.written += len(rows)
+            return True
+        except Exception:
+            logging.exception('RECORD INSERT %d ROWS FAILED', len(rows))
+            return False
+
+    async def _execute(self, rows: List[Dict[str, Any]]):
+        values = [{
+            'log': gamelog.encode(row['round'], self.compress),
+            'robot': row['robot'],
+            'last_modified': row['last_modified'],
+        } for row in rows]
+        async with engine.begin() as conn:
+            await conn.execute(insert(Record).values(values))
+
+    async def _spool_async(self, rows: List[Dict[str, Any]]):
+        await IOLoop.current().run_in_executor(self._executor, self._spool, rows)
+
+    def _spool(self, rows: List[Dict[str, Any]]):
+        with open(self.spool_path, 'ab') as f:
+            for row in rows:
+                f.write(orjson.dumps(row, option=orjson.OPT_NON_STR_KEYS) + b'\n')
+        self.spooled += len(rows)
+        logging.warning('RECORD SPOOL %d ROWS TO %s', len(rows), self.spool_path)
+
+    def _take_spool(self, replay_path: str) -> List[Dict[str, Any]]:
+        # 上次补写中途退出时先补写留下的文件
+        if not os.path.exists(replay_path):
+            os.replace(self.spool_path, replay_path)
+        return self._read_spool(replay_path)
+
+    @staticmethod
+    def _read_spool(path: str) -> List[Dict[str, Any]]:
+        rows = []
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    row = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    # 停服时写了一半的行
+                    logging.error('RECORD SPOOL BAD LINE: %s', line)
+                    continue
+                row['last_modified'] = datetime.fromisoformat(row['last_modified'])
+                rows.append(row)
+        return rows
+
+
+recorder = RecordWriter(RECORD_SPOOL, RECORD_BATCH_SIZE, RECORD_FLUSH_INTERVAL, RECORD_MAX_PENDING, RECORD_FLUSH_TIMEOUT,
+                        RECORD_COMPRESS)
@@ -0,0 +1,193 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects import mysql, sqlite
+
+from config import USER_CACHE_SIZE, USER_CACHE_TTL, USER_CACHE_NEGATIVE_TTL
+from .auth import User
+from .base import engine, fetch_one
+
+'''
+用户信息的进程内缓存, 可以按 uid、name、openid 查询
+
+    命中        直接返回, 不访问数据库
+    未命中      同一个 key 同时只有一个请求查询数据库, 其他请求等待同一个结果
+    不存在      记住不存在的 key, negative_ttl 秒内不再查询
+    写入        upsert 之后删除相关的缓存
+
+缓存的用户信息是 User.to_dict() 的结果, 调用方不要修改
+'''
+
+Key = Tuple[str, Any]
+
+
+class UserCache(object):
+
+    def __init__(self, max_size: int = 100000, ttl: float = 300, negative_ttl: float = 30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # uid -> (过期时间, 用户信息, openid)
+        self._users: 'OrderedDict[int, Tuple[float, Dict[str, Any], Optional[str]]]' = OrderedDict()
+        self._names: Dict[str, int] = {}
+        self._openids: Dict[str, int] = {}
+        self._missing: 'OrderedDict[Key, float]' = OrderedDict()
+        self._inflight: Dict[Key, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_by_uid(self, uid: int) -> Optional[Dict[str, Any]]:
+        return await self._get(('uid', uid), lambda: self._load(User.id == uid))
+
+    async def get_by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        return await self._get(('name', name), lambda: self._load(User.name == name))
+
+    async def get_by_openid(self, openid: str) -> Optional[Dict[str, Any]]:
+        return await self._get(('openid', openid), lambda: self._load(User.openid == openid))
+
+    async def upsert(self, openid: str, name: str, sex: int, avatar: str, update: bool = True) -> Dict[str, Any]:
+        """
+        按 openid 插入用户, openid 已存在时 update 为 True 则更新 name、sex、avatar
+        """
+        values = {'openid': openid, 'name': name, 'sex': sex, 'avatar': avatar}
+        async with engine.begin() as conn:
+            await conn.execute(upsert_stmt(values, ('name', 'sex', 'avatar') if update else ()))
+        self.invalidate(name=name, openid=openid)
+        return await self.get_by_openid(openid)
+
+    def invalidate(self, uid: Optional[int] = None, name: Optional[str] = None, openid: Optional[str] = None):
+        for key in {uid, self._names.get(name), self._openids.get(openid)}:
+            if key is not None:
+                self._remove(key)
+                self._missing.pop(('uid', key), None)
+        if name is not None:
+            self._missing.pop(('name', name), None)
+        if openid is not None:
+            self._missing.pop(('openid', openid), None)
+
+    def clear(self):
+        self._users.clear()
+        self._names.clear()
+        self._openids.clear()
+        self._missing.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._users),
+            'missing': len(self._missing),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    async def _get(self, key: Key, loader: Callable[[], Awaitable[Optional[Tuple[Dict[str, Any], str]]]]):
+        now = time.monotonic()
+        found, user = self._lookup(key, now)
+        if found:
+            self.hits += 1
+            return user
+
+        self.misses += 1
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = self._inflight[key] = asyncio.get_event_loop().create_future()
+        try:
+            row = await loader()
+            if row is None:
+                self._set_missing(key, now)
+                user = None
+            else:
+                user, openid = row
+                self._set(user, openid, now)
+            future.set_result(user)
+            return user
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他请求在等待时避免 "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def _lookup(self, key: Key, now: float) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        kind, value = key
+        if kind == 'uid':
+            uid = value
+        else:
+            uid = (self._names if kind == 'name' else self._openids).get(value)
+
+        entry = self._users.get(uid) if uid is not None else None
+        if entry is not None:
+            if entry[0] > now:
+                self._users.move_to_end(uid)
+                return True, entry[1]
+            self._remove(uid)
+
+        expires = self._missing.get(key)
+        if expires is not None:
+            if expires > now:
+                return True, None
+            del self._missing[key]
+        return False, None
+
+    def _set(self, user: Dict[str, Any], openid: Optional[str], now: float):
+        uid = user['uid']
+        self._remove(uid)
+        self._users[uid] = (now + self.ttl, user, openid)
+        self._names[user['name']] = uid
+        if openid:
+            self._openids[openid] = uid
+        while len(self._users) > self.max_size:
+            self._remove(next(iter(self._users)))
+
+    def _set_missing(self, key: Key, now: float):
+        self._missing[key] = now + self.negative_ttl
+        self._missing.move_to_end(key)
+        while len(self._missing) > self.max_size:
+            self._missing.popitem(last=False)
+
+    def _remove(self, uid: int):
+        entry = self._users.pop(uid, None)
+        if entry is None:
+            return
+        _, user, openid = entry
+        if self._names.get(user['name']) == uid:
+            del self._names[user['name']]
+        if openid and self._openids.get(openid) == uid:
+            del self._openids[openid]
+
+    @staticmethod
+    async def _load(where) -> Optional[Tuple[Dict[str, Any], str]]:
+        row = await fetch_one(select(User.id, User.name, User.sex, User.avatar, User.openid)
+                              .where(where).order_by(User.id).limit(1))
+        if row is None:
+            return None
+        return {'uid': row.id, 'name': row.name, 'sex': row.sex, 'avatar': row.avatar}, row.openid
+
+
+def upsert_stmt(values: Dict[str, Any], update_fields: Tuple[str, ...]):
+    """
+    MySQL 用 ON DUPLICATE KEY UPDATE, SQLite 用 ON CONFLICT, 冲突时不更新的字段保持原值
+    """
+    if engine.dialect.name == 'sqlite':
+        stmt = sqlite.insert(User).values(**values)
+        if update_fields:
+            return stmt.on_conflict_do_update(
+                index_elements=[User.openid],
+                set_={field: getattr(stmt.excluded, field) for field in update_fields},
+            )
+        return stmt.on_conflict_do_nothing(index_elements=[User.openid])
+
+    stmt = mysql.insert(User).values(**values)
+    if update_fields:
+        return stmt.on_duplicate_key_update(**{field: getattr(stmt.inserted, field) for field in update_fields})
+    return stmt.on_duplicate_key_update(openid=stmt.inserted.openid)
+
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL, USER_CACHE_NEGATIVE_TTL)
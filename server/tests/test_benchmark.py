@@ -0,0 +1,31 @@
+from api.game.benchmark import compare, measure
+
+
+def report(median_ns, **meta):
+    return {
+        'meta': {'host': 'a', 'machine': 'x86_64', 'implementation': 'CPython', 'python': '3.11.7', 'seed': 0,
+                 'size': 10, 'digest': 'd', **meta},
+        'results': {'find_best_shot': {'min_ns': median_ns, 'median_ns': median_ns}},
+    }
+
+
+def test_compare_medians_with_tolerance():
+    assert compare(report(130), report(100), 0.5)['changes']['find_best_shot']['status'] == 'same'
+    assert compare(report(160), report(100), 0.5)['changes']['find_best_shot']['status'] == 'slower'
+    assert compare(report(60), report(100), 0.5)['changes']['find_best_shot']['status'] == 'faster'
+
+
+def test_other_machine_not_compared():
+    # 主机名不同仍然比较
+    assert compare(report(500, host='b'), report(100), 0.5)['changes']['find_best_shot']['status'] == 'slower'
+    result = compare(report(500, python='3.12.1'), report(100), 0.5)
+    assert not result['comparable'] and result['changes'] == {}
+    # 出牌结果不受机器影响, 仍然比较 digest
+    assert compare(report(100, host='b', digest='e'), report(100), 0.5)['digest_changed']
+
+
+def test_measure():
+    calls = []
+    result = measure(lambda: calls.append(1), 1, 5)
+    # 包含一次预热
+    assert len(calls) == 6 and result['repeat'] == 5
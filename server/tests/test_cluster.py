@@ -0,0 +1,84 @@
+import asyncio
+
+from api.game.cluster import Cluster
+
+
+class FakeBus(object):
+    """
+    同一进程里的两个节点互相投递消息
+    """
+
+    def __init__(self):
+        self.peers = []
+        self.handlers = {}
+        self.sent = []
+        self.on_peer = None
+
+    def subscribe(self, topic, handler):
+        self.handlers[topic] = handler
+
+    def publish(self, topic, message):
+        self.sent.append((topic, message))
+        for peer in self.peers:
+            if topic in peer.handlers:
+                peer.handlers[topic](message)
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_release_bounds_presence():
+    async def run():
+        a, b = Cluster(), Cluster()
+        bus_a, bus_b = FakeBus(), FakeBus()
+        bus_a.peers, bus_b.peers = [bus_b], [bus_a]
+        a.start('a', bus_a)
+        b.start('b', bus_b)
+        try:
+            for uid in range(100):
+                a.claim(uid, -1)
+            a.claim(7, 3)
+            assert len(b._players) == 100 and b.player_room(7) == 3
+
+            # 断开连接的玩家释放后, 心跳只发布仍在线的玩家, 其他节点也删除
+            for uid in range(100):
+                if uid != 7:
+                    a.release(uid)
+            a.release(7000)
+            assert list(a._claimed) == [7] and list(b._players) == [7]
+            bus_a.sent.clear()
+            a._publish_state()
+            presence = [message for topic, message in bus_a.sent if message.get('players') is not None]
+            assert presence[0]['players'][0][:2] == [7, 3] and len(presence[0]['players']) == 1
+
+            # 释放后重新连接会再次发布
+            a.claim(1, -1)
+            assert 1 in b._players
+        finally:
+            a.close()
+            b.close()
+
+    asyncio.run(run())
+
+
+def test_release_does_not_drop_newer_claim():
+    async def run():
+        a, b = Cluster(), Cluster()
+        bus_a, bus_b = FakeBus(), FakeBus()
+        bus_a.peers, bus_b.peers = [bus_b], [bus_a]
+        a.start('a', bus_a)
+        b.start('b', bus_b)
+        try:
+            a.claim(5, -1)
+            # 玩家又在 b 登录了, a 之后的释放不影响 b 的记录
+            b.claim(5, 2)
+            a.release(5)
+            assert b._players[5][:2] == ('b', 2) and a._players[5][:2] == ('b', 2)
+        finally:
+            a.close()
+            b.close()
+
+    asyncio.run(run())
@@ -0,0 +1,91 @@
+import asyncio
+
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from tornado.web import Application
+from tornado.websocket import WebSocketHandler, websocket_connect
+
+from api.game.codec import LAYOUTS, HEADER, JSON_BODY, BinaryCodec, JsonCodec
+from api.game.protocol import Protocol as Pt
+from api.game.views import SocketHandler
+
+# 每个字段格式的取值范围内的值, 包括边界
+SAMPLES = {'i': -2 ** 31, 'I': 2 ** 32 - 1, 'b': -1, 'B': 255, 'H': 65535}
+
+
+def sample(code):
+    fmt, fields, pokers_field = LAYOUTS[code]
+    formats = fmt.format.lstrip('<')
+    packet = {field: SAMPLES[c] for field, c in zip(fields, formats)}
+    if pokers_field:
+        packet[pokers_field] = [1, 17, 53, 54]
+    return packet
+
+
+def test_layouts_round_trip():
+    for code in LAYOUTS:
+        packet = sample(code)
+        data = BinaryCodec.encode([code, packet])
+        assert not HEADER.unpack_from(data)[0] & JSON_BODY, code
+        assert BinaryCodec.decode(data) == (code, packet)
+
+    empty = {'pokers': []}
+    assert BinaryCodec.decode(BinaryCodec.encode([Pt.REQ_SHOT_POKER, empty])) == (Pt.REQ_SHOT_POKER, empty)
+
+
+def test_json_fallback():
+    packets = [
+        (Pt.RSP_ROOM_LIST, {'rooms': [{'level': 1, 'number': 3}]}),
+        # 缺少字段、超出范围、类型不对时整条消息用 JSON
+        (Pt.RSP_READY, {'uid': 1}),
+        (Pt.RSP_LEAVE_ROOM, {'uid': -1}),
+        (Pt.REQ_SHOT_POKER, {'pokers': [300]}),
+        (Pt.REQ_JOIN_ROOM, {'room': 'x', 'level': 1}),
+    ]
+    for code, packet in packets:
+        data = BinaryCodec.encode([code, packet])
+        assert HEADER.unpack_from(data)[0] == code | JSON_BODY
+        assert BinaryCodec.decode(data) == (code, packet)
+
+    # 文本帧按 JSON 解码
+    assert BinaryCodec.decode('[1005, {"room": -1}]') == (1005, {'room': -1})
+    assert BinaryCodec.decode(b'\x01') == (None, None)
+    assert BinaryCodec.decode(HEADER.pack(1) + b'') == (None, None)
+    assert BinaryCodec.decode(HEADER.pack(JSON_BODY) + b'[1]') == (None, None)
+    assert JsonCodec.decode('not json') == (None, None)
+
+
+class EchoHandler(WebSocketHandler):
+    select_subprotocol = SocketHandler.select_subprotocol
+    codec = SocketHandler.codec
+
+    def on_message(self, message):
+        codec = self.codec
+        self.write_message(codec.encode(list(codec.decode(message))), codec.binary)
+
+
+def test_subprotocol_negotiation():
+    async def run():
+        sock, port = bind_unused_port()
+        server = HTTPServer(Application([('/ws', EchoHandler)]))
+        server.add_sockets([sock])
+        message = [Pt.REQ_SHOT_POKER, {'pokers': [1, 2]}]
+        try:
+            conn = await websocket_connect(f'ws://127.0.0.1:{port}/ws', subprotocols=['chat', BinaryCodec.name])
+            assert conn.selected_subprotocol == BinaryCodec.name
+            await conn.write_message(BinaryCodec.encode(message), binary=True)
+            reply = await conn.read_message()
+            assert isinstance(reply, bytes) and BinaryCodec.decode(reply) == tuple(message)
+            conn.close()
+
+            # 没有请求子协议的客户端仍使用 JSON
+            conn = await websocket_connect(f'ws://127.0.0.1:{port}/ws')
+            assert conn.selected_subprotocol is None
+            await conn.write_message(JsonCodec.encode(message))
+            reply = await conn.read_message()
+            assert isinstance(reply, str) and JsonCodec.decode(reply) == tuple(message)
+            conn.close()
+        finally:
+            server.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,41 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from api.game import decision
+from api.game.decision import Decision
+
+
+def slow_shot(hand_pokers):
+    time.sleep(0.3)
+    return decision.rule.find_best_shot(hand_pokers)
+
+
+def test_timeout_falls_back_without_search(monkeypatch):
+    async def run():
+        monkeypatch.setattr(Decision, 'executor', ThreadPoolExecutor(1))
+        monkeypatch.setattr(Decision, 'timeout', 0.05)
+        monkeypatch.setattr(Decision, 'timeouts', 0)
+        monkeypatch.setattr(decision, 'find_best_shot', slow_shot)
+        # 超时后不在 IOLoop 里重新搜索: 主动出牌出最小的单张, 跟牌不出
+        start = time.perf_counter()
+        assert await Decision.find_best_shot([54, 1, 3, 15]) == [3]
+        assert time.perf_counter() - start < 0.2
+        assert Decision.timeouts == 1
+        Decision.executor.shutdown(wait=True)
+
+    asyncio.run(run())
+
+
+def test_pool_cache_stats(monkeypatch):
+    async def run():
+        monkeypatch.setattr(Decision, 'executor', ThreadPoolExecutor(1))
+        monkeypatch.setattr(Decision, 'caches', {})
+        await Decision.find_best_shot([1, 14, 27])
+        await Decision.find_best_follow([2, 15], [1], False)
+        stats = Decision.stats()
+        assert stats['workers'] == 1
+        assert set(stats['cache']['pool']) == {'shot', 'follow'}
+        Decision.executor.shutdown(wait=True)
+
+    asyncio.run(run())
@@ -0,0 +1,73 @@
+import asyncio
+import inspect
+
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from tornado.web import Application
+from tornado.websocket import WebSocketHandler, WebSocketProtocol13, websocket_connect, _WebSocketParams, \
+    _PerMessageDeflateCompressor, _PerMessageDeflateDecompressor
+
+from api.game.deflate import DeflateProtocol, DeflateStats
+
+'''
+deflate.py 依赖 tornado 的内部接口, 升级 tornado 后这里失败说明需要跟着修改
+'''
+
+
+def parameters(func):
+    return list(inspect.signature(func).parameters)
+
+
+def test_tornado_internals():
+    assert parameters(WebSocketProtocol13.__init__) == ['self', 'handler', 'mask_outgoing', 'params']
+    assert parameters(WebSocketProtocol13._create_compressors) == \
+        ['self', 'side', 'agreed_parameters', 'compression_options']
+    assert parameters(WebSocketProtocol13._get_compressor_options) == \
+        ['self', 'side', 'agreed_parameters', 'compression_options']
+    assert parameters(_PerMessageDeflateCompressor.__init__) == \
+        ['self', 'persistent', 'max_wbits', 'compression_options']
+    assert 'max_message_size' in parameters(_PerMessageDeflateDecompressor.__init__)
+    assert parameters(_WebSocketParams.__init__) == \
+        ['self', 'ping_interval', 'ping_timeout', 'max_message_size', 'compression_options']
+
+
+class EchoHandler(WebSocketHandler):
+    protocols = []
+
+    def get_compression_options(self):
+        return {'threshold': 100, 'max_wbits': 10, 'no_context_takeover': True}
+
+    def get_websocket_protocol(self):
+        protocol = DeflateProtocol.create(self)
+        self.protocols.append(protocol)
+        return protocol
+
+    def on_message(self, message):
+        self.write_message(message)
+
+
+def test_threshold_and_options():
+    async def run():
+        sock, port = bind_unused_port()
+        server = HTTPServer(Application([('/ws', EchoHandler)]))
+        server.add_sockets([sock])
+        conn = await websocket_connect(f'ws://127.0.0.1:{port}/ws', compression_options={})
+        try:
+            protocol = EchoHandler.protocols[-1]
+            # 压缩器由本模块创建, 服务端的窗口和上下文设置生效
+            assert protocol._compressor._max_wbits == 10
+            assert protocol._compressor._compressor is None
+
+            compressed, skipped = DeflateStats.compressed, DeflateStats.skipped
+            for message in ('small', 'large' * 100):
+                await conn.write_message(message)
+                assert await conn.read_message() == message
+            # 小于 threshold 的消息不经过压缩器, 压缩器在发送后恢复
+            assert DeflateStats.skipped - skipped == 1
+            assert DeflateStats.compressed - compressed == 1
+            assert protocol._compressor is not None
+        finally:
+            conn.close()
+            server.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,50 @@
+import asyncio
+import io
+import json
+
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from models import gamelog
+from models.auth import Record
+from models.base import Base
+from utils.exporter import export
+
+# 地主炸弹后春天
+SPRING = {'left': {0: [], 1: [6, 7], 2: [8]}, 'round': [[3, 16, 29, 42], [], [], [5], [], []], 'lord': 0}
+# 旧的 JSON 记录, 农民王炸后反春
+ANTI_SPRING = {'left': {'0': [], '1': [9], '2': [10]}, 'round': [[5], [53, 54], []], 'lord': 1}
+
+
+def test_export_matches_gamelog(tmp_path, monkeypatch):
+    engine = create_async_engine(f'sqlite+aiosqlite:///{tmp_path / "ddz.db"}')
+    monkeypatch.setattr('utils.exporter.engine', engine)
+    checkpoint = str(tmp_path / 'export.checkpoint.json')
+
+    async def run():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all, tables=[Record.__table__])
+            await conn.execute(Record.__table__.insert(), [
+                {'id': 1, 'round': None, 'log': gamelog.encode(SPRING), 'robot': 0},
+                {'id': 2, 'round': ANTI_SPRING, 'log': None, 'robot': 1},
+                {'id': 3, 'round': None, 'log': b'garbage', 'robot': 1},
+            ])
+
+        out = io.StringIO()
+        stats = await export(checkpoint, 2, out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        assert rows == [
+            {'id': 1, 'robot': 0, 'lord': 0,
+             'landlord_win': True, 'spring': True, 'anti_spring': False, 'bombs': 1},
+            {'id': 2, 'robot': 1, 'lord': 1, 'landlord_win': False, 'spring': False, 'anti_spring': True, 'bombs': 1},
+        ]
+        assert stats.state() == {
+            'games': 2, 'landlord_wins': 1, 'spring': 1, 'anti_spring': 1, 'bombs': 2, 'bomb_games': 2,
+            'skipped': 1, 'by_robot': {'robot': [1, 0], 'human': [1, 1]},
+        }
+
+        # 检查点之后没有新记录, 再次导出结果不变
+        out = io.StringIO()
+        assert (await export(checkpoint, 2, out)).state() == stats.state()
+        assert out.getvalue() == ''
+
+    asyncio.run(run())
@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+from models import gamelog
+from models.auth import Record
+
+
+def make_game(seed: int):
+    rng = random.Random(seed)
+    pokers = list(range(1, 55))
+    rng.shuffle(pokers)
+    rounds = []
+    for _ in range(rng.randint(0, 60)):
+        n = rng.choice((0, 0, 1, 2, 3, 4, 5, 20))
+        rounds.append(rng.sample(range(1, 55), n))
+    return {
+        'left': {seat: pokers[seat * 5: seat * 5 + rng.randint(0, 5)] for seat in range(3)},
+        'round': rounds,
+        'lord': rng.randint(0, 2),
+    }
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_round_trip(compress):
+    for seed in range(200):
+        game = make_game(seed)
+        assert gamelog.decode(gamelog.encode(game, compress)) == game
+
+
+def test_long_pass_runs():
+    game = {'left': {0: [], 1: [3], 2: [4, 5]}, 'round': [[]] * 300 + [[1]] + [[]] * 127, 'lord': 2}
+    assert gamelog.decode(gamelog.encode(game)) == game
+
+
+def test_json_seats():
+    game = {'left': {'0': [1], '1': [], '2': [54, 53]}, 'round': [[1, 14], [], []], 'lord': 1}
+    decoded = gamelog.decode(gamelog.encode(game))
+    assert decoded['left'] == {0: [1], 1: [], 2: [54, 53]}
+    assert decoded['round'] == game['round']
+
+
+def test_errors():
+    with pytest.raises(gamelog.GameLogError):
+        gamelog.encode({'left': {}, 'round': [list(range(1, 22))], 'lord': 0})
+    with pytest.raises(gamelog.GameLogError):
+        gamelog.decode(b'\x02\x00\x00')
+    data = gamelog.encode({'left': {0: [1, 2]}, 'round': [[3, 4]], 'lord': 0})
+    with pytest.raises(gamelog.GameLogError):
+        gamelog.decode(data[:-1])
+
+
+def test_record_game():
+    legacy = {'left': {'0': [1, 2], '1': [], '2': [3]}, 'round': [[5], [], [6]], 'lord': 1}
+    assert Record(round=legacy, robot=1).game() is legacy
+
+    game = make_game(1)
+    assert Record(log=gamelog.encode(game), robot=1).game() == game
@@ -0,0 +1,52 @@
+import random
+from collections import Counter
+
+from api.game import hand
+from api.game.rule import Rule, rule
+
+
+def test_pack_and_unpack():
+    assert hand.to_cards(hand.from_cards('3334wW2A')) == '3334A2wW'
+    assert hand.from_pokers([53, 54]) == hand.ROCKET
+    # 1 和 14 都是 A, 13 是 K
+    assert hand.to_cards(hand.from_pokers([1, 14, 13])) == 'KAA'
+
+    rng = random.Random(0)
+    for _ in range(200):
+        pokers = rng.sample(range(1, 55), rng.randint(0, 20))
+        packed = hand.from_pokers(pokers)
+        assert sorted(hand.to_cards(packed)) == sorted(Rule._to_cards(pokers))
+        assert hand.size(packed) == len(pokers)
+        assert hand.singles(packed) == sum(1 for n in Counter(Rule._to_cards(pokers)).values() if n == 1)
+
+
+def test_contains_add_subtract():
+    rng = random.Random(1)
+    for _ in range(200):
+        deck = list(range(1, 55))
+        rng.shuffle(deck)
+        a, b = deck[:rng.randint(0, 20)], deck[20:20 + rng.randint(0, 20)]
+        ha, hb = hand.from_pokers(a), hand.from_pokers(b)
+        total = hand.add(ha, hb)
+        assert total == hand.from_pokers(a + b)
+        assert hand.contains(total, ha) and hand.contains(total, hb)
+        assert hand.subtract(total, hb) == ha
+        expected = not Counter(Rule._to_cards(b)) - Counter(Rule._to_cards(a))
+        assert hand.contains(ha, hb) == expected
+
+    # 借位不能越过保护位
+    assert not hand.contains(hand.from_cards('4'), hand.from_cards('3'))
+    assert not hand.contains(hand.from_cards('33'), hand.from_cards('333'))
+    assert hand.contains(hand.from_cards('3333'), hand.from_cards('333'))
+
+
+def test_contains_pokers():
+    pokers = [1, 14, 27, 53]
+    assert hand.contains_pokers(pokers, [14, 53])
+    assert hand.contains_pokers(pokers, [])
+    # 同点数不同花色的牌不算包含
+    assert not hand.contains_pokers(pokers, [40])
+    assert not hand.contains_pokers(pokers, [1, 1])
+    assert not hand.contains_pokers(pokers, [0])
+    assert not hand.contains_pokers(pokers, ['1'])
+    assert rule.is_contains(pokers, [14, 53]) and not rule.is_contains(pokers, [1, 1])
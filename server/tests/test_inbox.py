@@ -0,0 +1,88 @@
+import asyncio
+
+from api.game.inbox import Inbox, InboxStats
+
+
+def test_in_order_with_awaits():
+    async def run():
+        inbox = Inbox('t1')
+        log = []
+
+        async def slow(name):
+            log.append(f'{name} start')
+            await asyncio.sleep(0.01)
+            log.append(f'{name} end')
+
+        inbox.submit(slow, 'a')
+        inbox.submit(log.append, 'b')
+        inbox.submit(slow, 'c')
+        await inbox.drain()
+        # 处理函数里的 await 不会和下一条消息交错
+        assert log == ['a start', 'a end', 'b', 'c start', 'c end']
+
+    asyncio.run(run())
+
+
+def test_full_queue():
+    async def run():
+        inbox = Inbox('t2', maxsize=2)
+        log = []
+        dropped = InboxStats.dropped
+        assert inbox.submit(log.append, 1) and inbox.submit(log.append, 2)
+        # submit 在队列满时丢弃
+        assert not inbox.submit(log.append, 3)
+        assert InboxStats.dropped == dropped + 1
+
+        # put 在队列满时等待, 有空位后放入
+        put = asyncio.ensure_future(inbox.put(log.append, 4))
+        await asyncio.sleep(0)
+        assert await put
+        await inbox.drain()
+        assert log == [1, 2, 4]
+
+    asyncio.run(run())
+
+
+def test_drain_resume_close():
+    async def run():
+        inbox = Inbox('t3')
+        log = []
+        inbox.submit(log.append, 1)
+        drain = asyncio.ensure_future(inbox.drain())
+        await asyncio.sleep(0)
+        # drain 之后的消息留在队列里
+        inbox.submit(log.append, 2)
+        await drain
+        assert log == [1] and inbox.paused and inbox.depth == 1
+
+        inbox.resume()
+        await asyncio.sleep(0)
+        assert log == [1, 2] and not inbox.paused
+
+        await inbox.drain()
+        inbox.submit(log.append, 3)
+        inbox.submit(log.append, 4)
+        assert inbox.close() == 2
+        assert not inbox.submit(log.append, 5)
+        inbox.resume()
+        await asyncio.sleep(0)
+        assert log == [1, 2] and inbox.depth == 0
+
+    asyncio.run(run())
+
+
+def test_close_wakes_putters():
+    async def run():
+        inbox = Inbox('t4', maxsize=1)
+        log = []
+        await inbox.drain()
+        inbox.submit(log.append, 1)
+        put = asyncio.ensure_future(inbox.put(log.append, 2))
+        await asyncio.sleep(0)
+        assert not put.done()
+        inbox.close()
+        # 等待中的 put 返回 False, 消息被丢弃
+        assert await put is False
+        assert log == []
+
+    asyncio.run(run())
@@ -0,0 +1,29 @@
+from api.game.components.simple import RobotPlayer
+from api.game.globalvar import GlobalVar
+from api.game.player import Player
+from api.game.room import Room
+
+
+def test_lobby_offset_added_once(monkeypatch):
+    published = []
+    monkeypatch.setattr(GlobalVar, '__level_players__', {1: 2, 2: 0, 3: 0})
+    monkeypatch.setattr('api.game.globalvar.cluster.update_lobby', lambda levels: published.append(dict(levels)))
+    monkeypatch.setattr('api.game.globalvar.cluster.remote_levels', lambda: {1: 5, 2: 1})
+    GlobalVar.invalidate_room_list()
+
+    rooms = {room['level']: room['number'] for room in GlobalVar.room_list()}
+    assert rooms == {1: 2 + 5 + GlobalVar.LOBBY_OFFSET[1], 2: 1, 3: 0}
+
+    # 发布给其他节点的只有真实人数
+    room = Room(-7, 1, False)
+    room.players[0] = Player(9101, 'p')
+    GlobalVar._update_room_players(room)
+    assert published == [{1: 3, 2: 0, 3: 0}]
+
+    # 机器人入座不计入人数, 也不再发布
+    room.players[1] = RobotPlayer(-9102, 'r', room=room)
+    GlobalVar._update_room_players(room)
+    assert published == [{1: 3, 2: 0, 3: 0}]
+    assert GlobalVar.__room_players__[room.room_id] == 1
+    GlobalVar.__room_players__.pop(room.room_id, None)
+    GlobalVar.invalidate_room_list()
@@ -0,0 +1,95 @@
+import asyncio
+import types
+
+from api.game.globalvar import GlobalVar
+from api.game.player import Player
+from api.game.protocol import Protocol as Pt
+
+
+class FakeSocket(object):
+    allow_robot = False
+
+    def __init__(self):
+        self.messages = []
+
+    def write_message(self, message):
+        self.messages.append(message)
+
+    def write_frame(self, frame):
+        self.messages.append(frame)
+
+
+def join(uid: int) -> Player:
+    player = Player(uid, f'p{uid}')
+    player.socket = FakeSocket()
+    GlobalVar.__players__[uid] = player
+    room = GlobalVar.new_room(1, True)
+    player.state = player.state.WAITING
+    player.join_room(room)
+    player.socket.messages.clear()
+    return player
+
+
+def seats(player: Player):
+    code, packet = [m for m in player.socket.messages if m[0] == Pt.RSP_JOIN_ROOM][-1]
+    return [p.get('uid') for p in packet['players']]
+
+
+def test_match_syncs_partial_rooms(monkeypatch):
+    robots = []
+    monkeypatch.setattr('api.game.room.scheduler.call_later', lambda delay, func, **kwargs: robots.append(func))
+    a, b = join(9001), join(9002)
+    assert len(robots) == 2
+    asyncio.run(GlobalVar.match_rooms())
+
+    assert a.room is b.room
+    room = a.room
+    assert not room.is_full()
+    # 移动的玩家和原来在房间里的玩家都收到新的座位
+    assert seats(a) == seats(b) == [p.uid if p else None for p in room.players]
+    # 合桌不再安排补机器人
+    assert len(robots) == 2
+
+    for uid in (9001, 9002):
+        GlobalVar.remove_player(uid)
+    room.players = [None, None, None]
+    GlobalVar.on_room_changed(room)
+
+
+def test_match_runs_through_inboxes(monkeypatch):
+    monkeypatch.setattr('api.game.room.scheduler.call_later', lambda delay, func, **kwargs: None)
+    a, b = join(9011), join(9012)
+    # 人多的房间是合桌的目标
+    c = Player(9013, 'p9013')
+    c.socket = FakeSocket()
+    c.state = c.state.WAITING
+    c.join_room(a.room)
+    target, source = a.room, b.room
+    seen = []
+
+    async def busy():
+        seen.append('busy start')
+        await asyncio.sleep(0.01)
+        seen.append('busy end')
+
+    async def run():
+        b.probe = types.MethodType(lambda self: seen.append(self.room.room_id), b)
+        # 合桌要等房间里正在处理的消息结束
+        source.inbox.submit(busy)
+        await asyncio.sleep(0)
+        match = asyncio.ensure_future(GlobalVar.match_rooms())
+        while not source.inbox.depth:
+            await asyncio.sleep(0)
+        # 合桌等待期间收到的消息排在暂停之后, 移动后在新房间的队列里处理
+        source.inbox.submit(b.probe)
+        await match
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert seen == ['busy start', 'busy end', target.room_id]
+    assert b.room is target and source.inbox.depth == 0 and not source.inbox.paused
+
+    for uid in (9011, 9012, 9013):
+        GlobalVar.remove_player(uid)
+    target.players = [None, None, None]
+    GlobalVar.on_room_changed(target)
@@ -0,0 +1,33 @@
+import asyncio
+import threading
+
+from models.recorder import RecordWriter
+
+
+def test_overflow_spools_off_loop_and_replays_in_order(tmp_path):
+    async def run():
+        writer = RecordWriter(str(tmp_path / 'record.spool'), batch_size=100, max_pending=3)
+        threads, inserted = [], []
+        spool = writer._spool
+
+        def record_thread(rows):
+            threads.append(threading.current_thread())
+            spool(rows)
+
+        async def execute(rows):
+            inserted.extend(row['robot'] for row in rows)
+
+        writer._spool = record_thread
+        writer._execute = execute
+        for i in range(7):
+            writer.append({'round': [], 'lord': 0}, i)
+        # 超过 max_pending 的两批交给落盘线程, 内存里只剩一条
+        assert writer.stats()['pending'] == 1
+        await writer.close()
+        assert threads and threading.main_thread() not in threads
+        assert writer.stats() == {'pending': 0, 'written': 1, 'spooled': 6}
+
+        assert await writer.replay()
+        assert inserted == [6, 0, 1, 2, 3, 4, 5]
+
+    asyncio.run(run())
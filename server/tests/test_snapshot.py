@@ -0,0 +1,82 @@
+import asyncio
+import os
+import time
+
+import orjson
+
+from api.game.components.simple import RobotPlayer
+from api.game.globalvar import GlobalVar
+from api.game.player import Player, State
+from api.game.room import Room
+from api.game.snapshot import VERSION, Snapshot
+
+
+def playing_room(room_id: int, uid: int) -> Room:
+    room = Room(room_id, 1, True)
+    room.players = [Player(uid, f'p{uid}'), RobotPlayer(uid + 1, 'r1', 1, '', room),
+                    RobotPlayer(uid + 2, 'r2', 1, '', room)]
+    for seat, player in enumerate(room.players):
+        player.room = room
+        player.seat = seat
+        player.state = State.PLAYING
+        player.push_pokers(list(range(seat * 17 + 1, seat * 17 + 18)))
+    room.whose_turn = 0
+    return room
+
+
+def test_restore_without_timer_uses_full_timeout():
+    async def run():
+        data = orjson.loads(orjson.dumps(playing_room(-21, 9201).snapshot()))
+        data['timer'] = -1
+        room = Snapshot.restore_room(data)
+        try:
+            # 真人玩家恢复后按离开处理, 倒计时和 start_timing 一样翻倍
+            assert room.turn_player.is_left()
+            assert room.timer.timeout == room.turn_player.timeout * 2
+        finally:
+            GlobalVar.detach_room(room)
+
+    asyncio.run(run())
+
+
+def test_chunked_save_and_shutdown(tmp_path):
+    path = str(tmp_path / 'snapshot.json')
+
+    async def run():
+        rooms = [playing_room(-31 - i, 9301 + i * 10) for i in range(5)]
+        hands = [room.players[0].hand_pokers for room in rooms]
+        for room in rooms:
+            GlobalVar.restore_room(room)
+
+        parts = await Snapshot.dump_async(chunk=2)
+        assert sorted(orjson.loads(part)['id'] for part in parts) == sorted(room.room_id for room in rooms)
+
+        await Snapshot.save_async(path)
+        with open(path, 'rb') as f:
+            assert len(orjson.loads(f.read())['rooms']) == 5
+
+        # 停服时导出的房间从本进程删除
+        assert await Snapshot.shutdown(path) == 5
+        assert all(GlobalVar.get_room(room.room_id) is None for room in rooms)
+        assert all(room.inbox.submit(lambda: None) is False for room in rooms)
+
+        assert Snapshot.load(path) == 5
+        restored = [GlobalVar.get_room(room.room_id) for room in rooms]
+        assert [room.players[0].hand_pokers for room in restored] == hands
+        for room in restored:
+            GlobalVar.detach_room(room)
+        assert not os.path.exists(path)
+
+    asyncio.run(run())
+
+
+def test_load_keeps_unsupported_snapshot(tmp_path):
+    path = str(tmp_path / 'snapshot.json')
+    with open(path, 'wb') as f:
+        f.write(orjson.dumps({'version': VERSION + 1, 'time': time.time(), 'rooms': []}))
+
+    # 其他版本写的快照不删除, 改名留下
+    assert Snapshot.load(path) == 0
+    assert not os.path.exists(path)
+    with open(f'{path}.v{VERSION + 1}', 'rb') as f:
+        assert orjson.loads(f.read())['version'] == VERSION + 1
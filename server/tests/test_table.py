@@ -0,0 +1,67 @@
+import json
+import os
+
+from api.game import hand
+from api.game.table import RuleTable, compile_file, load_table
+from config import STATIC_ROOT
+
+RULES = {
+    'single': ['3', '4', '5', 'A', '2', 'w', 'W'],
+    'pair': ['33', '44', 'AA', '22'],
+    'bomb': ['3333', '2222'],
+    'rocket': ['wW'],
+}
+
+
+def write_rules(path, rules):
+    with open(path, 'w') as f:
+        json.dump(rules, f)
+
+
+def assert_same(table: RuleTable, rules):
+    expected = RuleTable.from_json(rules)
+    assert list(table.specs) == list(expected.specs)
+    assert table.sizes == expected.sizes
+    for name, specs in expected.specs.items():
+        assert list(table.specs[name]) == list(specs)
+        for key in specs:
+            assert table.index.get(key) == expected.index[key]
+    assert table.index.get(hand.from_cards('34')) is None
+
+
+def test_compiled_table_round_trip(tmp_path):
+    json_path, bin_path = str(tmp_path / 'rule.json'), str(tmp_path / 'rule.bin')
+    write_rules(json_path, RULES)
+    compile_file(json_path, bin_path)
+
+    table = load_table(json_path, bin_path)
+    assert table._buffer is not None
+    assert_same(table, RULES)
+
+
+def test_stale_table_falls_back_to_json(tmp_path):
+    json_path, bin_path = str(tmp_path / 'rule.json'), str(tmp_path / 'rule.bin')
+    write_rules(json_path, RULES)
+    compile_file(json_path, bin_path)
+
+    # rule.json 改动后 rule.bin 的摘要对不上, 改为解析 rule.json
+    rules = dict(RULES, pair=['33', '44', 'KK', 'AA', '22'])
+    write_rules(json_path, rules)
+    table = load_table(json_path, bin_path)
+    assert table._buffer is None
+    assert_same(table, rules)
+
+    # 规则表缺失或损坏同样回退
+    with open(bin_path, 'wb') as f:
+        f.write(b'\0' * 128)
+    assert load_table(json_path, bin_path)._buffer is None
+    os.remove(bin_path)
+    assert_same(load_table(json_path, bin_path), rules)
+
+
+def test_shipped_table_matches_json():
+    json_path = os.path.join(STATIC_ROOT, 'rule.json')
+    table = load_table(json_path, os.path.join(STATIC_ROOT, 'rule.bin'))
+    assert table._buffer is not None
+    with open(json_path) as f:
+        assert_same(table, json.load(f))
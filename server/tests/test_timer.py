@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from api.game import timer
+from api.game.timer import Scheduler, Timer
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = Scheduler()
+    monkeypatch.setattr(timer, 'scheduler', scheduler)
+    return scheduler
+
+
+def test_order_and_cancel(scheduler):
+    async def run():
+        fired = []
+        scheduler.call_later(0.03, fired.append, 'c')
+        scheduler.call_later(0.01, fired.append, 'a')
+        # 同一时间到期的按加入顺序
+        b1 = scheduler.call_later(0.02, fired.append, 'b1')
+        scheduler.call_later(0.02, fired.append, 'b2')
+        cancelled = scheduler.call_later(0.005, fired.append, 'x')
+        cancelled.cancel()
+        cancelled.cancel()
+        assert scheduler.pending == 4
+
+        await asyncio.sleep(0.05)
+        assert fired == ['a', 'b1', 'b2', 'c']
+        assert scheduler.pending == 0
+        # 已触发的再 cancel 不影响计数
+        b1.cancel()
+        assert scheduler.pending == 0
+        assert scheduler.stats()['max_lag'] >= 0
+
+    asyncio.run(run())
+
+
+def test_earlier_deadline_rearms(scheduler):
+    async def run():
+        fired = []
+        scheduler.call_later(10, fired.append, 'late')
+        scheduler.call_later(0.01, fired.append, 'early')
+        await asyncio.sleep(0.03)
+        assert fired == ['early'] and scheduler.pending == 1
+
+    asyncio.run(run())
+
+
+def test_compaction(scheduler):
+    async def run():
+        handles = [scheduler.call_later(10 + i, lambda: None) for i in range(100)]
+        for handle in handles[:70]:
+            handle.cancel()
+        # 取消的超过 64 个且超过一半时重建堆, 第 65 个取消后堆里剩 35 个
+        assert len(scheduler._heap) == 35 and scheduler.pending == 30
+
+    asyncio.run(run())
+
+
+def test_timer_reschedule(scheduler):
+    async def run():
+        fired = []
+        t = Timer(lambda: fired.append(1))
+        t.start_timing(0.01)
+        t.start_timing(0.02)
+        # 重新计时取消原来的定时器, 倒计时按两倍计
+        assert scheduler.pending == 1 and t.timeout == 0.04
+        await asyncio.sleep(0.06)
+        assert fired == [1] and not t.is_running
+
+        t.start_timing(0.01)
+        t.stop_timing()
+        assert not t.is_running and scheduler.pending == 0
+        await asyncio.sleep(0.03)
+        assert fired == [1]
+
+        t.resume(0.01)
+        await asyncio.sleep(0.03)
+        assert fired == [1, 1]
+
+    asyncio.run(run())
+
+
+def test_cancel_after_deadline_before_callback(scheduler):
+    async def run():
+        fired = []
+        handle = scheduler.call_later(-1, fired.append, 'stale')
+        # 到期出堆, 回调已排队但还没执行
+        scheduler._on_tick()
+        handle.cancel()
+        await asyncio.sleep(0.01)
+        assert fired == [] and scheduler.pending == 0
+
+        # 出牌在超时回调执行前开始了下一轮倒计时
+        t = Timer(lambda: fired.append('timeout'))
+        t.start_timing(-1)
+        scheduler._on_tick()
+        t.start_timing(10)
+        await asyncio.sleep(0.01)
+        assert fired == [] and t.is_running and scheduler.pending == 1
+        t.stop_timing()
+
+    asyncio.run(run())
@@ -0,0 +1,104 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from models.usercache import UserCache
+
+
+class FakeTable(object):
+    """
+    按 openid 唯一的用户表, 记录查询次数
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.loads = 0
+
+    async def load(self, where):
+        self.loads += 1
+        await asyncio.sleep(0)
+        field = 'uid' if where.left.key == 'id' else where.left.key
+        for row in self.rows.values():
+            if row[field] == where.right.value:
+                return {key: row[key] for key in ('uid', 'name', 'sex', 'avatar')}, row['openid']
+        return None
+
+    @asynccontextmanager
+    async def begin(self):
+        yield self
+
+    async def execute(self, stmt):
+        values, update_fields = stmt
+        row = self.rows.get(values['openid'])
+        if row is None:
+            self.rows[values['openid']] = dict(values, uid=len(self.rows) + 1)
+        else:
+            row.update({field: values[field] for field in update_fields})
+
+
+def fake_cache(monkeypatch, **kwargs):
+    table = FakeTable()
+    cache = UserCache(**kwargs)
+    monkeypatch.setattr(cache, '_load', table.load)
+    monkeypatch.setattr('models.usercache.engine', table)
+    monkeypatch.setattr('models.usercache.upsert_stmt', lambda values, update_fields: (values, update_fields))
+    return cache, table
+
+
+def test_hit_and_miss(monkeypatch):
+    async def run():
+        cache, table = fake_cache(monkeypatch)
+        table.rows['o1'] = {'uid': 1, 'name': 'a', 'sex': 1, 'avatar': '', 'openid': 'o1'}
+
+        # 同一个 key 并发未命中只查一次
+        users = await asyncio.gather(*[cache.get_by_uid(1) for _ in range(3)])
+        assert users == [{'uid': 1, 'name': 'a', 'sex': 1, 'avatar': ''}] * 3
+        assert table.loads == 1
+
+        # uid 查到后 name、openid 也命中
+        assert (await cache.get_by_name('a'))['uid'] == 1
+        assert (await cache.get_by_openid('o1'))['uid'] == 1
+        assert table.loads == 1
+
+        # 不存在的用户记住一段时间
+        assert await cache.get_by_uid(2) is None
+        assert await cache.get_by_uid(2) is None
+        assert table.loads == 2
+        assert cache.stats() == {'size': 1, 'missing': 1, 'hits': 3, 'misses': 4, 'hit_rate': 3 / 7}
+
+    asyncio.run(run())
+
+
+def test_expired_entries_reload(monkeypatch):
+    async def run():
+        cache, table = fake_cache(monkeypatch, ttl=0, negative_ttl=0)
+        table.rows['o1'] = {'uid': 1, 'name': 'a', 'sex': 1, 'avatar': '', 'openid': 'o1'}
+        await cache.get_by_uid(1)
+        await cache.get_by_uid(1)
+        await cache.get_by_uid(2)
+        await cache.get_by_uid(2)
+        assert table.loads == 4
+
+    asyncio.run(run())
+
+
+def test_upsert_invalidates(monkeypatch):
+    async def run():
+        cache, table = fake_cache(monkeypatch)
+        assert await cache.get_by_openid('o1') is None
+
+        # 新用户写入后不再返回缓存的 "不存在"
+        user = await cache.upsert('o1', 'a', 1, '')
+        assert user == {'uid': 1, 'name': 'a', 'sex': 1, 'avatar': ''}
+        assert await cache.get_by_uid(1) is user
+
+        # 改名后旧的缓存失效, 旧名字查不到
+        loads = table.loads
+        assert (await cache.upsert('o1', 'b', 2, 'x'))['name'] == 'b'
+        assert table.loads == loads + 1
+        assert (await cache.get_by_uid(1))['name'] == 'b'
+        assert await cache.get_by_name('a') is None
+
+        # update 为 False 时保留原来的信息
+        assert (await cache.upsert('o1', 'c', 1, '', update=False))['name'] == 'b'
+
+    asyncio.run(run())
@@ -0,0 +1,41 @@
+from api.game.worker import Worker
+
+
+def test_forwarded_token():
+    token = Worker.sign_forwarded(42)
+    assert Worker.is_forwarded(token, 42)
+    # 客户端自己带的值、其他用户的签名都不能绕过路由
+    assert not Worker.is_forwarded('1', 42)
+    assert not Worker.is_forwarded(token, 43)
+    assert not Worker.is_forwarded(None, 42)
+
+
+def test_shared_levels(monkeypatch):
+    import multiprocessing
+
+    from api.game.globalvar import GlobalVar
+    from api.game.worker import MAX_LEVEL
+
+    monkeypatch.setattr(Worker, 'count', 3)
+    monkeypatch.setattr(Worker, 'levels', multiprocessing.Array('i', 3 * MAX_LEVEL, lock=False))
+    monkeypatch.setattr(GlobalVar, '__level_players__', {1: 0, 2: 0, 3: 0})
+    monkeypatch.setattr('api.game.globalvar.cluster.remote_levels', lambda: {})
+
+    for index, levels in enumerate(({1: 2, 2: 1}, {1: 4, 3: 3}, {1: 1})):
+        monkeypatch.setattr(Worker, 'index', index)
+        Worker.publish_levels(levels)
+
+    monkeypatch.setattr(Worker, 'index', 0)
+    assert Worker.remote_levels() == {1: 5, 3: 3}
+
+    GlobalVar.invalidate_room_list()
+    rooms = {room['level']: room['number'] for room in GlobalVar.room_list()}
+    assert rooms == {1: 5 + GlobalVar.LOBBY_OFFSET[1], 2: 0, 3: 3}
+
+    # 其他 worker 的人数变化后大厅列表重新生成
+    monkeypatch.setattr(Worker, 'index', 2)
+    Worker.publish_levels({1: 0, 2: 6})
+    monkeypatch.setattr(Worker, 'index', 0)
+    rooms = {room['level']: room['number'] for room in GlobalVar.room_list()}
+    assert rooms == {1: 4 + GlobalVar.LOBBY_OFFSET[1], 2: 6, 3: 3}
+    GlobalVar.invalidate_room_list()
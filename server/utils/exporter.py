@@ -0,0 +1,147 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from typing import Any, Dict, Optional, TextIO
+
+from sqlalchemy import select
+
+from api.game.rule import rule
+from config import BASE_DIR
+from models import Record, gamelog
+from models.base import engine
+
+'''
+牌局记录导出与统计
+
+    python -m utils.exporter                        统计上次之后新增的记录, 输出累计结果
+    python -m utils.exporter --rows games.jsonl     同时把每局的结果逐行写到 games.jsonl
+    python -m utils.exporter --reset                忽略检查点, 从头统计
+
+按 id 分页, 每页用服务端游标逐行读取, 内存占用与表大小无关
+每页处理完后把最后的 id 和累计结果写入检查点
+'''
+
+BOMBS = ('bomb', 'rocket')
+
+
+class GameStats(object):
+
+    def __init__(self, state: Optional[Dict[str, Any]] = None):
+        state = state or {}
+        self.games = state.get('games', 0)
+        self.landlord_wins = state.get('landlord_wins', 0)
+        self.spring = state.get('spring', 0)
+        self.anti_spring = state.get('anti_spring', 0)
+        self.bombs = state.get('bombs', 0)
+        self.bomb_games = state.get('bomb_games', 0)
+        self.skipped = state.get('skipped', 0)
+        # robot 字段只记录了房间里是否有机器人
+        self.by_robot = state.get('by_robot', {'robot': [0, 0], 'human': [0, 0]})
+
+    def update(self, game: Dict[str, Any], robot: int) -> Dict[str, Any]:
+        lord = game['lord']
+        rounds = game['round']
+        landlord_win = not game['left'][lord]
+        spring = landlord_win and not any(pokers for i, pokers in enumerate(rounds) if i % 3)
+        anti_spring = not landlord_win and not any(pokers for i, pokers in enumerate(rounds) if i and i % 3 == 0)
+        bombs = sum(1 for pokers in rounds if pokers and rule.get_poker_spec(pokers) in BOMBS)
+
+        self.games += 1
+        self.landlord_wins += landlord_win
+        self.spring += spring
+        self.anti_spring += anti_spring
+        self.bombs += bombs
+        self.bomb_games += bombs > 0
+        outcome = self.by_robot['robot' if robot else 'human']
+        outcome[0] += 1
+        outcome[1] += landlord_win
+        return {'landlord_win': landlord_win, 'spring': spring, 'anti_spring': anti_spring, 'bombs': bombs}
+
+    def state(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+    def report(self) -> Dict[str, Any]:
+        games = self.games or 1
+        return {
+            **self.state(),
+            'landlord_win_rate': self.landlord_wins / games,
+            'spring_rate': self.spring / games,
+            'anti_spring_rate': self.anti_spring / games,
+            'bombs_per_game': self.bombs / games,
+            'bomb_game_rate': self.bomb_games / games,
+            'landlord_win_rate_by_robot': {
+                key: wins / count if count else 0.0 for key, (count, wins) in self.by_robot.items()
+            },
+        }
+
+
+def load_checkpoint(path: str) -> Dict[str, Any]:
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {'last_id': 0, 'stats': {}}
+
+
+def save_checkpoint(path: str, last_id: int, stats: GameStats):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'last_id': last_id, 'stats': stats.state()}, f)
+    os.replace(tmp, path)
+
+
+async def export(checkpoint: str, batch_size: int, rows_out: Optional[TextIO], reset: bool = False) -> GameStats:
+    state = {'last_id': 0, 'stats': {}} if reset else load_checkpoint(checkpoint)
+    last_id, stats = state['last_id'], GameStats(state['stats'])
+    while True:
+        stmt = (select(Record.id, Record.log, Record.round, Record.robot)
+                .where(Record.id > last_id)
+                .order_by(Record.id)
+                .limit(batch_size))
+        count = 0
+        async with engine.connect() as conn:
+            result = await conn.stream(stmt.execution_options(yield_per=min(batch_size, 500)))
+            async for row in result:
+                count += 1
+                last_id = row.id
+                try:
+                    game = gamelog.decode(row.log) if row.log else row.round
+                    game['left'] = {int(seat): pokers for seat, pokers in game['left'].items()}
+                except (gamelog.GameLogError, KeyError, TypeError, AttributeError):
+                    stats.skipped += 1
+                    continue
+                outcome = stats.update(game, row.robot)
+                if rows_out:
+                    rows_out.write(json.dumps({'id': row.id, 'robot': row.robot, 'lord': game['lord'], **outcome}))
+                    rows_out.write('\n')
+        if count == 0:
+            break
+        save_checkpoint(checkpoint, last_id, stats)
+    await engine.dispose()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m utils.exporter', description='export and aggregate game records')
+    parser.add_argument('--checkpoint', default=os.path.join(BASE_DIR, 'export.checkpoint.json'))
+    parser.add_argument('--batch', type=int, default=1000)
+    parser.add_argument('--rows', help='write one JSON line per game to this file, - for stdout')
+    parser.add_argument('--reset', action='store_true', help='ignore the checkpoint and start from the first record')
+    args = parser.parse_args()
+
+    rows_out = None
+    if args.rows:
+        rows_out = sys.stdout if args.rows == '-' else open(args.rows, 'a')
+    try:
+        stats = asyncio.run(export(args.checkpoint, args.batch, rows_out, args.reset))
+    finally:
+        if rows_out and rows_out is not sys.stdout:
+            rows_out.close()
+    out = sys.stderr if rows_out is sys.stdout else sys.stdout
+    json.dump(stats.report(), out, indent=2)
+    out.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -16,6 +16,7 @@
 # 14) 四带二对：一个四张带上两对，例如 J-J-J-J-9-9-Q-Q
 
 # ♠ ♡ ♢ ♣
+import os
 from collections import OrderedDict
 from itertools import combinations
 from typing import Dict, List
@@ -139,9 +140,22 @@ def generate():
 
 
 def main():
+    """
+    python -m utils.generator           生成 rule.json 和 rule.bin
+    python -m utils.generator compile   由 static/rule.json 编译 static/rule.bin
+    """
     import json
+    import sys
+    from api.game.table import compile_file
+    from config import STATIC_ROOT
+
+    if sys.argv[1:] == ['compile']:
+        compile_file(os.path.join(STATIC_ROOT, 'rule.json'), os.path.join(STATIC_ROOT, 'rule.bin'))
+        return
+
     with open('rule.json', 'w') as out:
         json.dump(generate(), out, indent=4)
+    compile_file('rule.json', 'rule.bin')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,112 @@
+import atexit
+import logging
+import logging.config
+import os
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+'''
+日志先放进有界队列, 由后台线程写到 config.LOGGING 里配置的 handler, IOLoop 不会阻塞在 stdout 上
+队列满时丢弃日志并计数
+
+热点日志按分类采样, 在创建 LogRecord 之前判断:
+
+    if sampled(logger):
+        logger.info('REQ[%d]: %s', uid, message)
+'''
+
+SAMPLING: Dict[str, float] = {}
+
+
+class DropQueueHandler(QueueHandler):
+    """
+    只在调用线程里把参数拼进消息(参数可能是之后会被修改的列表), 格式化交给后台线程
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+listener: Optional[QueueListener] = None
+
+
+def setup_logging(config: dict, sampling: Optional[Dict[str, float]] = None, queue_size: int = 10000):
+    """
+    按 config 创建 handler, 再把 root 的 handler 换成队列
+    """
+    global listener
+    logging.config.dictConfig(config)
+    SAMPLING.update(sampling or {})
+    if listener:
+        return
+
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    handler = DropQueueHandler(queue.Queue(queue_size))
+    for h in handlers:
+        root.removeHandler(h)
+    root.addHandler(handler)
+
+    listener = QueueListener(handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_logging)
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def _restart_after_fork():
+    """
+    fork 出的子进程里没有后台线程, 换一个新队列重新启动
+    """
+    global listener
+    if not listener:
+        return
+    handler = next(h for h in logging.getLogger().handlers if isinstance(h, DropQueueHandler))
+    handler.queue = queue.Queue(handler.queue.maxsize)
+    listener = QueueListener(handler.queue, *listener.handlers, respect_handler_level=True)
+    listener.start()
+
+
+def stop_logging():
+    """
+    写完队列里剩余的日志
+    """
+    global listener
+    if listener:
+        listener.stop()
+        listener = None
+
+
+def sampled(logger: logging.Logger, level: int = logging.INFO) -> bool:
+    if not logger.isEnabledFor(level):
+        return False
+    rate = SAMPLING.get(logger.name, 1.0)
+    return rate >= 1.0 or random.random() < rate
+
+
+def parse_sampling(value: str) -> Dict[str, float]:
+    """
+    'ddz.req=0.01,ddz.rsp=0' -> {'ddz.req': 0.01, 'ddz.rsp': 0.0}
+    """
+    rates = {}
+    for item in value.split(','):
+        if '=' in item:
+            name, rate = item.split('=', 1)
+            rates[name.strip()] = float(rate)
+    return rates